@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from functools import partial
+from app.config import settings
+from app.logger import logger
+
+
+class ServiceBusyError(Exception):
+    """
+    Raised when blocking work cannot be queued because the service is at capacity.
+    The application turns this into a 503 response with a Retry-After header.
+    """
+
+
+executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Get the shared executor for blocking work (model inference, rasterio I/O, OpenCV).
+    """
+    global executor
+    with _executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=settings.executor_pool_size, thread_name_prefix="blocking-worker")
+            logger.info(f"Started blocking-work executor with {settings.executor_pool_size} workers")
+        return executor
+
+
+def shutdown_executor():
+    """
+    Shut down the shared executor, waiting for running work to finish.
+    """
+    global executor
+    with _executor_lock:
+        if executor is not None:
+            executor.shutdown(wait=True)
+            executor = None
+
+
+process_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Get the shared process pool for CPU-bound analysis that holds the GIL (e.g. pysal).
+    Workers are spawned rather than forked, so they never inherit the model or threads.
+    """
+    global process_pool
+    with _executor_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(max_workers=settings.process_pool_size, mp_context=get_context("spawn"))
+            logger.info(f"Started analysis process pool with {settings.process_pool_size} workers")
+        return process_pool
+
+
+def shutdown_process_pool():
+    """
+    Shut down the shared process pool, waiting for running work to finish.
+    """
+    global process_pool
+    with _executor_lock:
+        if process_pool is not None:
+            process_pool.shutdown(wait=True)
+            process_pool = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function on the shared executor without blocking the event loop.
+
+    At most `settings.executor_max_pending` calls may be running or queued at once;
+    beyond that, ServiceBusyError is raised immediately instead of queueing.
+    """
+    global _pending
+    with _executor_lock:
+        if _pending >= settings.executor_max_pending:
+            raise ServiceBusyError(f"Too many pending jobs ({_pending}), try again later")
+        _pending += 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+    finally:
+        with _executor_lock:
+            _pending -= 1
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 class Settings(BaseSettings):
     app_name: str = "My FastAPI App"
@@ -44,13 +44,82 @@ class Settings(BaseSettings):
     epochs: int = 100
     batch_size: int = 16
     img_size: int = 640
+    warmup_iterations: int = 3  # Dummy inferences run at startup before the app reports ready
+    model_registry_watch: bool = True  # Hot-reload new trained weights without a restart
+    model_registry_poll_seconds: float = 30.0  # How often to look for new weights
     project_name: str = "yolo_training"
     run_name: str = "exp"
     data_config: str = "data/data.yaml"
 
+    # Inference backend settings
+    inference_backend: str = "pytorch"  # One of "pytorch", "onnx", "onnx_int8" or "openvino"
+    quantization_calibration_dir: str = "data/valid/images"  # Images used to calibrate INT8 activation ranges
+    quantization_calibration_samples: int = 100  # Number of calibration images sampled from that directory
+
+    # Tiled inference settings
+    tile_size: Optional[int] = None  # Tile edge length in pixels; defaults to img_size, so tiles are not downscaled
+    tile_overlap: int = 128  # Overlap between neighbouring tiles in pixels
+    tile_nms_iou_threshold: float = 0.5  # IoU above which boxes across tile seams are merged
+
+    # Prediction batching settings
+    batching_enabled: bool = False  # Group concurrent predict calls into one forward pass
+    batch_max_size: int = 8  # Maximum number of images per batched forward pass
+    batch_max_wait_ms: float = 10.0  # Maximum time the first request waits for a batch to fill
+    batch_queue_depth: int = 64  # Maximum number of pending requests before new ones are rejected
+    batch_max_file_bytes: int = 100 * 1024 * 1024  # Largest image or GeoTIFF in a /predict/batch request, uncompressed
+    batch_max_total_bytes: int = 2 * 1024 * 1024 * 1024  # Largest /predict/batch request, all files uncompressed
+
+    # Blocking work executor settings
+    executor_pool_size: int = 4  # Worker threads for inference, rasterio I/O and OpenCV work
+    executor_max_pending: int = 32  # Running plus queued jobs before requests are rejected with 503
+    process_pool_size: int = 4  # Worker processes for CPU-bound analysis, e.g. parallel trackway statistics
+    raster_cache_max_datasets: int = 8  # Open rasterio datasets kept for repeated sampling, e.g. the habitat map
+    raster_block_workers: int = 1  # Threads reading blocks for whole-raster statistics such as habitat areas
+    raster_stats_cache_max_entries: int = 32  # Cached whole-raster statistics, invalidated when the raster changes
+    retry_after_seconds: int = 5  # Retry-After header value on 503 responses
+
+    # Inference worker pool settings
+    inference_pool_enabled: bool = False  # Dispatch inference to the worker pool instead of an in-process model
+    inference_pool_workers: int = 2  # Number of worker processes, each pinned to a slice of the CPU cores
+    inference_pool_address: str = "127.0.0.1:50055"  # Local address the pool server listens on
+    inference_pool_authkey: Optional[str] = None  # Shared secret between the pool server and API processes; required to use the pool
+    inference_pool_timeout: float = 60.0  # Seconds to wait for a result from the pool
+
+    # Detection store settings
+    detection_store_backend: str = "parquet"  # "parquet" for partitioned files or "sqlite" for the indexed database
+    detections_dir: str = "detections"  # Root of the date-partitioned Parquet detection store
+    detection_db_path: str = "detections/detections.db"  # SQLite database used by the "sqlite" backend
+    detection_grid_cell_size: float = 100.0  # Width of the spatial index grid cells, in detection coordinates
+    detections_page_size: int = 1000  # Default page size of the detection query API
+    detections_page_max: int = 10000  # Largest page a client may request
+    detection_write_behind: bool = True  # Buffer detections in memory and write them from a background thread
+    detection_flush_rows: int = 1000  # Buffered rows that trigger a flush
+    detection_flush_interval: float = 5.0  # Maximum seconds a detection stays buffered
+    detection_buffer_max_rows: int = 100_000  # Rows kept while flushes fail; the oldest beyond this are dropped
+    detection_compaction_min_files: int = 16  # Small files in a date partition that are merged into one
+    detection_compaction_min_age: float = 600.0  # Seconds a file is left alone before it can be merged
+    detection_compaction_target_bytes: int = 64 * 1024 * 1024  # Files this large are not merged again
+
+    # Trackway analysis settings
+    trackway_cluster_eps: float = 50.0  # DBSCAN neighbourhood radius, in detection coordinates
+    trackway_cluster_min_samples: int = 5  # DBSCAN minimum points per trackway cluster
+    trackway_cluster_time_eps: Optional[float] = 3600.0  # ST-DBSCAN temporal radius in seconds; None clusters on space only
+    trackway_cluster_chunk_size: int = 1_000_000  # Points per time-sorted chunk of batch ST-DBSCAN, bounds its memory
+    trackway_cluster_n_jobs: int = 1  # Threads for the KD-tree neighbour queries of batch ST-DBSCAN (-1 for all cores)
+    trackway_image_cluster_eps: float = 0.1  # DBSCAN radius for deer detected in a single image, in image or map units
+    trackway_image_cluster_min_samples: int = 3
+    trackway_cache_enabled: bool = True  # Memoize analyze_trackways until the detections in range change
+    trackway_cache_max_entries: int = 128
+    trackway_cache_max_bytes: int = 256 * 1024 * 1024
+    trackway_engine_max_engines: int = 16  # Queries whose trackway clusters are kept and updated incrementally
+    trackway_engine_max_bytes: int = 512 * 1024 * 1024  # Estimated memory of the kept trackway clusters
+    trackway_parallel_enabled: bool = False  # Compute per-trackway habitat and Moran's I across the process pool
+    trackway_parallel_min_trackways: int = 16  # Fewer accepted trackways than this are analyzed serially
+
     # Habitat Classification settings
     habitat_map_path: str = "data/gis/habitat_map.tif"
     degradation_map_path: str = "data/gis/degradation_map.tif"
+    trackway_buffer_distance: float = 25.0  # Buffer around trackway paths for zonal statistics, in map units
     habitat_model: str = "yolov8n-cls.pt"
     habitat_model_path: str = "yolov8n-cls.pt"
     habitat_epochs: int = 50
@@ -0,0 +1,274 @@
+"""
+SQLite backend for the detection store.
+
+Detections go into a single table indexed on timestamp, filename and a spatial
+grid cell, so date range and bounding-box queries are index lookups instead of
+scans. Timestamps are stored as integer microseconds since the epoch, and grid cells
+are `detection_grid_cell_size` units wide in detection coordinates. Enable it with
+`detection_store_backend = "sqlite"`.
+"""
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+
+COLUMNS = ["timestamp", "filename", "x_center", "y_center", "score", "label"]
+
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS detections (
+        id INTEGER PRIMARY KEY,
+        timestamp INTEGER NOT NULL,
+        filename TEXT,
+        x_center REAL,
+        y_center REAL,
+        score REAL,
+        label TEXT,
+        cell_x INTEGER,
+        cell_y INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_filename ON detections (filename)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_cell ON detections (cell_x, cell_y, timestamp)",
+]
+
+
+# Column and ordering fragments queries are assembled from; anything else is rejected
+_COLUMN_SQL = {name: name for name in ["id"] + COLUMNS}
+_ORDER_SQL = {"timestamp": "timestamp", "timestamp_id": "timestamp, id", "id": "id"}
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _initialize(db_path: str):
+    """
+    Create the schema and switch the database to WAL, once per database in this process.
+    WAL is a persistent setting of the database file, so later connections inherit it.
+    """
+    key = os.path.abspath(db_path)
+    with _init_lock:
+        if key in _initialized and os.path.exists(key):
+            return
+        if os.path.dirname(key):
+            os.makedirs(os.path.dirname(key), exist_ok=True)
+        connection = sqlite3.connect(key, timeout=30)
+        try:
+            # WAL lets readers run while a writer from another worker process is committing
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                for statement in SCHEMA_STATEMENTS:
+                    connection.execute(statement)
+        finally:
+            connection.close()
+        _initialized.add(key)
+
+
+def _connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    db_path = db_path or settings.detection_db_path
+    _initialize(db_path)
+    return sqlite3.connect(db_path, timeout=30)
+
+
+def _select(columns: Sequence[str], conditions: Sequence[str] = (), order_by: Optional[str] = None, limit: bool = False) -> str:
+    """
+    Assemble a SELECT on the detections table from constant fragments: whitelisted column
+    names, the conditions of _filter_conditions and an ordering. Values are always bound
+    as parameters, including the LIMIT.
+    """
+    unknown = [c for c in columns if c not in _COLUMN_SQL]
+    if unknown:
+        raise ValueError(f"Unknown detection columns: {sorted(unknown)}")
+    parts = ["SELECT", ", ".join(_COLUMN_SQL[c] for c in columns), "FROM detections"]
+    if conditions:
+        parts += ["WHERE", " AND ".join(conditions)]
+    if order_by is not None:
+        parts += ["ORDER BY", _ORDER_SQL[order_by]]
+    if limit:
+        parts.append("LIMIT ?")
+    return " ".join(parts)
+
+
+def _to_micros(timestamp) -> int:
+    return pd.Timestamp(timestamp).value // 1000
+
+
+def _cells(values, cell_size: float) -> np.ndarray:
+    return np.floor(np.asarray(values, dtype=float) / cell_size).astype(np.int64)
+
+
+def write_detections(df: pd.DataFrame, db_path: Optional[str] = None) -> int:
+    """
+    Insert detection rows in a single transaction. Returns the number of rows written.
+    """
+    if df.empty:
+        return 0
+    df = df.reindex(columns=COLUMNS)
+    cell_size = settings.detection_grid_cell_size
+    timestamps = pd.to_datetime(df["timestamp"]).to_numpy(dtype="datetime64[us]").astype(np.int64)
+    rows = zip(
+        timestamps.tolist(),
+        df["filename"].astype(object).where(df["filename"].notna(), None).tolist(),
+        df["x_center"].astype(float).tolist(),
+        df["y_center"].astype(float).tolist(),
+        df["score"].astype(float).tolist(),
+        df["label"].astype(object).where(df["label"].notna(), None).tolist(),
+        _cells(df["x_center"], cell_size).tolist(),
+        _cells(df["y_center"], cell_size).tolist(),
+    )
+    connection = _connect(db_path)
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT INTO detections (timestamp, filename, x_center, y_center, score, label, cell_x, cell_y) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+    finally:
+        connection.close()
+    return len(df)
+
+
+def _filter_conditions(start_date=None, end_date=None, bbox=None, min_score=None, label=None, filename=None):
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append("timestamp >= ?")
+        params.append(_to_micros(start_date))
+    if end_date is not None:
+        conditions.append("timestamp <= ?")
+        params.append(_to_micros(end_date))
+    if filename is not None:
+        conditions.append("filename = ?")
+        params.append(filename)
+    if label is not None:
+        conditions.append("label = ?")
+        params.append(label)
+    if min_score is not None:
+        conditions.append("score >= ?")
+        params.append(min_score)
+    if bbox is not None:
+        min_x, min_y, max_x, max_y = bbox
+        cell_size = settings.detection_grid_cell_size
+        conditions.append("cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?")
+        params.extend([int(_cells(min_x, cell_size)), int(_cells(max_x, cell_size)), int(_cells(min_y, cell_size)), int(_cells(max_y, cell_size))])
+        conditions.append("x_center BETWEEN ? AND ? AND y_center BETWEEN ? AND ?")
+        params.extend([min_x, max_x, min_y, max_y])
+    return conditions, params
+
+
+def read_detections(
+    start_date=None,
+    end_date=None,
+    columns: Optional[List[str]] = None,
+    bbox: Optional[Sequence[float]] = None,
+    filename: Optional[str] = None,
+    db_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Read detections with a timestamp between `start_date` and `end_date` (inclusive),
+    optionally within a (min_x, min_y, max_x, max_y) bounding box and for one file.
+    The bounding box is first narrowed to grid cells, which the cell index serves.
+    """
+    columns = columns or COLUMNS
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown detection columns: {sorted(unknown)}")
+    conditions, params = _filter_conditions(start_date, end_date, bbox, filename=filename)
+    query = _select(columns, conditions, order_by="timestamp" if "timestamp" in columns else None)
+
+    connection = _connect(db_path)
+    try:
+        df = pd.read_sql_query(query, connection, params=params)
+    finally:
+        connection.close()
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="us")
+    return df
+
+
+def query_detections(
+    start_date=None,
+    end_date=None,
+    bbox: Optional[Sequence[float]] = None,
+    min_score: Optional[float] = None,
+    label: Optional[str] = None,
+    filename: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    db_path: Optional[str] = None,
+) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Read one page of detections matching the filters, ordered by timestamp and row id.
+    Returns the page and the cursor of the next page, or None on the last page.
+    The SQLite cursor key is the id of the last row returned.
+    """
+    from app.detections.store import decode_cursor, encode_cursor
+
+    conditions, params = _filter_conditions(start_date, end_date, bbox, min_score, label, filename)
+    if cursor:
+        after, last_id = decode_cursor(cursor)
+        conditions.append("(timestamp > ? OR (timestamp = ? AND id > ?))")
+        params.extend([_to_micros(after), _to_micros(after), last_id])
+
+    query = _select(["id"] + COLUMNS, conditions, order_by="timestamp_id", limit=True)
+    # One extra row tells whether there is a next page
+    params.append(limit + 1)
+
+    connection = _connect(db_path)
+    try:
+        df = pd.read_sql_query(query, connection, params=params)
+    finally:
+        connection.close()
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="us")
+
+    page = df.iloc[:limit]
+    next_cursor = encode_cursor(page["timestamp"].iloc[-1], page["id"].iloc[-1]) if len(df) > limit else None
+    return page.drop(columns="id").reset_index(drop=True), next_cursor
+
+
+def data_version(start_date=None, end_date=None, db_path: Optional[str] = None) -> str:
+    """
+    Identify the stored detections in a date range, for cache invalidation.
+    Rows are only ever inserted, so the count and highest id change whenever detections
+    in the range are added.
+    """
+    db_path = db_path or settings.detection_db_path
+    conditions, params = _filter_conditions(start_date, end_date)
+    parts = ["SELECT COUNT(*), MAX(id) FROM detections"]
+    if conditions:
+        parts += ["WHERE", " AND ".join(conditions)]
+    query = " ".join(parts)
+    connection = _connect(db_path)
+    try:
+        count, max_id = connection.execute(query, params).fetchone()
+    finally:
+        connection.close()
+    return f"{os.path.abspath(db_path)}:{count}:{max_id}"
+
+
+def read_new_detections(start_date=None, end_date=None, bbox: Optional[Sequence[float]] = None, seen: Optional[int] = None, db_path: Optional[str] = None):
+    """
+    Read only the detections in range inserted since a previous call.
+    The token is the highest row id already read; see store.read_new_detections.
+    """
+    seen = seen or 0
+    conditions, params = _filter_conditions(start_date, end_date, bbox)
+    connection = _connect(db_path)
+    try:
+        max_id = connection.execute("SELECT MAX(id) FROM detections").fetchone()[0] or 0
+        if max_id < seen:
+            return pd.DataFrame(columns=COLUMNS), seen, True
+        conditions.append("id > ?")
+        params.append(seen)
+        df = pd.read_sql_query(_select(["id"] + COLUMNS, conditions, order_by="id"), connection, params=params)
+    finally:
+        connection.close()
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="us")
+    # Rows outside the range still move the token, so they are not scanned again
+    return df.drop(columns="id"), max_id, False
@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import io
+import pyarrow as pa
+from app.config import settings
+from app.logger import logger
+from .store import SCHEMA, query_detections
+
+router = APIRouter()
+
+# Rows serialized per chunk of the streamed response
+STREAM_CHUNK_ROWS = 1000
+
+
+def _parse_bbox(bbox: Optional[str]):
+    if bbox is None:
+        return None
+    try:
+        values = [float(v) for v in bbox.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != 4:
+        raise HTTPException(status_code=400, detail="bbox must be min_x,min_y,max_x,max_y")
+    return values
+
+
+def _ndjson_chunks(page):
+    for start in range(0, len(page), STREAM_CHUNK_ROWS):
+        yield page.iloc[start:start + STREAM_CHUNK_ROWS].to_json(orient="records", lines=True, date_format="iso") + "\n"
+
+
+def _arrow_chunks(page):
+    table = pa.Table.from_pandas(page, schema=SCHEMA, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, SCHEMA) as writer:
+        for batch in table.to_batches(max_chunksize=STREAM_CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    # End-of-stream marker written when the writer closes
+    yield sink.getvalue()
+
+
+@router.get("/detections", tags=["Detections"])
+def list_detections(
+    start_date: Optional[str] = Query(None, description="Earliest detection timestamp, inclusive."),
+    end_date: Optional[str] = Query(None, description="Latest detection timestamp, inclusive."),
+    bbox: Optional[str] = Query(None, description="Bounding box as min_x,min_y,max_x,max_y."),
+    min_score: Optional[float] = Query(None, ge=0, le=1),
+    label: Optional[str] = Query(None),
+    filename: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="The X-Next-Cursor header of the previous page."),
+    limit: int = Query(settings.detections_page_size, ge=1, le=settings.detections_page_max),
+    format: str = Query("ndjson", pattern="^(ndjson|arrow)$"),
+):
+    """
+    Query detections, one page at a time, ordered by timestamp.
+    The page is streamed as NDJSON or as an Arrow IPC stream. When there are more
+    results, the X-Next-Cursor response header holds the cursor of the next page.
+    """
+    bbox_values = _parse_bbox(bbox)
+    try:
+        page, next_cursor = query_detections(
+            start_date, end_date, bbox_values, min_score, label, filename, cursor, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error querying detections: {e}")
+        raise HTTPException(status_code=500, detail="Error querying detections")
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if format == "arrow":
+        return StreamingResponse(_arrow_chunks(page), media_type="application/vnd.apache.arrow.stream", headers=headers)
+    return StreamingResponse(_ndjson_chunks(page), media_type="application/x-ndjson", headers=headers)
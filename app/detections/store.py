@@ -0,0 +1,444 @@
+"""
+Date-partitioned Parquet store for deer detection points.
+With `detection_store_backend = "sqlite"`, reads and writes go to the indexed
+SQLite database in app.detections.database instead.
+
+Detections are written as `<detections_dir>/date=YYYY-MM-DD/part-*.parquet` with a
+fixed, typed schema. Readers pass a date range: partitions outside it are never
+opened, and the timestamp filter is pushed down to pyarrow, which skips row groups
+on their statistics. The cost of a query grows with the range it covers rather
+than with the whole detection history.
+
+Every write adds a file, named `part-<seq>-<id>.parquet` after the time in nanoseconds
+at which it was renamed into place. Once a partition holds enough small files, they are
+compacted into one `part-<seq>-<id>-from-<first seq>.parquet`, which stands for every
+file of the partition with a sequence number in [first seq, seq].
+"""
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional, Sequence, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from app.config import settings
+from app.logger import logger
+from app.detections import database
+
+SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us")),
+    ("filename", pa.string()),
+    ("x_center", pa.float64()),
+    ("y_center", pa.float64()),
+    ("score", pa.float64()),
+    ("label", pa.string()),
+])
+
+
+_FILE_NAME = re.compile(r"^part-(\d+)-[0-9a-f]+(?:-from-(\d+))?\.parquet$")
+
+# A file is named just before it is renamed into place, so after this many seconds no
+# file with an older sequence number can still appear
+SETTLE_SECONDS = 30
+
+
+def _empty_frame(columns: Optional[List[str]] = None) -> pd.DataFrame:
+    return SCHEMA.empty_table().to_pandas()[columns or SCHEMA.names]
+
+
+def _sequence_range(name: str) -> Tuple[int, int]:
+    """
+    The first and last sequence numbers a file stands for; files written by earlier
+    versions, named after the second they were written, sort before all others.
+    """
+    match = _FILE_NAME.match(name)
+    if match is None:
+        return 0, 0
+    last = int(match.group(1))
+    return (int(match.group(2)) if match.group(2) else last), last
+
+
+def _publish(partition_dir: str, table: pa.Table, seq: Optional[int] = None, first_seq: Optional[int] = None) -> str:
+    """
+    Write a table into a partition under a hidden name and rename it into place, so
+    readers never see a partial file. The sequence number defaults to the rename time.
+    """
+    tmp_path = os.path.join(partition_dir, f".tmp-{uuid.uuid4().hex}.parquet")
+    pq.write_table(table, tmp_path)
+    seq = time.time_ns() if seq is None else seq
+    suffix = f"-from-{first_seq:020d}" if first_seq is not None else ""
+    path = os.path.join(partition_dir, f"part-{seq:020d}-{uuid.uuid4().hex[:8]}{suffix}.parquet")
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_detections(df: pd.DataFrame, detections_dir: Optional[str] = None) -> int:
+    """
+    Write detection rows to the store, one new file per date partition they fall in.
+    Columns missing from `df` are stored as nulls. Returns the number of rows written.
+    """
+    if df.empty:
+        return 0
+    if settings.detection_store_backend == "sqlite":
+        return database.write_detections(df)
+    detections_dir = detections_dir or settings.detections_dir
+
+    df = df.reindex(columns=SCHEMA.names)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    for date, partition in df.groupby(df["timestamp"].dt.strftime("%Y-%m-%d")):
+        partition_dir = os.path.join(detections_dir, f"date={date}")
+        os.makedirs(partition_dir, exist_ok=True)
+        _publish(partition_dir, pa.Table.from_pandas(partition, schema=SCHEMA, preserve_index=False))
+        try:
+            compact_partition(partition_dir)
+        except Exception as e:
+            logger.error(f"Error compacting detections in {partition_dir}: {e}")
+    return len(df)
+
+
+def _partition_entries(partition_dir: str) -> List[Tuple[int, int, str]]:
+    """
+    List the (first seq, last seq, path) of the Parquet files of a partition, in sequence
+    order. Files already merged into a compacted file are left out: they are deleted
+    right after it is renamed into place, but may not be gone yet.
+    """
+    entries = []
+    for name in os.listdir(partition_dir):
+        if name.endswith(".parquet") and not name.startswith("."):
+            first, last = _sequence_range(name)
+            entries.append((first, last, os.path.join(partition_dir, name)))
+    compacted = [(first, last, path) for first, last, path in entries if first < last]
+    return sorted(
+        (first, last, path) for first, last, path in entries
+        if not any(c_first <= first and last <= c_last and path != c_path for c_first, c_last, c_path in compacted)
+    )
+
+
+def _partition_dirs(detections_dir: str, start=None, end=None) -> List[Tuple[str, str]]:
+    """
+    List the dates and directories of the date partitions that overlap [start, end], in date order.
+    """
+    partition_dirs = []
+    for entry in sorted(os.listdir(detections_dir)):
+        if not entry.startswith("date="):
+            continue
+        date = entry[len("date="):]
+        if start is not None and date < start.strftime("%Y-%m-%d"):
+            continue
+        if end is not None and date > end.strftime("%Y-%m-%d"):
+            continue
+        partition_dirs.append((date, os.path.join(detections_dir, entry)))
+    return partition_dirs
+
+
+def _partitions(detections_dir: str, start=None, end=None) -> List[Tuple[str, List[str]]]:
+    """
+    List the date partitions that overlap [start, end], in date order, with their Parquet files.
+    """
+    partitions = []
+    for date, partition_dir in _partition_dirs(detections_dir, start, end):
+        files = [path for _, _, path in _partition_entries(partition_dir)]
+        if files:
+            partitions.append((date, files))
+    return partitions
+
+
+def _read_files(list_files, columns: Optional[List[str]] = None, row_filter=None) -> pd.DataFrame:
+    """
+    Read the Parquet files returned by `list_files()`. Compaction may delete a file
+    between listing and reading it, in which case the files are listed again.
+    """
+    for attempt in range(3):
+        files = list_files()
+        if not files:
+            return _empty_frame(columns)
+        try:
+            return ds.dataset(files, schema=SCHEMA, format="parquet").to_table(columns=columns or SCHEMA.names, filter=row_filter).to_pandas()
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+
+
+@contextmanager
+def _compaction_lock(partition_dir: str):
+    """
+    Yield whether this process holds the partition's compaction lock, without waiting for it.
+    """
+    with open(os.path.join(partition_dir, ".compaction.lock"), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def compact_partition(partition_dir: str) -> int:
+    """
+    Merge the small files at the end of a date partition into one file once there are at
+    least `detection_compaction_min_files` of them. Returns the number of files merged.
+
+    Only files older than `detection_compaction_min_age` are merged, so incremental
+    readers have usually read them already. The merged files are a contiguous run of
+    sequence numbers, which the compacted file records in its name; readers skip its
+    inputs from the moment it appears, and the inputs are deleted afterwards. Partitions
+    already being compacted by another process are skipped.
+    """
+    with _compaction_lock(partition_dir) as locked:
+        if not locked:
+            return 0
+        cutoff = time.time_ns() - int(max(settings.detection_compaction_min_age, SETTLE_SECONDS) * 1e9)
+        run = []
+        for first, last, path in _partition_entries(partition_dir):
+            if last >= cutoff:
+                break
+            # A large file ends the run, so the merged files stay contiguous
+            run = [] if os.path.getsize(path) >= settings.detection_compaction_target_bytes else run + [(first, last, path)]
+        if len(run) < settings.detection_compaction_min_files:
+            return 0
+
+        table = ds.dataset([path for _, _, path in run], schema=SCHEMA, format="parquet").to_table()
+        _publish(partition_dir, table.sort_by("timestamp"), seq=run[-1][1], first_seq=run[0][0])
+        for _, _, path in run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Compacted {len(run)} detection files ({table.num_rows} rows) in {partition_dir}")
+        return len(run)
+
+
+def compact_detections(detections_dir: Optional[str] = None) -> int:
+    """
+    Compact every date partition of the store. Returns the number of files merged.
+    """
+    detections_dir = detections_dir or settings.detections_dir
+    if not os.path.isdir(detections_dir):
+        return 0
+    return sum(
+        compact_partition(os.path.join(detections_dir, entry))
+        for entry in sorted(os.listdir(detections_dir)) if entry.startswith("date=")
+    )
+
+
+def _partition_files(detections_dir: str, start=None, end=None) -> List[str]:
+    """
+    List the Parquet files of the date partitions that overlap [start, end].
+    """
+    return [f for _, files in _partitions(detections_dir, start, end) for f in files]
+
+
+def _row_filter(start=None, end=None, bbox: Optional[Sequence[float]] = None, min_score=None, label=None, filename=None):
+    """
+    Build a pyarrow row filter on the timestamp, bounding box, score, label and
+    filename; all bounds are inclusive.
+    """
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field("timestamp") >= start.to_pydatetime())
+    if end is not None:
+        conditions.append(ds.field("timestamp") <= end.to_pydatetime())
+    if bbox is not None:
+        min_x, min_y, max_x, max_y = bbox
+        conditions.append((ds.field("x_center") >= min_x) & (ds.field("x_center") <= max_x))
+        conditions.append((ds.field("y_center") >= min_y) & (ds.field("y_center") <= max_y))
+    if min_score is not None:
+        conditions.append(ds.field("score") >= min_score)
+    if label is not None:
+        conditions.append(ds.field("label") == label)
+    if filename is not None:
+        conditions.append(ds.field("filename") == filename)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_detections(
+    start_date=None,
+    end_date=None,
+    columns: Optional[List[str]] = None,
+    detections_dir: Optional[str] = None,
+    bbox: Optional[Sequence[float]] = None,
+) -> pd.DataFrame:
+    """
+    Read detections with a timestamp between `start_date` and `end_date` (inclusive,
+    either may be None), touching only the partitions in that range.
+    `bbox` optionally restricts them to a (min_x, min_y, max_x, max_y) box.
+    """
+    if settings.detection_store_backend == "sqlite":
+        return database.read_detections(start_date, end_date, columns, bbox=bbox)
+    detections_dir = detections_dir or settings.detections_dir
+    if not os.path.isdir(detections_dir):
+        return _empty_frame(columns)
+
+    start = pd.Timestamp(start_date) if start_date is not None else None
+    end = pd.Timestamp(end_date) if end_date is not None else None
+    df = _read_files(lambda: _partition_files(detections_dir, start, end), columns, _row_filter(start, end, bbox))
+    if "timestamp" in df.columns:
+        df = df.sort_values("timestamp", kind="stable", ignore_index=True)
+    return df
+
+
+def read_new_detections(start_date=None, end_date=None, bbox: Optional[Sequence[float]] = None, seen=None, detections_dir: Optional[str] = None):
+    """
+    Read only the detections in range that were written since a previous call.
+
+    `seen` is the token returned by the previous call (None the first time). Returns
+    the new rows, the token for the next call, and whether the store lost data the
+    caller had already seen (e.g. files were cleaned up), in which case the caller
+    should start over from a None token.
+
+    The Parquet token is a watermark: every file with a sequence number up to it has
+    been read. Files newer than the watermark may still be joined by files named a
+    moment earlier, so the few of them already read are kept in the token too. A
+    compacted file that merges files on both sides of the watermark counts as lost data.
+    """
+    if settings.detection_store_backend == "sqlite":
+        return database.read_new_detections(start_date, end_date, bbox, seen)
+    detections_dir = detections_dir or settings.detections_dir
+    watermark, recent = seen or (-1, frozenset())
+    start = pd.Timestamp(start_date) if start_date is not None else None
+    end = pd.Timestamp(end_date) if end_date is not None else None
+    # Taken before listing, so no file at or below the next watermark can appear after it
+    next_watermark = time.time_ns() - SETTLE_SECONDS * 1_000_000_000
+
+    for attempt in range(3):
+        partition_dirs = _partition_dirs(detections_dir, start, end) if os.path.isdir(detections_dir) else []
+        entries = [entry for _, partition_dir in partition_dirs for entry in _partition_entries(partition_dir)]
+        recent_seqs = [_sequence_range(os.path.basename(path))[1] for path in recent]
+        new_entries = []
+        for first, last, path in entries:
+            if last <= watermark or path in recent:
+                continue
+            if first <= watermark or any(first <= seq <= last for seq in recent_seqs):
+                return _empty_frame(), seen, True
+            new_entries.append((first, last, path))
+
+        next_recent = frozenset(path for _, last, path in entries if last > next_watermark)
+        next_seen = (max(watermark, next_watermark), next_recent)
+        if not new_entries:
+            return _empty_frame(), next_seen, False
+        try:
+            df = ds.dataset([path for _, _, path in new_entries], schema=SCHEMA, format="parquet").to_table(filter=_row_filter(start, end, bbox)).to_pandas()
+            return df, next_seen, False
+        except FileNotFoundError:
+            # Compacted since listing; list again
+            if attempt == 2:
+                raise
+
+
+def data_version(start_date=None, end_date=None, detections_dir: Optional[str] = None) -> str:
+    """
+    Identify the stored detections in a date range, for cache invalidation.
+    Stored files are never modified, only added, so the version changes exactly
+    when detections are written to a partition in the range.
+    """
+    if settings.detection_store_backend == "sqlite":
+        return database.data_version(start_date, end_date)
+    detections_dir = detections_dir or settings.detections_dir
+    digest = hashlib.sha1(os.path.abspath(detections_dir).encode())
+    if os.path.isdir(detections_dir):
+        start = pd.Timestamp(start_date) if start_date is not None else None
+        end = pd.Timestamp(end_date) if end_date is not None else None
+        for path in _partition_files(detections_dir, start, end):
+            digest.update(path.encode())
+    return digest.hexdigest()
+
+
+def encode_cursor(timestamp: pd.Timestamp, key: int) -> str:
+    """
+    Encode a pagination position: the timestamp of the last row returned and a
+    backend-specific key that orders rows sharing that timestamp.
+    """
+    return base64.urlsafe_b64encode(json.dumps([pd.Timestamp(timestamp).value // 1000, int(key)]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[pd.Timestamp, int]:
+    """
+    Decode a cursor from encode_cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        timestamp_us, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return pd.Timestamp(int(timestamp_us), unit="us"), int(key)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+SORT_COLUMNS = ["timestamp", "filename", "x_center", "y_center", "score"]
+
+
+def query_detections(
+    start_date=None,
+    end_date=None,
+    bbox: Optional[Sequence[float]] = None,
+    min_score: Optional[float] = None,
+    label: Optional[str] = None,
+    filename: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    detections_dir: Optional[str] = None,
+) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Read one page of detections matching the filters, ordered by timestamp.
+    Returns the page and the cursor of the next page, or None on the last page.
+
+    Partitions are read one date at a time, only until the page is full, so a page
+    costs about one partition of memory however long the detection history is.
+    The Parquet cursor key is the number of rows with the cursor's timestamp that
+    were already returned.
+    """
+    if settings.detection_store_backend == "sqlite":
+        return database.query_detections(start_date, end_date, bbox, min_score, label, filename, cursor, limit)
+    detections_dir = detections_dir or settings.detections_dir
+    if not os.path.isdir(detections_dir):
+        return _empty_frame(), None
+
+    start = pd.Timestamp(start_date) if start_date is not None else None
+    end = pd.Timestamp(end_date) if end_date is not None else None
+    after, skip = decode_cursor(cursor) if cursor else (None, 0)
+    if after is not None and (start is None or after > start):
+        start = after
+
+    row_filter = _row_filter(start, end, bbox, min_score, label, filename)
+    frames, collected = [], 0
+    for _, partition_dir in _partition_dirs(detections_dir, start, end):
+        frame = _read_files(lambda: [path for _, _, path in _partition_entries(partition_dir)], row_filter=row_filter)
+        frames.append(frame.sort_values(SORT_COLUMNS, kind="stable", ignore_index=True))
+        collected += len(frame)
+        # One extra row tells whether there is a next page
+        if collected > skip + limit:
+            break
+    if not frames:
+        return _empty_frame(), None
+
+    df = pd.concat(frames, ignore_index=True).iloc[skip:]
+    page = df.iloc[:limit].reset_index(drop=True)
+    if len(df) <= limit or page.empty:
+        return page, None
+
+    last = page["timestamp"].iloc[-1]
+    key = int((page["timestamp"] == last).sum()) + (skip if last == after else 0)
+    return page, encode_cursor(last, key)
+
+
+def import_csv(csv_path: str, detections_dir: Optional[str] = None) -> int:
+    """
+    Import a legacy detections CSV (timestamp, filename, x_center, y_center, score, label) into the store.
+    """
+    df = pd.read_csv(csv_path)
+    count = write_detections(df, detections_dir)
+    logger.info(f"Imported {count} detections from {csv_path}")
+    return count
@@ -0,0 +1,188 @@
+import threading
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+
+from app.config import settings
+from app.logger import logger
+from app.detections.store import write_detections
+
+
+class DetectionWriter:
+    """
+    Write-behind buffer for detection rows.
+
+    `submit` only appends to an in-memory buffer, so the predict path never waits on
+    disk. A background thread writes the buffer out in one bulk write once it holds
+    `flush_rows` rows or its oldest row is `flush_interval` seconds old. Every flush
+    writes new, uniquely named files, so several API processes can each run their own
+    writer against the same store without locking. If `max_rows` is set, at most that many
+    rows are kept while the store keeps failing; the oldest beyond it are dropped and counted.
+    """
+
+    def __init__(self, write_fn: Callable[[pd.DataFrame], int], flush_rows: int, flush_interval: float, max_rows: Optional[int] = None):
+        self.write_fn = write_fn
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.max_rows = max(self.flush_rows, max_rows) if max_rows else None
+        self._buffer = []
+        self._buffered_rows = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._flushes = 0
+        self._rows_written = 0
+        self._failed_flushes = 0
+        self._dropped_rows = 0
+        self._last_error = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="detection-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """
+        Stop the background thread and flush whatever is still buffered.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def submit(self, df: pd.DataFrame):
+        """
+        Buffer detection rows for the next flush.
+        """
+        if df.empty:
+            return
+        with self._lock:
+            self._buffer.append(df)
+            self._buffered_rows += len(df)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = self._buffered_rows >= self.flush_rows
+            dropped = self._trim()
+        if dropped:
+            logger.warning(f"Detection buffer is full ({self.max_rows} rows), dropped the oldest {dropped} rows")
+        if full:
+            self._wake.set()
+
+    def _trim(self) -> int:
+        """
+        Drop the oldest buffered rows beyond `max_rows`; called with the lock held.
+        Returns the number of rows dropped.
+        """
+        if self.max_rows is None:
+            return 0
+        overflow = self._buffered_rows - self.max_rows
+        dropped = 0
+        while overflow > dropped:
+            oldest = self._buffer[0]
+            if len(oldest) <= overflow - dropped:
+                self._buffer.pop(0)
+                dropped += len(oldest)
+            else:
+                self._buffer[0] = oldest.iloc[overflow - dropped:]
+                dropped = overflow
+        self._buffered_rows -= dropped
+        self._dropped_rows += dropped
+        return dropped
+
+    def flush(self) -> int:
+        """
+        Write all buffered rows in one bulk write. Returns the number of rows written.
+        On failure the rows are put back at the front of the buffer for the next attempt,
+        as far as `max_rows` allows.
+        """
+        with self._flush_lock:
+            with self._lock:
+                buffer, self._buffer = self._buffer, []
+                buffered_rows, self._buffered_rows = self._buffered_rows, 0
+                oldest, self._oldest = self._oldest, None
+            if not buffer:
+                return 0
+
+            try:
+                self.write_fn(pd.concat(buffer, ignore_index=True))
+            except Exception as e:
+                logger.error(f"Error flushing {buffered_rows} buffered detections: {e}")
+                with self._lock:
+                    self._buffer = buffer + self._buffer
+                    self._buffered_rows += buffered_rows
+                    self._oldest = oldest
+                    self._failed_flushes += 1
+                    self._last_error = str(e)
+                    dropped = self._trim()
+                if dropped:
+                    logger.warning(f"Detection buffer is full ({self.max_rows} rows), dropped the oldest {dropped} rows")
+                return 0
+
+            with self._lock:
+                self._flushes += 1
+                self._rows_written += buffered_rows
+            return buffered_rows
+
+    def _due(self) -> bool:
+        with self._lock:
+            if self._buffered_rows >= self.flush_rows:
+                return True
+            return self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(timeout=min(self.flush_interval, 1.0))
+            self._wake.clear()
+            if self._due():
+                self.flush()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "backlog_rows": self._buffered_rows,
+                "backlog_age_seconds": time.monotonic() - self._oldest if self._oldest is not None else 0.0,
+                "flushes": self._flushes,
+                "rows_written": self._rows_written,
+                "failed_flushes": self._failed_flushes,
+                "dropped_rows": self._dropped_rows,
+                "last_error": self._last_error,
+            }
+
+
+detection_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_detection_writer() -> DetectionWriter:
+    """
+    Get the shared detection writer, starting its flush thread on first use.
+    """
+    global detection_writer
+    with _writer_lock:
+        if detection_writer is None:
+            detection_writer = DetectionWriter(
+                write_detections,
+                flush_rows=settings.detection_flush_rows,
+                flush_interval=settings.detection_flush_interval,
+                max_rows=settings.detection_buffer_max_rows,
+            )
+        detection_writer.start()
+        return detection_writer
+
+
+def shutdown_detection_writer():
+    """
+    Flush buffered detections and stop the writer, if it was started.
+    """
+    global detection_writer
+    with _writer_lock:
+        if detection_writer is not None:
+            detection_writer.stop()
+            detection_writer = None
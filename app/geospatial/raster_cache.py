@@ -0,0 +1,114 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Tuple
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from app.config import settings
+
+
+class _OpenDataset:
+    def __init__(self, dataset, mtime: float):
+        self.dataset = dataset
+        self.mtime = mtime
+        self.lock = threading.RLock()
+        self.users = 0
+        self.evicted = False
+
+
+class RasterDatasetCache:
+    """
+    Process-wide LRU of open rasterio datasets, so hot rasters (e.g. the habitat map)
+    are not reopened and their headers re-parsed on every lookup.
+
+    A dataset is reopened when its file's modification time changes, and the least
+    recently used dataset is dropped once more than `max_datasets` are open. Dropped
+    datasets are closed as soon as no caller is still reading them. rasterio datasets
+    are not safe to read from several threads at once, so each one is handed out under
+    its own lock.
+    """
+
+    def __init__(self, max_datasets: int):
+        self.max_datasets = max_datasets
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, path: str):
+        """
+        Yield the open dataset for `path`, held exclusively until the block exits.
+        """
+        key = os.path.abspath(path)
+        mtime = os.path.getmtime(key)
+        with self._lock:
+            entry = self._datasets.get(key)
+            if entry is not None and entry.mtime != mtime:
+                self._evict(self._datasets.pop(key))
+                entry = None
+            if entry is None:
+                entry = self._datasets[key] = _OpenDataset(rasterio.open(key), mtime)
+            self._datasets.move_to_end(key)
+            while len(self._datasets) > self.max_datasets:
+                self._evict(self._datasets.popitem(last=False)[1])
+            entry.users += 1
+        try:
+            with entry.lock:
+                yield entry.dataset
+        finally:
+            with self._lock:
+                entry.users -= 1
+                if entry.evicted and entry.users == 0:
+                    entry.dataset.close()
+
+    @staticmethod
+    def _evict(entry: _OpenDataset):
+        entry.evicted = True
+        if entry.users == 0:
+            entry.dataset.close()
+
+    def clear(self):
+        with self._lock:
+            while self._datasets:
+                self._evict(self._datasets.popitem()[1])
+
+
+raster_datasets = RasterDatasetCache(settings.raster_cache_max_datasets)
+
+
+def sample_raster(path: str, xs, ys, band: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sample a raster band at arrays of world coordinates.
+
+    Coordinates are grouped by the raster's internal blocks and each block that holds
+    at least one of them is read once, through the shared dataset cache. Returns the
+    pixel values and a mask of which coordinates fall inside the raster; values
+    outside it are 0.
+    """
+    xs = np.asarray(xs, dtype=float).ravel()
+    ys = np.asarray(ys, dtype=float).ravel()
+    with raster_datasets.open(path) as src:
+        cols, rows = ~src.transform * (xs, ys)
+        rows = np.floor(rows).astype(np.int64)
+        cols = np.floor(cols).astype(np.int64)
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        values = np.zeros(len(xs), dtype=src.dtypes[band - 1])
+
+        block_height, block_width = src.block_shapes[band - 1]
+        block_rows, block_cols = rows[inside] // block_height, cols[inside] // block_width
+        blocks, block_of, block_counts = np.unique(
+            np.column_stack((block_rows, block_cols)), axis=0, return_inverse=True, return_counts=True
+        )
+        # Coordinate indices grouped by block, in the order of `blocks`
+        by_block = np.split(np.flatnonzero(inside)[np.argsort(block_of.ravel(), kind="stable")], np.cumsum(block_counts)[:-1])
+        for (block_row, block_col), in_block in zip(blocks, by_block):
+            row_off, col_off = block_row * block_height, block_col * block_width
+            window = Window(
+                col_off, row_off, min(block_width, src.width - col_off), min(block_height, src.height - row_off)
+            )
+            data = src.read(band, window=window)
+            values[in_block] = data[rows[in_block] - row_off, cols[in_block] - col_off]
+    return values, inside
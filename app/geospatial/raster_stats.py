@@ -0,0 +1,169 @@
+"""
+Whole-raster statistics computed block by block.
+
+Rasters are read in windows aligned to their internal blocks, about
+`TARGET_WINDOW_PIXELS` pixels at a time, and reduced as they are read. Memory is
+bounded by the window size, not the raster size. Windows can be split across threads,
+each with its own dataset handle, since GDAL releases the GIL while it decodes.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+# Pixels read per window; several blocks are combined when blocks are small (e.g. strips)
+TARGET_WINDOW_PIXELS = 1 << 20
+
+
+def block_windows(src, band: int = 1, target_pixels: Optional[int] = None) -> Iterator[Window]:
+    """
+    Cover a dataset with windows made of whole internal blocks, each about
+    `target_pixels` (default TARGET_WINDOW_PIXELS) large.
+    """
+    target_pixels = target_pixels or TARGET_WINDOW_PIXELS
+    block_height, block_width = src.block_shapes[band - 1]
+    blocks_per_window = max(1, target_pixels // (block_height * block_width))
+    # Combine blocks across a block row first, then stack whole block rows
+    blocks_across = -(-src.width // block_width)
+    cols_per_window = min(blocks_across, blocks_per_window) * block_width
+    rows_per_window = max(1, blocks_per_window // blocks_across) * block_height
+    for row_off in range(0, src.height, rows_per_window):
+        for col_off in range(0, src.width, cols_per_window):
+            yield Window(col_off, row_off, min(cols_per_window, src.width - col_off), min(rows_per_window, src.height - row_off))
+
+
+def map_blocks(
+    path: str,
+    reduce_window: Callable,
+    combine: Callable,
+    band: int = 1,
+    workers: int = 1,
+    other_paths: Sequence[str] = (),
+    open_other: Callable = rasterio.open,
+):
+    """
+    Apply `reduce_window(src, window, *other_srcs)` to every window of the raster at
+    `path` and fold the partial results with `combine(a, b)`. Rasters in `other_paths`
+    are opened alongside with `open_other(path)`, a context manager yielding a dataset,
+    and read in the same windows. With `workers` > 1 the windows are shared out
+    round-robin between threads, each reading through its own datasets.
+    """
+    with rasterio.open(path) as src:
+        windows = list(block_windows(src, band))
+
+    def run(share: List[Window]):
+        result = None
+        with ExitStack() as stack:
+            src = stack.enter_context(rasterio.open(path))
+            others = [stack.enter_context(open_other(other)) for other in other_paths]
+            for window in share:
+                partial = reduce_window(src, window, *others)
+                result = partial if result is None else combine(result, partial)
+        return result
+
+    if workers <= 1 or len(windows) < 2:
+        return run(windows)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="raster-blocks") as pool:
+        partials = [p for p in pool.map(run, [windows[i::workers] for i in range(workers)]) if p is not None]
+    result = partials[0]
+    for partial in partials[1:]:
+        result = combine(result, partial)
+    return result
+
+
+def value_counts(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distinct values of an array and their counts. Small non-negative integer
+    classes, the usual case for class rasters, are counted with np.bincount.
+    """
+    data = data.ravel()
+    if data.size and np.issubdtype(data.dtype, np.integer) and data.min() >= 0 and data.max() < 1 << 16:
+        counts = np.bincount(data)
+        values = np.flatnonzero(counts)
+        return values, counts[values]
+    return np.unique(data, return_counts=True)
+
+
+def raster_value_counts(path: str, band: int = 1, workers: int = 1) -> Counter:
+    """
+    Count the pixels of each distinct value of a raster band, block by block.
+    """
+    def reduce_window(src, window):
+        values, counts = value_counts(src.read(band, window=window))
+        return Counter(dict(zip(values.tolist(), counts.tolist())))
+
+    return map_blocks(path, reduce_window, lambda a, b: a + b, band=band, workers=workers) or Counter()
+
+
+def valid_mask(data: np.ndarray, nodata) -> np.ndarray:
+    """
+    Mask of the pixels that are neither nodata nor NaN.
+    """
+    valid = np.ones(data.shape, dtype=bool) if nodata is None or np.isnan(nodata) else data != nodata
+    if np.issubdtype(data.dtype, np.floating):
+        valid &= ~np.isnan(data)
+    return valid
+
+
+def _combine_zone_stats(a: dict, b: dict) -> dict:
+    # Chan et al.'s pairwise update merges counts, means and sums of squared deviations
+    merged = dict(a)
+    for zone, (n_b, mean_b, m2_b, min_b, max_b) in b.items():
+        if zone not in merged:
+            merged[zone] = (n_b, mean_b, m2_b, min_b, max_b)
+            continue
+        n_a, mean_a, m2_a, min_a, max_a = merged[zone]
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        merged[zone] = (n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n, min(min_a, min_b), max(max_a, max_b))
+    return merged
+
+
+def zonal_statistics(zones_path: str, values_path: str, zones_band: int = 1, values_band: int = 1, workers: int = 1) -> dict:
+    """
+    Count, mean, min, max and (population) standard deviation of a values raster within
+    each zone of a zones raster of the same dimensions, e.g. degradation per habitat class.
+
+    Both rasters are streamed in the same windows, laid out on the zones raster's
+    blocks, so their block layouts may differ. Pixels that are nodata (or NaN) in either
+    raster are left out. Each window is reduced for all zones at once with
+    np.bincount and ufunc.at, and the partial results are merged exactly.
+    """
+    with rasterio.open(zones_path) as zones_src, rasterio.open(values_path) as values_src:
+        if zones_src.shape != values_src.shape:
+            raise ValueError("Zone and value rasters must have the same dimensions.")
+
+    def reduce_window(zones_src, window, values_src):
+        values = values_src.read(values_band, window=window).astype(np.float64)
+        valid = valid_mask(values, values_src.nodata)
+        zones = zones_src.read(zones_band, window=window)
+        valid &= valid_mask(zones, zones_src.nodata)
+        zones, values = zones[valid], values[valid]
+        if not zones.size:
+            return {}
+
+        keys, index = np.unique(zones, return_inverse=True)
+        index = index.ravel()
+        counts = np.bincount(index, minlength=len(keys))
+        means = np.bincount(index, weights=values, minlength=len(keys)) / counts
+        m2 = np.bincount(index, weights=(values - means[index]) ** 2, minlength=len(keys))
+        mins = np.full(len(keys), np.inf)
+        maxs = np.full(len(keys), -np.inf)
+        np.minimum.at(mins, index, values)
+        np.maximum.at(maxs, index, values)
+        return {
+            zone: stats
+            for zone, stats in zip(keys.tolist(), zip(counts.tolist(), means.tolist(), m2.tolist(), mins.tolist(), maxs.tolist()))
+        }
+
+    partial = map_blocks(
+        zones_path, reduce_window, _combine_zone_stats, band=zones_band, workers=workers, other_paths=[values_path]
+    ) or {}
+    return {
+        zone: {"count": n, "mean": mean, "min": minimum, "max": maximum, "std": float(np.sqrt(m2 / n))}
+        for zone, (n, mean, m2, minimum, maximum) in sorted(partial.items())
+    }
@@ -4,8 +4,9 @@ from rasterio.warp import calculate_default_transform, reproject, Resampling, Re
 from rasterio.merge import merge
 from shapely.geometry import box, LineString, MultiLineString
 import geopandas as gpd
-from typing import List
+from typing import List, Optional
 import os
+import numpy as np
 
 from app.config import settings
 
@@ -101,9 +102,32 @@ def mosaic_images(image_paths: List[str], output_path: str):
         src.close()
 
 
-def calculate_morans_i(gdf, column):
+# Permutations of the Moran's I pseudo p-value, as in esda
+MORANS_I_PERMUTATIONS = 999
+
+
+def _moran_p_sim(z: np.ndarray, w, observed: float, permutations: int, seed: Optional[int]) -> float:
+    """
+    esda's permutation pseudo p-value for Moran's I, drawn from a local generator
+    rather than the global NumPy one, so seeded runs are reproducible across threads.
+    """
+    rng = np.random.default_rng(seed)
+    lag = w.sparse
+    scale = len(z) / w.s0 / (z * z).sum()
+    sim = np.empty(permutations)
+    # Permutations are evaluated a block at a time to bound memory on long trackways
+    for start in range(0, permutations, 100):
+        block = rng.permuted(np.tile(z, (min(100, permutations - start), 1)), axis=1)
+        sim[start:start + len(block)] = scale * (block * (lag @ block.T).T).sum(axis=1)
+    larger = int((sim >= observed).sum())
+    larger = min(larger, permutations - larger)
+    return (larger + 1.0) / (permutations + 1.0)
+
+
+def calculate_morans_i(gdf, column, seed: Optional[int] = None):
     """
     Calculates Moran's I for a given GeoDataFrame and column.
+    With a seed, the permutation test, and so the pseudo p-value, is reproducible.
     """
     if gdf.empty or column not in gdf.columns:
         return None, None
@@ -117,9 +141,11 @@ def calculate_morans_i(gdf, column):
         w = weights.Queen.from_dataframe(gdf, use_index=True)
         w.transform = 'r'
 
-        # Calculate Moran's I
-        moran = esda.moran.Moran(gdf[column], w)
-        return moran.I, moran.p_sim
+        # esda draws its permutations from the global NumPy generator, which is shared
+        # between threads, so the permutation test is run here on a local one instead
+        y = gdf[column].to_numpy(dtype=float)
+        moran = esda.moran.Moran(y, w, permutations=0)
+        return moran.I, _moran_p_sim(y - y.mean(), w, moran.I, MORANS_I_PERMUTATIONS, seed)
     except ImportError:
         # Handle case where pysal is not installed
         return None, None
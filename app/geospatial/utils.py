@@ -1,4 +1,5 @@
 import rasterio
+import numpy as np
 from pyproj import Proj, transform
 import tempfile
 import os
@@ -80,11 +81,40 @@ def extract_detailed_metadata(file: UploadFile):
     finally:
         os.remove(tmp_path)
 
+class GeoReference:
+    """
+    The affine transform and CRS of a GeoTIFF, read once so that any number of
+    pixel coordinates can be converted without reopening the file.
+    """
+
+    def __init__(self, transform, crs=None):
+        self.transform = transform
+        self.crs = crs
+
+    @classmethod
+    def from_file(cls, geotiff_path: str) -> "GeoReference":
+        with rasterio.open(geotiff_path) as src:
+            return cls(src.transform, src.crs)
+
+    def pixel_to_geo(self, pixel_x, pixel_y):
+        """
+        Convert pixel coordinates to geographic coordinates.
+        Accepts scalars or NumPy arrays, which are converted in one affine operation.
+        """
+        return self.transform * (pixel_x, pixel_y)
+
+    def boxes_to_geo(self, xyxy: np.ndarray) -> np.ndarray:
+        """
+        Convert an (N, 4) array of x1, y1, x2, y2 pixel boxes to geographic corners.
+        """
+        xyxy = np.asarray(xyxy, dtype=float).reshape(-1, 4)
+        geo_x1, geo_y1 = self.pixel_to_geo(xyxy[:, 0], xyxy[:, 1])
+        geo_x2, geo_y2 = self.pixel_to_geo(xyxy[:, 2], xyxy[:, 3])
+        return np.column_stack((geo_x1, geo_y1, geo_x2, geo_y2))
+
 def pixel_to_geo(pixel_x, pixel_y, geotiff_path):
     """
     Convert a single pixel coordinate (x, y) to a geographic coordinate.
+    To convert many coordinates, read a GeoReference once and use it instead.
     """
-    with rasterio.open(geotiff_path) as src:
-        # The transform method maps pixel coordinates to geographic coordinates
-        geo_x, geo_y = src.transform * (pixel_x, pixel_y)
-        return geo_x, geo_y
+    return GeoReference.from_file(geotiff_path).pixel_to_geo(pixel_x, pixel_y)
@@ -2,12 +2,13 @@ from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, B
 from fastapi.responses import FileResponse
 from . import services
 from app.logger import logger
+from app.concurrency import ServiceBusyError, run_blocking
 import os
 import time
 from app.trackways.services import analyze_trackways
 import geopandas as gpd
 from shapely.geometry import LineString
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 router = APIRouter()
@@ -70,6 +71,34 @@ async def export_gis_endpoint(
         end_date=request.end_date
     )
 
+class ZonalStatsRequest(BaseModel):
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    buffer_distance: Optional[float] = Field(None, gt=0)  # Defaults to settings.trackway_buffer_distance
+
+@router.post("/gis/trackway_zonal_stats", tags=["GIS Integration"])
+async def trackway_zonal_stats_endpoint(
+    request: ZonalStatsRequest = Body(...)
+):
+    """
+    Habitat histogram and majority class, and mean, min and max degradation and
+    elevation, within a buffer around each AI-detected trackway.
+    """
+    try:
+        results = await run_blocking(
+            services.get_trackway_zonal_stats, request.start_date, request.end_date, request.buffer_distance
+        )
+    except ServiceBusyError:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error computing trackway zonal statistics: {e}")
+        raise HTTPException(status_code=500, detail="Error computing trackway zonal statistics")
+    if results is None:
+        raise HTTPException(status_code=404, detail="No AI trackways found.")
+    return results
+
 @router.post("/gis/visualize", tags=["GIS Integration"])
 async def visualize_comparison_endpoint(
     manual_gis_file: UploadFile = File(...),
@@ -95,7 +124,7 @@ async def visualize_comparison_endpoint(
                 buffer.write(await imagery_file.read())
 
         # Get AI trackways and convert to GDF
-        ai_trackways = analyze_trackways(start_date, end_date)
+        ai_trackways = await run_blocking(analyze_trackways, start_date, end_date)
         if not ai_trackways:
             raise HTTPException(status_code=404, detail="No AI trackways found.")
         geometries = [LineString([(p['x'], p['y']) for p in data['points']]) for data in ai_trackways.values() if len(data['points']) >= 2]
@@ -107,10 +136,12 @@ async def visualize_comparison_endpoint(
 
         # Generate map
         output_path = f"comparison_map_{int(time.time())}.html"
-        services.visualize_comparison(ai_gdf, manual_gdf, imagery_path, output_path)
+        await run_blocking(services.visualize_comparison, ai_gdf, manual_gdf, imagery_path, output_path)
 
         return FileResponse(output_path, media_type='text/html')
 
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error during visualization: {e}")
         raise HTTPException(status_code=500, detail=f"Error during visualization: {str(e)}")
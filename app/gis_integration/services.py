@@ -1,8 +1,18 @@
 import geopandas as gpd
+import shapely
 from app.logger import logger
 import rasterio
-from typing import Optional
+from typing import List, Optional
 import numpy as np
+from app.geospatial.raster_cache import sample_raster
+from app.geospatial.raster_stats import raster_value_counts, zonal_statistics
+from app.gis_integration.zonal import trackway_zonal_stats
+from app.caching import ResultCache
+from app.config import settings
+import os
+
+# Whole-raster statistics, keyed on the raster's path, mtime and size
+raster_stats_cache = ResultCache(settings.raster_stats_cache_max_entries, 64 * 1024 * 1024)
 
 def get_habitat_type_for_coord(x: float, y: float, habitat_map_path: str) -> Optional[int]:
     """
@@ -16,26 +26,40 @@ def get_habitat_type_for_coord(x: float, y: float, habitat_map_path: str) -> Opt
     Returns:
         Optional[int]: The habitat type (pixel value) or None if the coordinate is out of bounds.
     """
-    try:
-        with rasterio.open(habitat_map_path) as src:
-            # Get the pixel coordinates from the world coordinates
-            row, col = src.index(x, y)
+    return get_habitat_types_for_coords([x], [y], habitat_map_path)[0]
 
-            # Read the value of the pixel
-            # Assuming the habitat type is in the first band
-            value = src.read(1, window=((row, row + 1), (col, col + 1)))
+def get_habitat_types_for_coords(xs, ys, habitat_map_path: str) -> List[Optional[int]]:
+    """
+    Get the habitat types for arrays of coordinates from a classified habitat map.
+    Each raster block is read once, however many coordinates fall in it.
 
-            return int(value[0, 0])
-    except IndexError:
-        # Coordinate is outside the raster bounds
-        return None
+    Args:
+        xs: The x-coordinates.
+        ys: The y-coordinates.
+        habitat_map_path (str): The path to the classified habitat GeoTIFF.
+
+    Returns:
+        List[Optional[int]]: The habitat type (pixel value) of each coordinate, or None where it is out of bounds.
+    """
+    try:
+        # Assuming the habitat type is in the first band
+        values, inside = sample_raster(habitat_map_path, xs, ys, band=1)
+        return [int(value) if ok else None for value, ok in zip(values.tolist(), inside.tolist())]
     except Exception as e:
-        logger.error(f"Error getting habitat type for coordinate ({x}, {y}): {e}")
-        return None
+        logger.error(f"Error getting habitat types for {len(xs)} coordinates: {e}")
+        return [None] * len(xs)
+
+def raster_version(path: str) -> tuple:
+    """
+    Identify the current contents of a raster file, for caching statistics on it.
+    """
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
 
 def get_habitat_areas(habitat_map_path: str) -> dict:
     """
     Calculate the area of each habitat class in a GeoTIFF.
+    The raster is read block by block, and the result is cached until the file changes.
 
     Args:
         habitat_map_path (str): The path to the classified habitat GeoTIFF.
@@ -44,24 +68,46 @@ def get_habitat_areas(habitat_map_path: str) -> dict:
         dict: A dictionary where keys are habitat classes and values are their areas in square meters.
     """
     try:
-        with rasterio.open(habitat_map_path) as src:
-            # Read the raster data
-            data = src.read(1)
-            # Get the pixel size
-            pixel_size_x, pixel_size_y = src.res
-            # Calculate the area of a single pixel
-            pixel_area = pixel_size_x * pixel_size_y
-
-            # Get the unique habitat classes and their counts
-            unique, counts = np.unique(data, return_counts=True)
-            # Calculate the area for each class
-            areas = counts * pixel_area
-
-            return dict(zip(unique, areas))
+        key = ("habitat_areas", raster_version(habitat_map_path))
+        return raster_stats_cache.get_or_compute(key, lambda: _compute_habitat_areas(habitat_map_path))
     except Exception as e:
         logger.error(f"Error calculating habitat areas: {e}")
         return {}
 
+def _compute_habitat_areas(habitat_map_path: str) -> dict:
+    with rasterio.open(habitat_map_path) as src:
+        # Get the pixel size
+        pixel_size_x, pixel_size_y = src.res
+    # Calculate the area of a single pixel
+    pixel_area = pixel_size_x * pixel_size_y
+
+    # Count the pixels of each habitat class
+    counts = raster_value_counts(habitat_map_path, band=1, workers=settings.raster_block_workers)
+    return {habitat_class: count * pixel_area for habitat_class, count in sorted(counts.items())}
+
+def get_degradation_stats_for_habitats(habitat_map_path: str, degradation_map_path: str) -> dict:
+    """
+    Calculates degradation statistics for each habitat type in one pass over both maps.
+    The result is cached until either map changes.
+
+    Args:
+        habitat_map_path (str): The path to the habitat map GeoTIFF.
+        degradation_map_path (str): The path to the degradation map GeoTIFF.
+
+    Returns:
+        dict: A dictionary where keys are habitat types and values are dictionaries with the
+        count, mean, min, max and std of degradation. Nodata pixels in either map are left out.
+    """
+    try:
+        key = ("degradation_stats", raster_version(habitat_map_path), raster_version(degradation_map_path))
+        return raster_stats_cache.get_or_compute(
+            key,
+            lambda: zonal_statistics(habitat_map_path, degradation_map_path, workers=settings.raster_block_workers),
+        )
+    except Exception as e:
+        logger.error(f"Error calculating degradation statistics: {e}")
+        return {}
+
 def get_average_degradation_for_habitats(habitat_map_path: str, degradation_map_path: str) -> dict:
     """
     Calculates the average degradation for each habitat type.
@@ -73,31 +119,39 @@ def get_average_degradation_for_habitats(habitat_map_path: str, degradation_map_
     Returns:
         dict: A dictionary where keys are habitat types and values are the average degradation.
     """
-    try:
-        with rasterio.open(habitat_map_path) as habitat_src, rasterio.open(degradation_map_path) as degradation_src:
-            habitat_data = habitat_src.read(1)
-            degradation_data = degradation_src.read(1)
-
-            # Ensure the maps have the same shape
-            if habitat_data.shape != degradation_data.shape:
-                raise ValueError("Habitat and degradation maps must have the same dimensions.")
+    stats = get_degradation_stats_for_habitats(habitat_map_path, degradation_map_path)
+    return {int(habitat_type): habitat_stats["mean"] for habitat_type, habitat_stats in stats.items()}
 
-            unique_habitats = np.unique(habitat_data)
-            avg_degradation = {}
+def get_trackway_zonal_stats(start_date: Optional[str] = None, end_date: Optional[str] = None, buffer_distance: Optional[float] = None) -> Optional[dict]:
+    """
+    Summarize the habitat, degradation and elevation rasters within a buffer around each trackway.
 
-            for habitat_type in unique_habitats:
-                # Find where the habitat type is present
-                mask = habitat_data == habitat_type
-                # Get the degradation values for that habitat
-                degradation_in_habitat = degradation_data[mask]
-                # Calculate the average degradation and convert to python types
-                avg_degradation[int(habitat_type)] = float(np.mean(degradation_in_habitat))
+    Args:
+        start_date (str, optional): Start of the trackway analysis time window.
+        end_date (str, optional): End of the trackway analysis time window.
+        buffer_distance (float, optional): Buffer around each trackway's path, in map units.
+            Defaults to settings.trackway_buffer_distance.
 
-            return avg_degradation
+    Returns:
+        dict: Per trackway id, the statistics of each available raster, or None if there are no trackways.
+    """
+    from app.trackways.services import analyze_trackways
 
-    except Exception as e:
-        logger.error(f"Error calculating average degradation: {e}")
-        return {}
+    trackways = analyze_trackways(start_date, end_date)
+    if not trackways:
+        return None
+    candidates = {
+        "habitat": settings.habitat_map_path,
+        "degradation": settings.degradation_map_path,
+        "elevation": settings.DEM_PATH,
+    }
+    rasters = {name: path for name, path in candidates.items() if os.path.exists(path)}
+    if not rasters:
+        raise ValueError("No habitat, degradation or elevation raster is available.")
+    buffer_distance = buffer_distance if buffer_distance is not None else settings.trackway_buffer_distance
+    return trackway_zonal_stats(
+        trackways, rasters, buffer_distance, categorical=["habitat"], workers=settings.raster_block_workers
+    )
 
 def import_gis_data(filepath: str):
     """
@@ -198,10 +252,13 @@ def calculate_similarity(ai_trackways_gdf: gpd.GeoDataFrame, manual_trackways_gd
             logger.warning("CRS mismatch. Reprojecting AI trackways to match manual trackways.")
             ai_trackways_gdf = ai_trackways_gdf.to_crs(manual_trackways_gdf.crs)
 
-        # Spatial join to find intersecting trackways
-        joined_gdf = gpd.sjoin(ai_trackways_gdf, manual_trackways_gdf, how="inner", op='intersects')
+        ai_geoms = np.asarray(ai_trackways_gdf.geometry.array, dtype=object)
+        manual_geoms = np.asarray(manual_trackways_gdf.geometry.array, dtype=object)
+
+        # Find intersecting (AI, manual) trackway pairs with a spatial index on the manual trackways
+        ai_index, manual_index = shapely.STRtree(manual_geoms).query(ai_geoms, predicate="intersects")
 
-        if joined_gdf.empty:
+        if len(ai_index) == 0:
             logger.warning("No intersecting trackways found.")
             return {
                 "overlap_percentage": 0,
@@ -210,37 +267,35 @@ def calculate_similarity(ai_trackways_gdf: gpd.GeoDataFrame, manual_trackways_gd
                 "matches": []
             }
 
-        # Calculate overlap percentage
-        total_manual_length = manual_trackways_gdf.geometry.length.sum()
-        total_intersecting_length = 0
-
-        # Group by manual trackway index to handle multiple intersections
-        for index_right, group in joined_gdf.groupby('index_right'):
-            manual_geom = manual_trackways_gdf.geometry.iloc[index_right]
-            intersecting_geom = group.geometry.unary_union
-            intersection = manual_geom.intersection(intersecting_geom)
-            total_intersecting_length += intersection.length
+        # Calculate overlap percentage: the length of each manual trackway covered by any AI trackway.
+        # The union of a manual trackway's pairwise intersections is only needed when several AI trackways hit it
+        total_manual_length = shapely.length(manual_geoms).sum()
+        intersections = shapely.intersection(manual_geoms[manual_index], ai_geoms[ai_index])
+        order = np.argsort(manual_index, kind="stable")
+        manual_ids, starts, hits = np.unique(manual_index[order], return_index=True, return_counts=True)
+        covered = shapely.length(intersections[order[starts]])
+        for i in np.flatnonzero(hits > 1):
+            covered[i] = shapely.length(shapely.union_all(intersections[order[starts[i]:starts[i] + hits[i]]]))
+        total_intersecting_length = covered.sum()
 
         overlap_percentage = (total_intersecting_length / total_manual_length) * 100 if total_manual_length > 0 else 0
 
-        # Calculate spatial offset (average Hausdorff distance)
-        offsets = []
-        for _, row in joined_gdf.iterrows():
-            offset = row.geometry.hausdorff_distance(manual_trackways_gdf.geometry.iloc[row.index_right])
-            offsets.append(offset)
-
-        average_offset = sum(offsets) / len(offsets) if offsets else None
+        # Calculate spatial offset (average Hausdorff distance), once per pair
+        offsets = shapely.hausdorff_distance(ai_geoms[ai_index], manual_geoms[manual_index])
+        average_offset = float(offsets.mean())
 
         # Calculate detection completeness
-        detected_manual_trackways = joined_gdf['index_right'].nunique()
-        detection_completeness = (detected_manual_trackways / len(manual_trackways_gdf)) * 100
+        detection_completeness = (len(manual_ids) / len(manual_trackways_gdf)) * 100
 
         # Detailed matches
-        matches = joined_gdf.apply(lambda row: {
-            'ai_trackway_id': row.trackway_id,
-            'manual_trackway_id': row.index_right,
-            'offset': row.geometry.hausdorff_distance(manual_trackways_gdf.geometry.iloc[row.index_right])
-        }, axis=1).tolist()
+        matches = [
+            {'ai_trackway_id': ai_id, 'manual_trackway_id': manual_id, 'offset': offset}
+            for ai_id, manual_id, offset in zip(
+                ai_trackways_gdf['trackway_id'].to_numpy()[ai_index].tolist(),
+                manual_trackways_gdf.index[manual_index].tolist(),
+                offsets.tolist(),
+            )
+        ]
 
         metrics = {
             "overlap_percentage": overlap_percentage,
@@ -249,7 +304,10 @@ def calculate_similarity(ai_trackways_gdf: gpd.GeoDataFrame, manual_trackways_gd
             "matches": matches
         }
 
-        logger.info(f"Similarity calculation complete: {metrics}")
+        logger.info(
+            f"Similarity calculation complete: {len(matches)} matches, overlap {overlap_percentage:.1f}%, "
+            f"completeness {detection_completeness:.1f}%"
+        )
         return metrics
 
     except Exception as e:
@@ -261,6 +319,7 @@ import rasterio
 from rasterio.transform import from_bounds
 import numpy as np
 from fastapi import UploadFile, HTTPException
+from app.concurrency import ServiceBusyError, run_blocking
 import os
 
 async def compare_manual_vs_ai(manual_gis_file: UploadFile, start_date: Optional[str], end_date: Optional[str]):
@@ -277,7 +336,7 @@ async def compare_manual_vs_ai(manual_gis_file: UploadFile, start_date: Optional
             buffer.write(await manual_gis_file.read())
 
         # 1. Get AI trackways
-        ai_trackways = analyze_trackways(start_date, end_date)
+        ai_trackways = await run_blocking(analyze_trackways, start_date, end_date)
         if not ai_trackways:
             raise HTTPException(status_code=404, detail="No AI trackways found for the given dates.")
 
@@ -293,6 +352,8 @@ async def compare_manual_vs_ai(manual_gis_file: UploadFile, start_date: Optional
         metrics = calculate_similarity(ai_gdf, manual_gdf)
         return metrics
 
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error during comparison: {e}")
         raise HTTPException(status_code=500, detail=f"Error during comparison: {str(e)}")
@@ -368,7 +429,7 @@ async def export_gis(format: str, start_date: Optional[str], end_date: Optional[
     try:
         from app.trackways.services import analyze_trackways
         # Get AI trackways
-        ai_trackways = analyze_trackways(start_date, end_date)
+        ai_trackways = await run_blocking(analyze_trackways, start_date, end_date)
         if not ai_trackways:
             raise HTTPException(status_code=404, detail="No AI trackways found for the given dates.")
 
@@ -388,10 +449,12 @@ async def export_gis(format: str, start_date: Optional[str], end_date: Optional[
 
         output_path = os.path.join(output_dir, filename + ext)
 
-        export_trackways(ai_trackways, format, output_path)
+        await run_blocking(export_trackways, ai_trackways, format, output_path)
 
         return FileResponse(output_path, media_type='application/octet-stream', filename=filename+ext)
 
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error during export: {e}")
         raise HTTPException(status_code=500, detail=f"Error during export: {str(e)}")
@@ -0,0 +1,232 @@
+"""
+Zonal statistics of trackway buffers over aligned rasters.
+
+The rasters (e.g. habitat, degradation and DEM) are swept together in one windowed
+pass, tile by tile, on the grid of the first one. Rasters on another grid are
+resampled to it on the fly. In each tile, the buffered trackways that intersect it
+are found with an STRtree, and each is rasterized over the part of its bounding box
+inside the tile. That mask is shared by every raster read for the tile, so a
+geometry costs one rasterization per tile it touches, whatever the number of rasters.
+Trackways, and buffers that overlap each other, are handled independently. Per-tile
+partial results merge exactly, so tiles can be shared out between threads.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterable, Optional
+
+import numpy as np
+import rasterio
+from rasterio import features, windows
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from shapely.geometry import LineString, Point, box
+from shapely.strtree import STRtree
+
+from app.geospatial.raster_stats import map_blocks, valid_mask, value_counts
+from app.logger import logger
+
+
+def trackway_geometries(trackways: dict) -> dict:
+    """
+    The path of each analyzed trackway: a LineString through its points in time
+    order, or a Point for a single-point trackway.
+    """
+    geometries = {}
+    for trackway_id, data in trackways.items():
+        coords = [(p['x'], p['y']) for p in data['points']]
+        if coords:
+            geometries[trackway_id] = LineString(coords) if len(coords) >= 2 else Point(coords[0])
+    return geometries
+
+
+def _grid(path):
+    with rasterio.open(path) as src:
+        return src.crs, src.transform, src.height, src.width
+
+
+def _misaligned(paths) -> set:
+    """
+    The paths, after the first, whose rasters are not on the first one's grid.
+    """
+    crs, transform, height, width = _grid(paths[0])
+    misaligned = set()
+    for path in paths[1:]:
+        other_crs, other_transform, other_height, other_width = _grid(path)
+        if (
+            (other_height, other_width) != (height, width)
+            or not other_transform.almost_equals(transform)
+            or (crs and other_crs and other_crs != crs)
+        ):
+            logger.warning(f"Raster {path} is not aligned with {paths[0]}; resampling it to that grid.")
+            misaligned.add(path)
+    return misaligned
+
+
+@contextmanager
+def _open_on_grid(path: str, grid, resampling: Resampling):
+    """
+    Open a raster warped onto `grid` (crs, transform, height, width). An alpha band
+    marks the pixels the source covers.
+    """
+    crs, transform, height, width = grid
+    with rasterio.open(path) as src:
+        options = {"crs": crs} if crs and src.crs else {}
+        with WarpedVRT(
+            src, transform=transform, height=height, width=width, resampling=resampling, add_alpha=True, **options
+        ) as vrt:
+            yield vrt
+
+
+def _pixel_window(bounds, transform, height: int, width: int) -> Optional[windows.Window]:
+    """
+    The pixels of a tile covering a geometry's bounds, padded by one pixel for all_touched.
+    """
+    cols, rows = ~transform * (np.array([bounds[0], bounds[2]]), np.array([bounds[1], bounds[3]]))
+    row_start = max(int(np.floor(rows.min())) - 1, 0)
+    row_stop = min(int(np.ceil(rows.max())) + 1, height)
+    col_start = max(int(np.floor(cols.min())) - 1, 0)
+    col_stop = min(int(np.ceil(cols.max())) + 1, width)
+    if row_start >= row_stop or col_start >= col_stop:
+        return None
+    return windows.Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def _merge_zone(a: dict, b: dict) -> dict:
+    merged = dict(a)
+    for name, partial in b.items():
+        if name not in merged:
+            merged[name] = partial
+        elif isinstance(partial, Counter):
+            merged[name] = merged[name] + partial
+        else:
+            n_a, total_a, min_a, max_a = merged[name]
+            n_b, total_b, min_b, max_b = partial
+            merged[name] = (n_a + n_b, total_a + total_b, min(min_a, min_b), max(max_a, max_b))
+    return merged
+
+
+def _merge(a: dict, b: dict) -> dict:
+    merged = dict(a)
+    for key, zone in b.items():
+        merged[key] = _merge_zone(merged[key], zone) if key in merged else zone
+    return merged
+
+
+def zonal_stats(
+    geometries: Dict[Hashable, object],
+    rasters: Dict[str, str],
+    categorical: Iterable[str] = (),
+    workers: int = 1,
+) -> dict:
+    """
+    Compute statistics of every raster within every geometry, in one sweep.
+
+    `rasters` maps a name to the path of a single-band raster. Statistics are taken on
+    the grid (CRS, shape and transform) of the first raster, and geometries are taken to
+    be in its CRS. Other rasters not on that grid are resampled to it, nearest-neighbour
+    for categorical ones and bilinear for the others, and pixels they do not cover are
+    left out. Rasters named in `categorical` get a class `histogram` and `majority`
+    class, and the others get `mean`, `min` and `max`. Both kinds report the `count`
+    of valid (non-nodata) pixels touched by the geometry.
+    """
+    names = list(rasters)
+    paths = [rasters[name] for name in names]
+    categorical = set(categorical)
+    grid = _grid(paths[0])
+    transform = grid[1]
+    misaligned = _misaligned(paths)
+    resampling = {
+        rasters[name]: Resampling.nearest if name in categorical else Resampling.bilinear for name in names[1:]
+    }
+
+    def open_other(path):
+        return _open_on_grid(path, grid, resampling[path]) if path in misaligned else rasterio.open(path)
+    keys = list(geometries)
+    shapes = [geometries[key] for key in keys]
+    tree = STRtree(shapes)
+
+    def reduce_window(src, window, *other_srcs):
+        hits = tree.query(box(*windows.bounds(window, transform)))
+        if not len(hits):
+            return {}
+        tile_transform = windows.transform(window, transform)
+        height, width = int(window.height), int(window.width)
+        tiles = []
+        for source, path in zip((src, *other_srcs), paths):
+            data = source.read(1, window=window)
+            valid = valid_mask(data, source.nodata)
+            if path in misaligned:
+                valid &= source.read(source.count, window=window) > 0
+            tiles.append((data, valid))
+
+        result = {}
+        for i in hits.tolist():
+            # Rasterize the geometry over its own bounding box within the tile
+            sub = _pixel_window(shapes[i].bounds, tile_transform, height, width)
+            if sub is None:
+                continue
+            mask = features.geometry_mask(
+                [shapes[i]],
+                out_shape=(int(sub.height), int(sub.width)),
+                transform=windows.transform(sub, tile_transform),
+                invert=True,
+                all_touched=True,
+            )
+            if not mask.any():
+                continue
+            rows, cols = sub.toslices()
+            zone = {}
+            for name, (data, valid) in zip(names, tiles):
+                values = data[rows, cols][mask & valid[rows, cols]]
+                if name in categorical:
+                    classes, counts = value_counts(values)
+                    zone[name] = Counter(dict(zip(classes.tolist(), counts.tolist())))
+                elif values.size:
+                    zone[name] = (values.size, float(values.sum(dtype=np.float64)), float(values.min()), float(values.max()))
+                else:
+                    zone[name] = (0, 0.0, np.inf, -np.inf)
+            result[keys[i]] = zone
+        return result
+
+    partial = map_blocks(
+        paths[0], reduce_window, _merge, workers=workers, other_paths=paths[1:], open_other=open_other
+    ) or {}
+
+    results = {}
+    for key in keys:
+        zone = partial.get(key, {})
+        results[key] = {}
+        for name in names:
+            if name in categorical:
+                histogram = zone.get(name, Counter())
+                results[key][name] = {
+                    "count": sum(histogram.values()),
+                    "histogram": dict(sorted(histogram.items())),
+                    "majority": max(histogram, key=lambda c: (histogram[c], -c)) if histogram else None,
+                }
+            else:
+                n, total, minimum, maximum = zone.get(name, (0, 0.0, np.inf, -np.inf))
+                results[key][name] = {
+                    "count": n,
+                    "mean": total / n if n else None,
+                    "min": minimum if n else None,
+                    "max": maximum if n else None,
+                }
+    return results
+
+
+def trackway_zonal_stats(
+    trackways: dict,
+    rasters: Dict[str, str],
+    buffer_distance: float,
+    categorical: Iterable[str] = (),
+    workers: int = 1,
+) -> dict:
+    """
+    Zonal statistics of each trackway's path buffered by `buffer_distance`, keyed on trackway id.
+    """
+    geometries = {key: geometry.buffer(buffer_distance) for key, geometry in trackway_geometries(trackways).items()}
+    geometries = {key: geometry for key, geometry in geometries.items() if not geometry.is_empty}
+    if not geometries:
+        return {}
+    return zonal_stats(geometries, rasters, categorical=categorical, workers=workers)
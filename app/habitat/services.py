@@ -1,6 +1,6 @@
 from fastapi import UploadFile
 from app.trackways.services import analyze_trackways
-from app.gis_integration.services import get_habitat_areas, get_average_degradation_for_habitats
+from app.gis_integration.services import get_habitat_areas, get_degradation_stats_for_habitats
 from app.config import settings
 from collections import defaultdict
 import random
@@ -72,22 +72,23 @@ def calculate_ecological_pressure():
     if "error" in habitat_impact or "message" in habitat_impact:
         return habitat_impact
 
-    # 2. Get average degradation for each habitat
-    avg_degradation = get_average_degradation_for_habitats(
+    # 2. Get degradation statistics for each habitat
+    degradation_stats = get_degradation_stats_for_habitats(
         settings.habitat_map_path, settings.degradation_map_path
     )
-    if not avg_degradation:
+    if not degradation_stats:
         return {"error": "Could not calculate average degradation."}
 
     # 3. Combine the data
     ecological_pressure = {}
     for habitat_type, impact_data in habitat_impact.items():
         # Ensure consistent key types
-        degradation = avg_degradation.get(int(habitat_type))
+        degradation = degradation_stats.get(int(habitat_type))
         if degradation is not None:
             ecological_pressure[habitat_type] = {
                 "trackway_density": impact_data["density"],
-                "average_degradation": degradation
+                "average_degradation": degradation["mean"],
+                "degradation_stats": degradation,
             }
 
     return ecological_pressure
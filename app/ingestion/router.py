@@ -3,6 +3,7 @@ from typing import Optional, List
 from . import validation
 from . import services
 from app.logger import logger
+from app.concurrency import ServiceBusyError, run_blocking
 
 router = APIRouter()
 
@@ -19,7 +20,7 @@ async def ingest_data(
     """
     try:
         logger.info(f"Ingesting file: {file.filename}")
-        error, detailed_metadata = validation.validate_file(file)
+        error, detailed_metadata = await run_blocking(validation.validate_file, file)
         if error:
             logger.warning(f"Validation error for file {file.filename}: {error}")
             raise HTTPException(status_code=400, detail=error)
@@ -27,7 +28,7 @@ async def ingest_data(
         metadata = await services.save_file(file, detailed_metadata, season, processing_pipeline)
         logger.info(f"Successfully ingested file: {file.filename}")
         return {"message": "Data ingested successfully", "metadata": metadata}
-    except HTTPException as e:
+    except (HTTPException, ServiceBusyError) as e:
         raise e
     except Exception as e:
         logger.error(f"Error ingesting file {file.filename}: {e}")
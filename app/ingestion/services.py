@@ -7,6 +7,7 @@ from fastapi import UploadFile
 from app.processing.transformations import process_image
 from app.geospatial.services import reproject_image, orthorectify_image
 from app.logger import logger
+from app.concurrency import run_blocking
 from typing import Optional
 
 def log_metadata(metadata: dict):
@@ -53,19 +54,20 @@ async def save_file(
         # Reproject the image if it has spatial metadata and a different CRS
         if detailed_metadata and detailed_metadata.get('spatial') and detailed_metadata['spatial'].get('crs') and detailed_metadata['spatial']['crs'] != settings.TARGET_CRS:
             reprojected_path = os.path.join(settings.processed_dir, f"reprojected_{unique_filename}")
-            reproject_image(file_path, reprojected_path)
+            await run_blocking(reproject_image, file_path, reprojected_path)
             logger.info(f"Reprojected image for {file.filename} and saved to {reprojected_path}")
             file_path = reprojected_path
 
         # Orthorectify the image if enabled
         if settings.APPLY_ORTHO_ON_INGEST:
             ortho_path = os.path.join(settings.processed_dir, f"ortho_{unique_filename}")
-            orthorectify_image(file_path, ortho_path)
+            await run_blocking(orthorectify_image, file_path, ortho_path)
             logger.info(f"Orthorectified image for {file.filename} and saved to {ortho_path}")
             file_path = ortho_path
 
         # Process the image
-        processed_image_path = process_image(
+        processed_image_path = await run_blocking(
+            process_image,
             file_path,
             season=season,
             processing_pipeline=processing_pipeline
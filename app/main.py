@@ -1,6 +1,8 @@
 import os
+import threading
 import yaml
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from app.config import settings
 from app.ingestion.router import router as ingestion_router
 from app.annotation.router import router as annotation_router
@@ -10,8 +12,19 @@ from app.gis_integration.router import router as gis_integration_router
 from app.habitat.router import router as habitat_router
 from app.mosaicking.router import router as mosaicking_router
 from app.monitoring.router import router as monitoring_router
+from app.detections.router import router as detections_router
 from app.logger import logger
-from app.prediction.services import get_latest_model_path
+from app.concurrency import ServiceBusyError, shutdown_executor, shutdown_process_pool
+from app.detections.writer import shutdown_detection_writer
+from app.prediction.services import (
+    get_latest_model_path,
+    get_model_registry,
+    is_model_ready,
+    shutdown_batch_scheduler,
+    shutdown_model_registry,
+    shutdown_pool_client,
+    warm_up_model,
+)
 
 app = FastAPI()
 
@@ -21,7 +34,7 @@ def startup_event():
     """
     Startup event handler.
     Creates required directories, default data configuration file,
-    and checks for model availability.
+    checks for model availability and starts loading and warming up the model.
     """
     # Check for model availability
     try:
@@ -56,6 +69,45 @@ def startup_event():
         with open(settings.data_config, "w") as f:
             yaml.dump(data_config, f, default_flow_style=False)
 
+    # Warm up in the background so /health/ answers while /ready/ reports not ready
+    threading.Thread(target=_warm_up, name="model-warmup", daemon=True).start()
+    # The worker pool loads its own weights, so only in-process models are hot-reloaded
+    if settings.model_registry_watch and not settings.inference_pool_enabled:
+        get_model_registry().start()
+
+
+def _warm_up():
+    try:
+        warm_up_model()
+    except Exception as e:
+        logger.critical(f"Model warm-up failed, the application will not report ready: {e}")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """
+    Shutdown event handler.
+    Stops the prediction batch scheduler and inference pool connection so pending
+    requests are failed cleanly, waits for running blocking jobs to finish, then
+    flushes buffered detections to the store.
+    """
+    shutdown_model_registry()
+    shutdown_batch_scheduler()
+    shutdown_pool_client()
+    shutdown_executor()
+    shutdown_process_pool()
+    shutdown_detection_writer()
+
+
+@app.exception_handler(ServiceBusyError)
+async def service_busy_handler(request: Request, exc: ServiceBusyError):
+    logger.warning(f"Rejected request to {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service is busy, please retry later"},
+        headers={"Retry-After": str(settings.retry_after_seconds)},
+    )
+
 
 app.include_router(ingestion_router, prefix="/api/v1")
 app.include_router(annotation_router, prefix="/api/v1")
@@ -65,6 +117,7 @@ app.include_router(gis_integration_router, prefix="/api/v1")
 app.include_router(habitat_router, prefix="/api/v1")
 app.include_router(mosaicking_router, prefix="/api/v1")
 app.include_router(monitoring_router, prefix="/api/v1")
+app.include_router(detections_router, prefix="/api/v1")
 
 
 @app.get("/")
@@ -74,3 +127,12 @@ def read_root():
 @app.get("/health/")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/ready/")
+def readiness_check():
+    """
+    Report ready only once the model has been loaded and warmed up.
+    """
+    if not is_model_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
@@ -34,7 +34,7 @@ def _compare_trackways(gdf1: gpd.GeoDataFrame, gdf2: gpd.GeoDataFrame, buffer_di
     if gdf2.empty: return {"new": [], "abandoned": gdf1['trackway_id'].tolist(), "modified": []}
     buffered_gdf1 = gdf1.copy()
     buffered_gdf1['geometry'] = gdf1.geometry.buffer(buffer_distance)
-    join_gdf = gpd.sjoin(gdf2, buffered_gdf1, how='left', op='intersects')
+    join_gdf = gpd.sjoin(gdf2, buffered_gdf1, how='left', predicate='intersects')
     new_ids = join_gdf[join_gdf['index_right'].isna()]['trackway_id_left'].unique().tolist()
     modified_gdf = join_gdf[~join_gdf['index_right'].isna()]
     modified_p2_ids = modified_gdf['trackway_id_left'].unique().tolist()
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Body
 from typing import List
 from . import services
 from app.logger import logger
+from app.concurrency import ServiceBusyError, run_blocking
 
 router = APIRouter()
 
@@ -15,9 +16,11 @@ async def create_mosaic_endpoint(
     """
     try:
         logger.info(f"Creating mosaic for images: {image_paths}")
-        output_path = services.create_mosaic(image_paths, output_filename)
+        output_path = await run_blocking(services.create_mosaic, image_paths, output_filename)
         logger.info(f"Successfully created mosaic: {output_path}")
         return {"message": "Mosaic created successfully", "output_path": output_path}
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error creating mosaic: {e}")
         raise HTTPException(status_code=500, detail=f"Error creating mosaic: {e}")
@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from PIL import Image
+
+from app.concurrency import ServiceBusyError
+from app.logger import logger
+
+
+class QueueFullError(ServiceBusyError):
+    """Raised when the batching queue has no room for another request."""
+
+
+class BatchScheduler:
+    """
+    Collects pending predict requests and runs them as one batched forward pass.
+
+    A background thread waits for the first request, then keeps collecting until
+    either `max_batch_size` images are pending or `max_wait_ms` has elapsed since
+    that first request. Each caller gets back only its own result.
+    """
+
+    def __init__(self, model_fn: Callable[[List[Image.Image]], list], max_batch_size: int, max_wait_ms: float, max_queue_depth: int):
+        self.model_fn = model_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_depth)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="yolo-batcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, image: Image.Image) -> Future:
+        """
+        Queue an image for the next batch.
+        Raises QueueFullError if the queue already holds `max_queue_depth` requests.
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((image, future, time.monotonic()))
+        except queue.Full:
+            raise QueueFullError(f"Prediction queue is full ({self._queue.maxsize} pending requests)")
+        return future
+
+    def predict(self, image: Image.Image, timeout: Optional[float] = None):
+        """
+        Submit an image and block until its result is available.
+        """
+        return self.submit(image).result(timeout)
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            waits = [started - enqueued for _, _, enqueued in batch]
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._total_wait += sum(waits)
+                self._max_wait_seen = max(self._max_wait_seen, max(waits))
+
+            try:
+                results = self.model_fn([image for image, _, _ in batch])
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Error running batched prediction on {len(batch)} images: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+        # Fail anything still queued so callers don't wait forever
+        while True:
+            try:
+                _, future, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(RuntimeError("Batch scheduler stopped"))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            batches, requests = self._batches, self._requests
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._queue.maxsize,
+                "batches": batches,
+                "requests": requests,
+                "average_batch_size": requests / batches if batches else 0.0,
+                "average_batch_fill": requests / (batches * self.max_batch_size) if batches else 0.0,
+                "average_queue_wait_ms": 1000.0 * self._total_wait / requests if requests else 0.0,
+                "max_queue_wait_ms": 1000.0 * self._max_wait_seen,
+            }
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def _to_numpy(values) -> np.ndarray:
+    if hasattr(values, "cpu"):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+class Detections:
+    """
+    Boxes of a single model result as NumPy arrays: `xyxy` (N, 4), `conf` (N,),
+    `cls` (N,) and `centers` (N, 2), all in pixel coordinates, plus the model's
+    class `names`. Consumers work on these arrays instead of walking the result's
+    boxes one tensor at a time.
+    """
+
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray, names: dict):
+        self.xyxy = np.asarray(xyxy, dtype=float).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=float).reshape(-1)
+        self.cls = np.asarray(cls, dtype=int).reshape(-1)
+        self.names = names
+
+    def __len__(self):
+        return len(self.conf)
+
+    @property
+    def centers(self) -> np.ndarray:
+        return np.column_stack(((self.xyxy[:, 0] + self.xyxy[:, 2]) / 2, (self.xyxy[:, 1] + self.xyxy[:, 3]) / 2))
+
+    @property
+    def labels(self) -> list:
+        return [self.names[c] for c in self.cls.tolist()]
+
+    def filter(self, mask: np.ndarray) -> "Detections":
+        return Detections(self.xyxy[mask], self.conf[mask], self.cls[mask], self.names)
+
+    def filter_label(self, label: str) -> "Detections":
+        """
+        Keep only the detections of the class named `label`.
+        """
+        class_ids = [cls for cls, name in self.names.items() if name == label]
+        return self.filter(np.isin(self.cls, class_ids))
+
+
+def get_detections(results) -> Detections:
+    """
+    Convert the first result of a model call into a Detections object.
+    The conversion is done once per result and cached on it, so the routers and
+    the saving, drawing and trackway helpers can all share it.
+    """
+    result = results[0]
+    detections = getattr(result, "_detections", None)
+    if detections is None:
+        boxes = result.boxes
+        detections = Detections(_to_numpy(boxes.xyxy), _to_numpy(boxes.conf), _to_numpy(boxes.cls), result.names)
+        result._detections = detections
+    return detections
@@ -0,0 +1,115 @@
+import glob
+import os
+import random
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.logger import logger
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.tif", "*.tiff")
+
+
+def _letterbox(image: Image.Image, size: int) -> np.ndarray:
+    """
+    Resize an image to fit a `size` x `size` square, keeping its aspect ratio and padding
+    with grey, then return it as a (1, 3, size, size) float32 array in [0, 1], the
+    same preprocessing ultralytics applies before an exported model.
+    """
+    image = image.convert("RGB")
+    scale = min(size / image.width, size / image.height)
+    new_w, new_h = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+    canvas = Image.new("RGB", (size, size), (114, 114, 114))
+    canvas.paste(image.resize((new_w, new_h), Image.BILINEAR), ((size - new_w) // 2, (size - new_h) // 2))
+    array = np.asarray(canvas, dtype=np.float32) / 255.0
+    return np.transpose(array, (2, 0, 1))[np.newaxis]
+
+
+def sample_calibration_images(image_dir: Optional[str] = None, n_samples: Optional[int] = None, seed: int = 0) -> List[str]:
+    """
+    Pick a reproducible random sample of images to calibrate activation ranges on.
+    """
+    image_dir = image_dir or settings.quantization_calibration_dir
+    n_samples = n_samples or settings.quantization_calibration_samples
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(image_dir, pattern)))
+    if not paths:
+        raise FileNotFoundError(f"No calibration images found in {image_dir}")
+    if len(paths) > n_samples:
+        paths = sorted(random.Random(seed).sample(paths, n_samples))
+    return paths
+
+
+class CalibrationDataReader:
+    """
+    Feeds letterboxed calibration images to ONNX Runtime's static quantizer, one at a time.
+    Implements the `get_next` / `rewind` interface of onnxruntime.quantization.CalibrationDataReader.
+    """
+
+    def __init__(self, image_paths: List[str], input_name: str, img_size: int):
+        self.image_paths = image_paths
+        self.input_name = input_name
+        self.img_size = img_size
+        self._index = 0
+
+    def get_next(self) -> Optional[dict]:
+        if self._index >= len(self.image_paths):
+            return None
+        with Image.open(self.image_paths[self._index]) as image:
+            batch = _letterbox(image, self.img_size)
+        self._index += 1
+        return {self.input_name: batch}
+
+    def rewind(self):
+        self._index = 0
+
+
+def quantize_onnx_model(fp32_path: str, int8_path: str, image_paths: Optional[List[str]] = None) -> str:
+    """
+    Statically quantize an FP32 ONNX detection model to INT8 (QDQ format), calibrating
+    activation ranges on a sample of the validation images.
+    The ultralytics metadata (class names, stride, image size) is carried over so the
+    quantized model loads with YOLO() like the FP32 one.
+    """
+    try:
+        import onnx
+        import onnxruntime
+        from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError as e:
+        raise ImportError(
+            f"INT8 quantization needs the onnx and onnxruntime packages ({e}). "
+            "Install them with: pip install -r requirements.txt"
+        ) from e
+
+    image_paths = image_paths or sample_calibration_images()
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    reader = CalibrationDataReader(image_paths, input_name, settings.img_size)
+
+    preprocessed_path = f"{os.path.splitext(int8_path)[0]}_preprocessed.onnx"
+    logger.info(f"Quantizing {fp32_path} to INT8, calibrating on {len(image_paths)} images")
+    try:
+        quant_pre_process(fp32_path, preprocessed_path)
+        quantize_static(
+            preprocessed_path,
+            int8_path,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    finally:
+        if os.path.exists(preprocessed_path):
+            os.remove(preprocessed_path)
+
+    fp32_model = onnx.load(fp32_path, load_external_data=False)
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+
+    logger.info(f"Saved INT8 model to {int8_path}")
+    return int8_path
@@ -0,0 +1,188 @@
+import glob
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+from app.logger import logger
+
+# Version name of the base (untrained) model, served when there are no trained runs
+BASE_VERSION = "base"
+
+
+class ModelRegistry:
+    """
+    Index of trained model versions with a hot-swappable serving model.
+
+    Each training run under `project_dir` with a `weights/best.pt` is a version, named
+    after its run directory. The index is rebuilt by `scan()` (called once on creation
+    and then by the watcher thread) rather than on every request.
+
+    A new model is loaded and warmed by `load_fn` before it replaces the serving one,
+    so requests never see a cold model. The swap is a single reference assignment:
+    requests that already hold the old model finish on it.
+    """
+
+    def __init__(self, project_dir: str, load_fn: Callable[[str], object], default_path_fn: Callable[[], str], poll_interval: float):
+        self.project_dir = project_dir
+        self.load_fn = load_fn
+        self.default_path_fn = default_path_fn
+        self.poll_interval = poll_interval
+        self._versions = {}
+        self._index_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._current = None  # (version entry, model)
+        self._history = []
+        self._pinned = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.scan()
+
+    def scan(self) -> List[dict]:
+        """
+        Rebuild the index of trained versions from the run directories.
+        """
+        versions = {}
+        for weights_path in glob.glob(os.path.join(self.project_dir, "*", "weights", "best.pt")):
+            version = os.path.basename(os.path.dirname(os.path.dirname(weights_path)))
+            try:
+                versions[version] = {"version": version, "path": weights_path, "mtime": os.path.getmtime(weights_path)}
+            except OSError:
+                continue  # Run directory removed while scanning
+        with self._index_lock:
+            self._versions = versions
+        return self.versions()
+
+    def versions(self) -> List[dict]:
+        with self._index_lock:
+            return sorted(self._versions.values(), key=lambda v: v["mtime"])
+
+    def latest(self) -> Optional[dict]:
+        """
+        The most recently written trained version, or None if there is none.
+        """
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def _get_version(self, version: str) -> dict:
+        with self._index_lock:
+            if version in self._versions:
+                return self._versions[version]
+        if version == BASE_VERSION:
+            return {"version": BASE_VERSION, "path": self.default_path_fn(), "mtime": None}
+        raise KeyError(f"Unknown model version: {version}")
+
+    def _target(self) -> dict:
+        if self._pinned is not None:
+            return self._get_version(self._pinned)
+        latest = self.latest()
+        if latest is not None:
+            return latest
+        return self._get_version(BASE_VERSION)
+
+    def _activate(self, entry: dict, record_history: bool = True):
+        """
+        Load and warm up a version, then swap it in as the serving model.
+        """
+        start = time.perf_counter()
+        model = self.load_fn(entry["path"])
+        previous, self._current = self._current, (entry, model)
+        if previous is not None and record_history:
+            self._history.append(previous[0])
+        logger.info(f"Serving model version {entry['version']} from {entry['path']} (loaded in {time.perf_counter() - start:.2f}s)")
+        return model
+
+    def get_model(self):
+        """
+        Get the serving model, loading the pinned or latest version on first use.
+        """
+        current = self._current
+        if current is not None:
+            return current[1]
+        with self._load_lock:
+            if self._current is None:
+                return self._activate(self._target())
+            return self._current[1]
+
+    def current_version(self) -> Optional[dict]:
+        current = self._current
+        return current[0] if current is not None else None
+
+    def refresh(self):
+        """
+        Rescan the runs and, unless a version is pinned, swap in the latest weights if they changed.
+        Weights written less than `poll_interval` ago are skipped, as training may still be writing them.
+        """
+        self.scan()
+        if self._pinned is not None:
+            return
+        latest = self.latest()
+        current = self.current_version()
+        if latest is None or current is None:
+            return
+        if (latest["version"], latest["mtime"]) == (current["version"], current["mtime"]):
+            return
+        if time.time() - latest["mtime"] < self.poll_interval:
+            return
+        with self._load_lock:
+            self._activate(latest)
+
+    def pin(self, version: str) -> dict:
+        """
+        Serve `version` (a trained version, or "base" for the base model) and stop
+        following new weights until unpinned.
+        """
+        entry = self._get_version(version)
+        with self._load_lock:
+            current = self.current_version()
+            if current is None or (current["version"], current["mtime"]) != (entry["version"], entry["mtime"]):
+                self._activate(entry)
+            self._pinned = version
+        return entry
+
+    def unpin(self):
+        """
+        Go back to following the latest weights.
+        """
+        self._pinned = None
+        self.refresh()
+
+    def rollback(self) -> dict:
+        """
+        Swap back to the previously served version and pin it, so the watcher doesn't
+        upgrade straight back to the version being rolled back from.
+        """
+        with self._load_lock:
+            if not self._history:
+                raise LookupError("No previous model version to roll back to")
+            entry = self._history.pop()
+            self._activate(entry, record_history=False)
+            self._pinned = entry["version"]
+        return entry
+
+    def status(self) -> dict:
+        return {
+            "current": self.current_version(),
+            "pinned": self._pinned,
+            "versions": self.versions(),
+            "history": [entry["version"] for entry in self._history],
+        }
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="model-registry-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error reloading model: {e}")
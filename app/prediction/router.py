@@ -1,15 +1,21 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Depends
 from typing import List, Optional
-from PIL import Image
 import io
 from . import services
+from .postprocessing import get_detections
+from app.detections.writer import get_detection_writer
+from app.concurrency import ServiceBusyError, run_blocking
 from pydantic import BaseModel
 from app.logger import logger
-from app.geospatial.utils import pixel_to_geo
+from app.config import settings
+from app.geospatial.utils import GeoReference
 import tempfile
+import shutil
 import os
 from fastapi.responses import StreamingResponse
 import json
+import zipfile
+from functools import partial
 
 router = APIRouter()
 
@@ -29,62 +35,100 @@ def get_temp_geotiff_path(geotiff_file: UploadFile = File(None)):
             return tmp.name
     return None
 
+def _box_polygon(x1, y1, x2, y2):
+    return {
+        "type": "Polygon",
+        "coordinates": [[
+            [x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]
+        ]]
+    }
+
+def _feature_boxes(xyxy, geotiff_path: Optional[str] = None) -> list:
+    """
+    Get the boxes to put in GeoJSON geometries: geographic boxes if a GeoTIFF is
+    provided, converted all at once with its transform, otherwise the pixel boxes.
+    """
+    if geotiff_path:
+        return GeoReference.from_file(geotiff_path).boxes_to_geo(xyxy).tolist()
+    return xyxy.tolist()
+
+def _prediction_features(prediction, filename: str, geotiff_path: Optional[str] = None) -> List[GeoJSONFeature]:
+    """
+    Convert model results into GeoJSON features.
+    If a GeoTIFF is provided, the coordinates will be in the image's CRS.
+    """
+    detections = get_detections(prediction)
+    return [
+        GeoJSONFeature(
+            geometry=_box_polygon(*box),
+            properties={"score": score, "label": label, "filename": filename}
+        )
+        for box, score, label in zip(_feature_boxes(detections.xyxy, geotiff_path), detections.conf.tolist(), detections.labels)
+    ]
+
+def _predict_tiled(file: UploadFile, geotiff_path: Optional[str]):
+    """
+    Spool the upload to disk and run tiled prediction on it.
+    Geographic boxes come from each tile's window transform when the raster is
+    georeferenced; otherwise the companion GeoTIFF, if any, is used.
+    """
+    suffix = os.path.splitext(file.filename or "")[1] or ".tif"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        shutil.copyfileobj(file.file, tmp)
+        raster_path = tmp.name
+
+    try:
+        detections = services.predict_tiled(raster_path, file.filename)
+    finally:
+        os.remove(raster_path)
+
+    # Boxes without a geographic box from the tiled raster fall back to the companion GeoTIFF
+    boxes = [detection["geo_box"] or detection["box"] for detection in detections]
+    fallback = [i for i, detection in enumerate(detections) if detection["geo_box"] is None]
+    if geotiff_path and fallback:
+        geo_boxes = GeoReference.from_file(geotiff_path).boxes_to_geo([detections[i]["box"] for i in fallback])
+        for i, geo_box in zip(fallback, geo_boxes.tolist()):
+            boxes[i] = geo_box
+
+    features = [
+        GeoJSONFeature(
+            geometry=_box_polygon(*box),
+            properties={"score": detection["score"], "label": detection["label"], "filename": file.filename}
+        )
+        for box, detection in zip(boxes, detections)
+    ]
+
+    logger.info(f"Successfully processed file with tiled prediction: {file.filename}")
+    return GeoJSONFeatureCollection(features=features)
+
 @router.post("/predict/", response_model=GeoJSONFeatureCollection)
 async def predict_image(
     file: UploadFile = File(...),
     geotiff_path: Optional[str] = Depends(get_temp_geotiff_path),
     generate_annotated_image: bool = Form(False),
+    tiled: bool = Form(False),
 ):
     """
     Accept an image and return bounding box predictions as GeoJSON.
     If a GeoTIFF is provided, the coordinates will be in the image's CRS.
     Otherwise, coordinates will be pixel values.
+    With `tiled`, the image is read window by window and predicted on overlapping
+    tiles, which keeps small deer visible in large orthomosaics.
     """
     try:
         logger.info(f"Processing file: {file.filename}")
+        if tiled:
+            return await run_blocking(_predict_tiled, file, geotiff_path)
+
         image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes))
-        prediction = services.predict(image, file.filename, save=generate_annotated_image)
-
-        features = []
-        for box in prediction[0].boxes:
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            score = box.conf[0].item()
-            label = prediction[0].names[int(box.cls[0].item())]
-
-            if geotiff_path:
-                # Convert pixel coordinates to geographic coordinates
-                geo_x1, geo_y1 = pixel_to_geo(x1, y1, geotiff_path)
-                geo_x2, geo_y2 = pixel_to_geo(x2, y2, geotiff_path)
-                # Create a GeoJSON Polygon
-                geometry = {
-                    "type": "Polygon",
-                    "coordinates": [[
-                        [geo_x1, geo_y1],
-                        [geo_x2, geo_y1],
-                        [geo_x2, geo_y2],
-                        [geo_x1, geo_y2],
-                        [geo_x1, geo_y1]
-                    ]]
-                }
-            else:
-                # Use pixel coordinates if no GeoTIFF is provided
-                geometry = {
-                    "type": "Polygon",
-                    "coordinates": [[
-                        [x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]
-                    ]]
-                }
-
-            feature = GeoJSONFeature(
-                geometry=geometry,
-                properties={"score": score, "label": label, "filename": file.filename}
-            )
-            features.append(feature)
+        prediction = await services.predict_async(io.BytesIO(image_bytes), file.filename, save=generate_annotated_image)
+        features = await run_blocking(_prediction_features, prediction, file.filename, geotiff_path)
 
         logger.info(f"Successfully processed file: {file.filename}")
         return GeoJSONFeatureCollection(features=features)
 
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error processing file {file.filename}: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing file {file.filename}")
@@ -92,6 +136,58 @@ async def predict_image(
         if geotiff_path and os.path.exists(geotiff_path):
             os.remove(geotiff_path)
 
+@router.get("/predict/metrics", tags=["Prediction"])
+def prediction_metrics():
+    """
+    Report queue wait and batch fill metrics of the prediction batch scheduler,
+    and the backlog of detections waiting to be written.
+    """
+    metrics = {"batching_enabled": settings.batching_enabled}
+    if settings.batching_enabled:
+        metrics.update(services.get_batch_scheduler().metrics())
+    if settings.detection_write_behind:
+        metrics["detection_writer"] = get_detection_writer().metrics()
+    return metrics
+
+@router.get("/models/", tags=["Prediction"])
+def list_models():
+    """
+    List the indexed model versions, the one being served, whether it is pinned,
+    and the versions that can be rolled back to.
+    """
+    return services.get_model_registry().status()
+
+@router.post("/models/pin", tags=["Prediction"])
+async def pin_model(version: str = Form(...)):
+    """
+    Serve a specific model version and stop picking up new weights until unpinned.
+    """
+    try:
+        entry = await run_blocking(services.get_model_registry().pin, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return {"message": f"Pinned model version {entry['version']}", "current": entry}
+
+@router.post("/models/unpin", tags=["Prediction"])
+async def unpin_model():
+    """
+    Go back to serving the latest trained weights.
+    """
+    registry = services.get_model_registry()
+    await run_blocking(registry.unpin)
+    return {"message": "Following the latest model version", "current": registry.current_version()}
+
+@router.post("/models/rollback", tags=["Prediction"])
+async def rollback_model():
+    """
+    Swap back to the previously served model version and pin it.
+    """
+    try:
+        entry = await run_blocking(services.get_model_registry().rollback)
+    except LookupError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": f"Rolled back to model version {entry['version']}", "current": entry}
+
 @router.post("/predict/stream", tags=["Prediction"])
 async def predict_image_stream(
     file: UploadFile = File(...),
@@ -111,31 +207,30 @@ async def predict_image_stream(
     image_bytes = await file.read()
     file.file.close()
 
+    try:
+        logger.info(f"Streaming processing for file: {file.filename}")
+        # Run the prediction before the response starts, so errors still get a proper status code
+        prediction = await services.predict_stream(io.BytesIO(image_bytes), file.filename, generate_annotated_image)
+    except Exception as e:
+        if geotiff_path and os.path.exists(geotiff_path):
+            os.remove(geotiff_path)
+        if isinstance(e, ServiceBusyError):
+            raise
+        logger.error(f"Error streaming file {file.filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing file {file.filename}")
 
-    async def generate():
+    # A plain generator is iterated in the threadpool, which keeps the rasterio
+    # lookups for geographic coordinates off the event loop.
+    def generate():
         try:
-            logger.info(f"Streaming processing for file: {file.filename}")
-
-            # The predict service will now handle reading the file
-            prediction = await services.predict_stream(io.BytesIO(image_bytes), file.filename, generate_annotated_image)
-
             yield '{"type": "FeatureCollection", "features": ['
             first = True
-            for box in prediction[0].boxes:
+            detections = get_detections(prediction)
+            boxes = _feature_boxes(detections.xyxy, geotiff_path)
+            for box, score, label in zip(boxes, detections.conf.tolist(), detections.labels):
                 if not first:
                     yield ','
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                score = box.conf[0].item()
-                label = prediction[0].names[int(box.cls[0].item())]
-
-                if geotiff_path:
-                    geo_x1, geo_y1 = pixel_to_geo(x1, y1, geotiff_path)
-                    geo_x2, geo_y2 = pixel_to_geo(x2, y2, geotiff_path)
-                    geometry = {"type": "Polygon", "coordinates": [[[geo_x1, geo_y1], [geo_x2, geo_y1], [geo_x2, geo_y2], [geo_x1, geo_y2], [geo_x1, geo_y1]]]}
-                else:
-                    geometry = {"type": "Polygon", "coordinates": [[[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]]]}
-
-                feature = GeoJSONFeature(geometry=geometry, properties={"score": score, "label": label})
+                feature = GeoJSONFeature(geometry=_box_polygon(*box), properties={"score": score, "label": label})
                 yield json.dumps(feature.dict())
                 first = False
             yield ']}'
@@ -151,3 +246,153 @@ async def predict_image_stream(
                 os.remove(geotiff_path)
 
     return StreamingResponse(generate(), media_type="application/json")
+
+
+GEOTIFF_EXTENSIONS = (".tif", ".tiff")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png") + GEOTIFF_EXTENSIONS
+
+def _upload_size(upload: UploadFile) -> int:
+    if upload.size is not None:
+        return upload.size
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    return size
+
+def _open_upload(upload: UploadFile):
+    upload.file.seek(0)
+    return upload.file
+
+def _collect_batch_uploads(files: List[UploadFile], zf: Optional[zipfile.ZipFile], geotiff_files: List[UploadFile]):
+    """
+    Work out the images of a batch request and the GeoTIFFs that georeference them, from
+    names and sizes alone. A GeoTIFF is matched to an image by file stem, e.g. frame_01.jpg and
+    frame_01.tif. Inside a zip, a GeoTIFF with no matching image is treated as an image itself.
+
+    Nothing is read here: images are (filename, open_fn) pairs and GeoTIFFs map a stem to an
+    open_fn, where open_fn returns a binary file object, so each one is read only when
+    inference reaches it. Raises a 413 if a file is larger than `batch_max_file_bytes` or all
+    of them together are larger than `batch_max_total_bytes`. Zip members are measured
+    uncompressed, so a zip bomb is refused before anything is inflated.
+    """
+    images = [(f.filename, partial(_open_upload, f)) for f in files]
+    geotiffs = {os.path.splitext(f.filename)[0]: partial(_open_upload, f) for f in geotiff_files}
+    sizes = [(f.filename, _upload_size(f)) for f in [*files, *geotiff_files]]
+
+    if zf is not None:
+        members = [m for m in zf.infolist() if not m.is_dir() and m.filename.lower().endswith(IMAGE_EXTENSIONS)]
+        image_stems = {
+            os.path.splitext(m.filename)[0] for m in members
+            if not m.filename.lower().endswith(GEOTIFF_EXTENSIONS)
+        }
+        for member in members:
+            stem, ext = os.path.splitext(member.filename)
+            if ext.lower() in GEOTIFF_EXTENSIONS and stem in image_stems:
+                geotiffs[stem] = partial(zf.open, member)
+            else:
+                images.append((member.filename, partial(zf.open, member)))
+            sizes.append((member.filename, member.file_size))
+
+    for name, size in sizes:
+        if size > settings.batch_max_file_bytes:
+            raise HTTPException(status_code=413, detail=f"{name} is larger than {settings.batch_max_file_bytes} bytes")
+    if sum(size for _, size in sizes) > settings.batch_max_total_bytes:
+        raise HTTPException(status_code=413, detail=f"Batch is larger than {settings.batch_max_total_bytes} bytes")
+    return images, geotiffs
+
+def _read_batch_images(images):
+    """
+    Yield (filename, bytes) for each image, reading it only when asked for.
+    """
+    for filename, open_fn in images:
+        with open_fn() as f:
+            image_bytes = f.read(settings.batch_max_file_bytes + 1)
+        if len(image_bytes) > settings.batch_max_file_bytes:
+            raise ValueError(f"{filename} is larger than {settings.batch_max_file_bytes} bytes")
+        yield filename, image_bytes
+
+def _next_batch_collection(predictions, geotiffs: dict, temp_paths: dict) -> Optional[str]:
+    """
+    Run the batch until its next image is predicted and return that image's
+    FeatureCollection as an NDJSON line, or None once every image is done.
+    """
+    item = next(predictions, None)
+    if item is None:
+        return None
+    filename, prediction = item
+    stem = os.path.splitext(filename)[0]
+    geotiff_path = temp_paths.get(stem)
+    if geotiff_path is None and stem in geotiffs:
+        with geotiffs.pop(stem)() as src, tempfile.NamedTemporaryFile(delete=False, suffix=".tif") as tmp:
+            shutil.copyfileobj(src, tmp)
+            geotiff_path = temp_paths[stem] = tmp.name
+
+    features = _prediction_features(prediction, filename, geotiff_path)
+    collection = GeoJSONFeatureCollection(features=features).dict()
+    collection["filename"] = filename
+    return json.dumps(collection) + "\n"
+
+@router.post("/predict/batch", tags=["Prediction"])
+async def predict_batch(
+    files: List[UploadFile] = File([]),
+    archive: UploadFile = File(None),
+    geotiff_files: List[UploadFile] = File([]),
+):
+    """
+    Accept many images, as a multipart list and/or a zip archive, and stream back one
+    GeoJSON FeatureCollection per image as NDJSON while the batch is still running.
+    Images are read from the uploads and the archive, and run through the model,
+    `batch_max_size` at a time. The work runs on the shared executor, so a batch that
+    cannot start because the service is at capacity gets a 503.
+    """
+    zf = None
+    try:
+        if archive:
+            zf = zipfile.ZipFile(archive.file)
+        images, geotiffs = _collect_batch_uploads(files, zf, geotiff_files)
+        if not images:
+            raise HTTPException(status_code=400, detail="No images provided")
+    except (HTTPException, zipfile.BadZipFile) as e:
+        if zf is not None:
+            zf.close()
+        if isinstance(e, zipfile.BadZipFile):
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive {archive.filename}: {e}")
+        raise
+    logger.info(f"Received batch prediction request for {len(images)} images")
+
+    predictions = services.predict_batch(_read_batch_images(images))
+    temp_paths = {}
+
+    def cleanup():
+        predictions.close()
+        if zf is not None:
+            zf.close()
+        for path in temp_paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    try:
+        # Run the first batch before the response starts, so errors still get a proper status code
+        first = await run_blocking(_next_batch_collection, predictions, geotiffs, temp_paths)
+    except Exception as e:
+        cleanup()
+        if isinstance(e, ServiceBusyError):
+            raise
+        logger.error(f"Error during batch prediction: {e}")
+        raise HTTPException(status_code=500, detail="Error during batch prediction")
+
+    async def generate():
+        try:
+            line = first
+            while line is not None:
+                yield line
+                line = await run_blocking(_next_batch_collection, predictions, geotiffs, temp_paths)
+            logger.info(f"Successfully streamed batch prediction for {len(images)} images")
+        except Exception as e:
+            logger.error(f"Error during batch prediction: {e}")
+            # The response has already started streaming, so report the error in-band.
+            yield json.dumps({"error": f"Error during batch prediction: {e}"}) + "\n"
+        finally:
+            cleanup()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
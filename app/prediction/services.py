@@ -1,30 +1,39 @@
 from ultralytics import YOLO
 from app.config import settings
 from PIL import Image, ImageDraw
+import asyncio
 import os
-import glob
+import io
 import json
+import threading
+import time
 from datetime import datetime
 from app.logger import logger
 import pandas as pd
-from ultralytics import YOLO
+import numpy as np
+import rasterio
+from rasterio.windows import Window, transform as window_transform
+from typing import List, Optional
+from app.prediction.batching import BatchScheduler
+from app.prediction.registry import ModelRegistry
+from app.prediction.postprocessing import Detections, get_detections
+from app.prediction.worker_pool import InferencePoolClient, get_authkey
+from app.prediction.quantization import quantize_onnx_model
+from app.concurrency import run_blocking
+from app.detections.store import write_detections
+from app.detections.writer import get_detection_writer
 
 
 def get_latest_model_path():
     """
     Get the path to the latest YOLO model.
-    If a trained model is available, use it. Otherwise, use the base model.
+    If a trained model is available in the registry's index, use it. Otherwise, use the base model.
     If the base model doesn't exist, download it.
     """
-    project_dir = settings.project_name
-    if os.path.isdir(project_dir):
-        list_of_runs = glob.glob(os.path.join(project_dir, '*'))
-        if list_of_runs:
-            latest_run = max(list_of_runs, key=os.path.getctime)
-            weights_path = os.path.join(latest_run, 'weights', 'best.pt')
-            if os.path.exists(weights_path):
-                logger.info(f"Found trained model at {weights_path}")
-                return weights_path
+    latest = get_model_registry().latest()
+    if latest is not None:
+        logger.info(f"Found trained model at {latest['path']}")
+        return latest["path"]
 
     # If no trained model is found, check for the base model
     if os.path.exists(settings.yolo_model_path):
@@ -44,65 +53,253 @@ def get_latest_model_path():
                 "Please ensure you have an internet connection or run the training pipeline."
             )
 
-model = None
+# Export format and the path ultralytics writes the export to, relative to the .pt weights
+INFERENCE_BACKENDS = {
+    "pytorch": None,
+    "onnx": lambda stem: f"{stem}.onnx",
+    "onnx_int8": lambda stem: f"{stem}_int8.onnx",
+    "openvino": lambda stem: f"{stem}_openvino_model",
+}
 
-def get_model():
+def export_model(weights_path: str, backend: Optional[str] = None, force: bool = False) -> str:
+    """
+    Export PyTorch weights for the given inference backend and return the exported model's path.
+    The export is cached next to the weights (e.g. best.onnx next to best.pt) and reused
+    as long as it is newer than the weights.
+    """
+    backend = backend or settings.inference_backend
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unsupported inference backend: {backend}. Choose from {list(INFERENCE_BACKENDS)}")
+    if INFERENCE_BACKENDS[backend] is None:
+        return weights_path
+
+    export_path = INFERENCE_BACKENDS[backend](os.path.splitext(weights_path)[0])
+    if not force and os.path.exists(export_path) and os.path.getmtime(export_path) >= os.path.getmtime(weights_path):
+        logger.info(f"Using cached {backend} export at {export_path}")
+        return export_path
+
+    logger.info(f"Exporting {weights_path} to {backend}...")
+    if backend == "onnx_int8":
+        # Quantize the FP32 ONNX export, calibrating on the validation images
+        fp32_path = export_model(weights_path, backend="onnx", force=force)
+        export_path = quantize_onnx_model(fp32_path, export_path)
+    else:
+        # A dynamic batch axis lets batched calls run as one forward pass instead of one per image
+        export_path = YOLO(weights_path).export(
+            format=backend, imgsz=settings.img_size, dynamic=True, batch=max(1, settings.batch_max_size)
+        )
+    logger.info(f"Exported {backend} model to {export_path}")
+    return str(export_path)
+
+def get_serving_model_path() -> str:
+    """
+    Get the path of the model to serve: the latest weights, exported for the configured backend.
+    """
+    return export_model(get_latest_model_path())
+
+def _warm_up(predict_fn, iterations: Optional[int] = None):
+    """
+    Run dummy inferences at the serving image size, so the first real request doesn't
+    pay for building the graph and first-inference allocations.
     """
-    Load the YOLO model.
+    iterations = settings.warmup_iterations if iterations is None else iterations
+    dummy_image = Image.new("RGB", (settings.img_size, settings.img_size))
+    for _ in range(iterations):
+        predict_fn(dummy_image)
+
+def _load_serving_model(weights_path: str):
+    """
+    Load weights for the configured inference backend and warm them up.
+    Exported models return the same Results structure as the PyTorch one.
     """
-    global model
-    if model is None:
-        model_path = get_latest_model_path()
-        model = YOLO(model_path)
+    model = YOLO(export_model(weights_path), task="detect")
+    _warm_up(model)
     return model
 
-def _draw_bounding_boxes(image: Image.Image, predictions, model):
+registry = None
+_registry_lock = threading.Lock()
+
+def get_model_registry() -> ModelRegistry:
+    """
+    Get the registry of trained model versions, indexing the training runs on first use.
+    """
+    global registry
+    with _registry_lock:
+        if registry is None:
+            registry = ModelRegistry(
+                settings.project_name,
+                _load_serving_model,
+                default_path_fn=lambda: get_latest_model_path(),
+                poll_interval=settings.model_registry_poll_seconds,
+            )
+        return registry
+
+def shutdown_model_registry():
+    """
+    Stop watching for new weights, if the watcher was started.
+    """
+    if registry is not None:
+        registry.stop()
+
+def get_model():
+    """
+    Get the serving YOLO model from the registry.
+    Callers should keep the returned model for the whole request, so a hot swap
+    lets it finish on the model it started with.
+    """
+    return get_model_registry().get_model()
+
+batch_scheduler = None
+_batch_scheduler_lock = threading.Lock()
+
+def get_batch_scheduler() -> BatchScheduler:
+    """
+    Get the shared batch scheduler, starting its worker thread on first use.
+    """
+    global batch_scheduler
+    with _batch_scheduler_lock:
+        if batch_scheduler is None:
+            batch_scheduler = BatchScheduler(
+                lambda images: get_model()(images),
+                max_batch_size=settings.batch_max_size,
+                max_wait_ms=settings.batch_max_wait_ms,
+                max_queue_depth=settings.batch_queue_depth,
+            )
+        batch_scheduler.start()
+        return batch_scheduler
+
+def shutdown_batch_scheduler():
+    """
+    Stop the batch scheduler's worker thread, if it was started.
+    """
+    global batch_scheduler
+    with _batch_scheduler_lock:
+        if batch_scheduler is not None:
+            batch_scheduler.stop()
+            batch_scheduler = None
+
+pool_client = None
+
+def get_pool_client() -> InferencePoolClient:
+    """
+    Get this process's connection to the inference worker pool.
+    """
+    global pool_client
+    if pool_client is None:
+        pool_client = InferencePoolClient(settings.inference_pool_address, get_authkey())
+        logger.info(f"Connected to inference pool at {settings.inference_pool_address}")
+    return pool_client
+
+def shutdown_pool_client():
+    """
+    Close the connection to the inference worker pool, if one was opened.
+    """
+    global pool_client
+    if pool_client is not None:
+        pool_client.close()
+        pool_client = None
+
+def _run_model(model, image: Image.Image):
+    """
+    Run the model on a single image.
+    Inference goes to the worker pool when it is enabled, otherwise through the
+    batch scheduler when batching is enabled, otherwise straight to the local model.
+    """
+    if settings.inference_pool_enabled:
+        return [get_pool_client().predict(image, timeout=settings.inference_pool_timeout)]
+    if settings.batching_enabled:
+        return [get_batch_scheduler().predict(image)]
+    return model(image)
+
+def _run_model_many(model, images: List[Image.Image]) -> list:
+    """
+    Run the model on several images and return one result per image, routed like
+    `_run_model`. Every image is submitted before waiting on any, so the pool's workers
+    share them as separate tasks and the scheduler can put them in the same batch.
+    """
+    if settings.inference_pool_enabled:
+        client = get_pool_client()
+        futures = [client.submit(image) for image in images]
+        return [future.result(timeout=settings.inference_pool_timeout) for future in futures]
+    if settings.batching_enabled:
+        scheduler = get_batch_scheduler()
+        futures = [scheduler.submit(image) for image in images]
+        return [future.result() for future in futures]
+    return model(images)
+
+model_ready = threading.Event()
+
+def warm_up_model(iterations: Optional[int] = None):
+    """
+    Load and warm up the serving model, so the first real request doesn't pay for
+    loading weights. Sets `model_ready` once done.
+    """
+    start = time.perf_counter()
+    if settings.inference_pool_enabled:
+        # The pool warms its own models; this warms the connection
+        _warm_up(lambda image: _run_model(None, image), iterations)
+    else:
+        get_model()
+    model_ready.set()
+    logger.info(f"Model warm-up finished in {time.perf_counter() - start:.2f}s")
+
+def is_model_ready() -> bool:
+    return model_ready.is_set()
+
+def _draw_bounding_boxes(image: Image.Image, predictions):
     """
     Draw bounding boxes on an image.
     """
     draw = ImageDraw.Draw(image)
-    for box in predictions[0].boxes:
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        label = model.names[int(box.cls[0].item())]
-        confidence = box.conf[0].item()
+    detections = get_detections(predictions)
+    for (x1, y1, x2, y2), label, confidence in zip(detections.xyxy.tolist(), detections.labels, detections.conf.tolist()):
         draw.rectangle([x1, y1, x2, y2], outline="red", width=2)
         draw.text((x1, y1), f"{label} ({confidence:.2f})", fill="red")
     return image
 
 
-def _save_detection_points(filename: str, predictions, model):
+def _save_detection_points(filename: str, predictions):
     """
-    Save detection points to a CSV file.
+    Save detection points to the detection store.
     """
-    detections_dir = "detections"
-    os.makedirs(detections_dir, exist_ok=True)
-    detections_file = os.path.join(detections_dir, "detections.csv")
+    _save_deer_detections(filename, get_detections(predictions))
 
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    new_rows = []
-    for box in predictions[0].boxes:
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        x_center = (x1 + x2) / 2
-        y_center = (y1 + y2) / 2
-        score = box.conf[0].item()
-        label = model.names[int(box.cls[0].item())]
-        if label == 'deer':
-            new_rows.append([timestamp, filename, x_center, y_center, score, label])
+def _save_deer_detections(filename: str, detections: Detections):
+    """
+    Save the centers of the deer detections to the detection store.
+    """
+    deer = detections.filter_label('deer')
+    if not len(deer):
+        return
+    centers = deer.centers
+    _append_detection_rows(pd.DataFrame({
+        "timestamp": datetime.now().replace(microsecond=0),
+        "filename": filename,
+        "x_center": centers[:, 0],
+        "y_center": centers[:, 1],
+        "score": deer.conf,
+        "label": 'deer',
+    }))
+
 
-    if not new_rows:
+def _append_detection_rows(df: pd.DataFrame):
+    """
+    Append detection rows (timestamp, filename, x_center, y_center, score, label) to the detection store.
+    With write-behind enabled, rows are only buffered here and written in bulk later.
+    """
+    if df.empty:
         return
 
-    df = pd.DataFrame(new_rows, columns=["timestamp", "filename", "x_center", "y_center", "score", "label"])
+    if settings.detection_write_behind:
+        get_detection_writer().submit(df)
+        return
 
     try:
-        if not os.path.exists(detections_file):
-            df.to_csv(detections_file, index=False)
-        else:
-            df.to_csv(detections_file, mode='a', header=False, index=False)
-        logger.info(f"Saved {len(new_rows)} detection points to {detections_file}")
+        write_detections(df)
+        logger.info(f"Saved {len(df)} detection points to {settings.detections_dir}")
     except Exception as e:
-        logger.error(f"Error saving detection points to {detections_file}: {e}")
+        logger.error(f"Error saving detection points to {settings.detections_dir}: {e}")
 
 
 def predict(image: Image.Image, filename: str, save: bool = False):
@@ -110,11 +307,18 @@ def predict(image: Image.Image, filename: str, save: bool = False):
     Run prediction on a single image.
     Optionally save the annotated image and prediction data.
     """
-    model = get_model()
-    results = model(image)
+    # With the worker pool, the model lives in the pool's processes, not this one
+    model = None if settings.inference_pool_enabled else get_model()
+    results = _run_model(model, image)
+    return _finish_prediction(image, filename, results, save)
 
+def _finish_prediction(image: Image.Image, filename: str, results, save: bool = False):
+    """
+    Save the deer detections of a prediction and, optionally, the annotated image and
+    prediction data.
+    """
     # Save deer detection points for trackway analysis
-    _save_detection_points(filename, results, model)
+    _save_detection_points(filename, results)
 
     if save:
         try:
@@ -125,17 +329,16 @@ def predict(image: Image.Image, filename: str, save: bool = False):
             logger.info(f"Saving prediction results to {prediction_dir}")
 
             # Save annotated image
-            annotated_image = _draw_bounding_boxes(image.copy(), results, model)
+            annotated_image = _draw_bounding_boxes(image.copy(), results)
             annotated_image_path = os.path.join(prediction_dir, f"annotated_{filename}")
             annotated_image.save(annotated_image_path)
 
             # Save prediction data
-            prediction_data = []
-            for box in results[0].boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                score = box.conf[0].item()
-                label = model.names[int(box.cls[0].item())]
-                prediction_data.append({"box": [x1, y1, x2, y2], "score": score, "label": label})
+            detections = get_detections(results)
+            prediction_data = [
+                {"box": box, "score": score, "label": label}
+                for box, score, label in zip(detections.xyxy.tolist(), detections.conf.tolist(), detections.labels)
+            ]
 
             json_path = os.path.join(prediction_dir, "predictions.json")
             with open(json_path, "w") as f:
@@ -148,13 +351,196 @@ def predict(image: Image.Image, filename: str, save: bool = False):
 
     return results
 
-from fastapi import UploadFile
-import io
+def predict_batch(items, batch_size: Optional[int] = None):
+    """
+    Run prediction on many images, `batch_size` images per forward pass, or per round of
+    worker pool tasks when the pool is enabled.
+
+    Args:
+        items: An iterable of (filename, image_bytes) pairs. Images are decoded one
+               batch at a time, so only a single batch is held in memory.
+        batch_size (int, optional): Images per forward pass. Defaults to `settings.batch_max_size`.
+
+    Yields:
+        tuple: (filename, results) for each image, in input order, as soon as its batch finishes.
+    """
+    batch_size = max(1, batch_size or settings.batch_max_size)
+    model = None if settings.inference_pool_enabled else get_model()
+
+    def _run(batch):
+        images = [Image.open(io.BytesIO(image_bytes)) for _, image_bytes in batch]
+        results = _run_model_many(model, images)
+        for (filename, _), result in zip(batch, results):
+            _save_detection_points(filename, [result])
+            yield filename, [result]
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield from _run(batch)
+            batch = []
+    if batch:
+        yield from _run(batch)
+
+
+def _tile_windows(width: int, height: int, tile_size: int, overlap: int):
+    """
+    Yield overlapping windows that cover a raster of the given size.
+    The last row and column of tiles are shifted back so they end on the raster edge.
+    """
+    step = max(tile_size - overlap, 1)
+
+    def _offsets(length):
+        if length <= tile_size:
+            return [0]
+        offsets = list(range(0, length - tile_size + 1, step))
+        if offsets[-1] + tile_size < length:
+            offsets.append(length - tile_size)
+        return offsets
+
+    for row_off in _offsets(height):
+        for col_off in _offsets(width):
+            yield Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+
+
+def _read_tile_image(src, window: Window) -> Image.Image:
+    """
+    Read a raster window as an 8-bit RGB PIL image.
+    """
+    indexes = [1, 2, 3] if src.count >= 3 else [1]
+    data = src.read(indexes, window=window)
+    if data.dtype != np.uint8:
+        data = np.clip(data, 0, 255).astype(np.uint8)
+    data = np.transpose(data, (1, 2, 0))
+    if data.shape[2] == 1:
+        data = np.repeat(data, 3, axis=2)
+    return Image.fromarray(data, "RGB")
+
+
+def _non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression.
+    Returns the indices of the boxes to keep, highest score first.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=int)
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind="stable")
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        union = areas[i] + areas[rest] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+
+def predict_tiled(
+    raster_path: str,
+    filename: str,
+    tile_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    iou_threshold: Optional[float] = None,
+):
+    """
+    Run prediction on a large raster by reading it window by window.
+    Boxes from overlapping tiles are merged with class-aware NMS across tile seams.
+
+    Returns:
+        list: One dict per detection with the pixel box in full-raster coordinates,
+              the geographic box derived from the tile's window transform (None if the
+              raster is not georeferenced), the score and the label.
+    """
+    tile_size = tile_size or settings.tile_size or settings.img_size
+    overlap = settings.tile_overlap if overlap is None else overlap
+    iou_threshold = settings.tile_nms_iou_threshold if iou_threshold is None else iou_threshold
+    model = None if settings.inference_pool_enabled else get_model()
+    names = model.names if model is not None else {}
+
+    boxes, geo_boxes, scores, classes = [], [], [], []
+    with rasterio.open(raster_path) as src:
+        georeferenced = src.crs is not None
+        windows = list(_tile_windows(src.width, src.height, tile_size, overlap))
+        logger.info(f"Running tiled prediction on {filename} ({src.width}x{src.height}) with {len(windows)} tiles")
+
+        # Tiles are read and predicted `batch_max_size` at a time, as pool tasks when the pool is enabled
+        chunk_size = max(1, settings.batch_max_size)
+        for chunk_start in range(0, len(windows), chunk_size):
+            chunk = windows[chunk_start:chunk_start + chunk_size]
+            results = _run_model_many(model, [_read_tile_image(src, window) for window in chunk])
+            for window, result in zip(chunk, results):
+                tile_transform = window_transform(window, src.transform)
+                tile_detections = get_detections([result])
+                names = tile_detections.names
+                xyxy = tile_detections.xyxy
+                boxes.append(xyxy + [window.col_off, window.row_off, window.col_off, window.row_off])
+                if georeferenced:
+                    geo_x1, geo_y1 = tile_transform * (xyxy[:, 0], xyxy[:, 1])
+                    geo_x2, geo_y2 = tile_transform * (xyxy[:, 2], xyxy[:, 3])
+                    geo_boxes.extend(np.column_stack((geo_x1, geo_y1, geo_x2, geo_y2)).tolist())
+                else:
+                    geo_boxes.extend([None] * len(xyxy))
+                scores.append(tile_detections.conf)
+                classes.append(tile_detections.cls)
+
+    boxes = np.concatenate(boxes) if boxes else np.empty((0, 4))
+    scores = np.concatenate(scores) if scores else np.empty(0)
+    classes = np.concatenate(classes) if classes else np.empty(0, dtype=int)
+
+    # Cross-tile NMS per class, so a deer cut by a tile seam is only reported once
+    keep = []
+    for cls in np.unique(classes):
+        idx = np.flatnonzero(classes == cls)
+        keep.extend(idx[_non_max_suppression(boxes[idx], scores[idx], iou_threshold)])
+    keep = np.array(sorted(keep, key=lambda i: -scores[i]), dtype=int)
+
+    detections = [
+        {
+            "box": boxes[i].tolist(),
+            "geo_box": geo_boxes[i],
+            "score": float(scores[i]),
+            "label": names[int(classes[i])],
+        }
+        for i in keep
+    ]
+
+    _save_deer_detections(filename, Detections(boxes[keep], scores[keep], classes[keep], names))
+
+    logger.info(f"Tiled prediction on {filename} kept {len(detections)} of {len(boxes)} boxes after NMS")
+    return detections
+
+async def predict_async(image_bytes: io.BytesIO, filename: str, save: bool = False):
+    """
+    Run prediction on a single encoded image from async code.
+    With batching enabled, the request waits on the scheduler's future without holding
+    an executor thread, so a batch can fill up with more requests than there are executor
+    threads. Otherwise decoding and inference run on the shared executor. Either way,
+    saving the results runs on the executor, off the event loop.
+    """
+    if settings.batching_enabled and not settings.inference_pool_enabled:
+        # Image.open only parses the header; the scheduler's thread decodes the pixels
+        image = Image.open(image_bytes)
+        result = await asyncio.wrap_future(get_batch_scheduler().submit(image))
+        return await run_blocking(_finish_prediction, image, filename, [result], save)
+
+    def _predict():
+        image = Image.open(image_bytes)
+        return predict(image, filename, save)
+
+    return await run_blocking(_predict)
 
 async def predict_stream(image_bytes: io.BytesIO, filename: str, save: bool = False):
     """
     Run prediction on a single image from a BytesIO object.
     This is designed for use with streaming responses.
     """
-    image = Image.open(image_bytes)
-    return predict(image, filename, save)
+    return await predict_async(image_bytes, filename, save)
@@ -0,0 +1,265 @@
+"""
+Multi-process inference worker pool.
+
+The pool is a standalone server: one manager process owns a shared task queue and
+one result queue per API process, and N worker processes each hold a warmed copy of
+the model, pinned to their own slice of the CPU cores. API processes connect to it
+over a local socket, so weights are loaded once per worker rather than once per
+uvicorn worker.
+
+Start it with `python -m app.prediction.worker_pool` (or `make serve-inference-pool`)
+and set `inference_pool_enabled` for the API processes. The manager unpickles what
+authenticated clients send, so both sides must share `inference_pool_authkey`, a
+secret with no default that the pool refuses to start without.
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.managers import BaseManager
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.logger import logger
+from app.prediction.postprocessing import get_detections
+
+_task_queue = queue.Queue()
+_result_queues = {}
+_result_queues_lock = threading.Lock()
+
+
+def _get_task_queue():
+    return _task_queue
+
+
+def _get_result_queue(client_id: str):
+    with _result_queues_lock:
+        if client_id not in _result_queues:
+            _result_queues[client_id] = queue.Queue()
+        return _result_queues[client_id]
+
+
+def _drop_result_queue(client_id: str):
+    with _result_queues_lock:
+        _result_queues.pop(client_id, None)
+
+
+class PoolManager(BaseManager):
+    pass
+
+
+PoolManager.register("get_task_queue", callable=_get_task_queue)
+PoolManager.register("get_result_queue", callable=_get_result_queue)
+PoolManager.register("drop_result_queue", callable=_drop_result_queue)
+
+
+def get_authkey() -> bytes:
+    """
+    The configured pool secret. Raises RuntimeError if it is not set, since anyone
+    holding the key can run code in the pool.
+    """
+    if not settings.inference_pool_authkey:
+        raise RuntimeError(
+            "INFERENCE_POOL_AUTHKEY is not set. Set it to the same random secret for the pool and the API, "
+            "e.g. the output of: python -c 'import secrets; print(secrets.token_hex(32))'"
+        )
+    return settings.inference_pool_authkey.encode()
+
+
+def _parse_address(address: str):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def _cpu_slices(n_workers: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """
+    Split the available CPU cores into `n_workers` contiguous, non-overlapping slices.
+    If there are fewer cores than workers, workers share cores round-robin.
+    """
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if n_workers <= len(cpus):
+        return [list(chunk) for chunk in np.array_split(cpus, n_workers)]
+    return [[cpus[i % len(cpus)]] for i in range(n_workers)]
+
+
+def _pack_results(results) -> np.ndarray:
+    """
+    Flatten a model result into an (N, 6) array of x1, y1, x2, y2, score, class
+    so it can cross the process boundary cheaply.
+    """
+    detections = get_detections(results)
+    return np.column_stack((detections.xyxy, detections.conf, detections.cls)).astype(np.float32)
+
+
+def _unpack_results(data: np.ndarray, image: np.ndarray, names: dict, path: str = ""):
+    """
+    Rebuild an ultralytics Results object from packed boxes, for consumers that
+    expect the same structure as a local `model(image)` call.
+    """
+    import torch
+    from ultralytics.engine.results import Results
+
+    return Results(orig_img=image, path=path, names=names, boxes=torch.from_numpy(data))
+
+
+def _worker_main(worker_id: int, cpus: List[int], address: str, authkey: bytes, model_path: str):
+    """
+    Entry point of a worker process: pin to `cpus`, load and warm the model, then serve tasks.
+    """
+    # Thread counts must be set before torch is imported to take effect in all pools
+    os.environ["OMP_NUM_THREADS"] = str(len(cpus))
+    os.environ["MKL_NUM_THREADS"] = str(len(cpus))
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(len(cpus))
+    model = YOLO(model_path, task="detect")
+    model(Image.new("RGB", (settings.img_size, settings.img_size)), verbose=False)
+    logger.info(f"Inference worker {worker_id} ready on CPUs {cpus} with {model_path}")
+
+    manager = PoolManager(address=_parse_address(address), authkey=authkey)
+    manager.connect()
+    tasks = manager.get_task_queue()
+    result_queues = {}
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        client_id, task_id, image = task
+        if client_id not in result_queues:
+            result_queues[client_id] = manager.get_result_queue(client_id)
+        try:
+            results = model(image, verbose=False)
+            result_queues[client_id].put((task_id, _pack_results(results), model.names, None))
+        except Exception as e:
+            logger.error(f"Inference worker {worker_id} failed on task {task_id}: {e}")
+            result_queues[client_id].put((task_id, None, None, str(e)))
+
+
+def serve_pool(n_workers: Optional[int] = None, address: Optional[str] = None, model_path: Optional[str] = None):
+    """
+    Run the inference pool server in the foreground until interrupted.
+    """
+    from app.prediction.services import get_serving_model_path
+
+    authkey = get_authkey()
+    n_workers = n_workers or settings.inference_pool_workers
+    address = address or settings.inference_pool_address
+    model_path = model_path or get_serving_model_path()
+
+    manager = PoolManager(address=_parse_address(address), authkey=authkey)
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, name="inference-pool-manager", daemon=True).start()
+    logger.info(f"Inference pool listening on {address}")
+
+    ctx = get_context("spawn")
+    workers = []
+    for worker_id, cpus in enumerate(_cpu_slices(n_workers)):
+        process = ctx.Process(
+            target=_worker_main,
+            args=(worker_id, cpus, address, authkey, model_path),
+            name=f"inference-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        workers.append(process)
+
+    try:
+        while all(p.is_alive() for p in workers):
+            time.sleep(1)
+        logger.critical("An inference worker exited unexpectedly, shutting down the pool.")
+    except KeyboardInterrupt:
+        logger.info("Shutting down inference pool.")
+    finally:
+        for _ in workers:
+            _task_queue.put(None)
+        for process in workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+class InferencePoolClient:
+    """
+    Client used by an API process to dispatch images to the inference pool.
+    A receiver thread hands each result back to the caller that submitted it.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.client_id = uuid.uuid4().hex
+        self._manager = PoolManager(address=_parse_address(address), authkey=authkey)
+        self._manager.connect()
+        self._tasks = self._manager.get_task_queue()
+        self._results = self._manager.get_result_queue(self.client_id)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._receiver = threading.Thread(target=self._receive, name="inference-pool-receiver", daemon=True)
+        self._receiver.start()
+
+    def _receive(self):
+        while not self._closed.is_set():
+            try:
+                task_id, data, names, error = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, ConnectionError, BrokenPipeError) as e:
+                logger.error(f"Lost connection to the inference pool: {e}")
+                self._fail_pending(e)
+                return
+            with self._lock:
+                future, image = self._pending.pop(task_id, (None, None))
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"Inference pool error: {error}"))
+            else:
+                future.set_result(_unpack_results(data, np.asarray(image), names))
+
+    def _fail_pending(self, exc: Exception):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(exc)
+
+    def submit(self, image: Image.Image) -> Future:
+        image = image.convert("RGB")
+        task_id = uuid.uuid4().hex
+        future = Future()
+        with self._lock:
+            self._pending[task_id] = (future, image)
+        self._tasks.put((self.client_id, task_id, image))
+        return future
+
+    def predict(self, image: Image.Image, timeout: Optional[float] = None):
+        """
+        Send an image to the pool and block until its Results come back.
+        """
+        return self.submit(image).result(timeout)
+
+    def close(self):
+        self._closed.set()
+        self._receiver.join(timeout=2)
+        try:
+            self._manager.drop_result_queue(self.client_id)
+        except Exception:
+            pass
+        self._fail_pending(RuntimeError("Inference pool client closed"))
+
+
+if __name__ == "__main__":
+    try:
+        serve_pool()
+    except RuntimeError as e:
+        raise SystemExit(str(e))
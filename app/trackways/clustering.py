@@ -0,0 +1,390 @@
+from collections import defaultdict
+from itertools import chain
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy.cluster.hierarchy import DisjointSet
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+_NEIGHBOUR_OFFSETS_2D = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+_NEIGHBOUR_OFFSETS_3D = [(dx, dy, dt) for dx, dy in _NEIGHBOUR_OFFSETS_2D for dt in (-1, 0, 1)]
+
+
+class IncrementalDBSCAN:
+    """
+    DBSCAN that takes points in batches and updates its clusters instead of
+    re-clustering everything.
+
+    Points are never removed, so a point that becomes a core point stays one. Each
+    insertion only touches the neighbourhoods of the new points. Neighbour counts are
+    raised, new core points are linked to the core points within `eps` (union-find),
+    and border points are attached to a neighbouring core point. A grid of `eps`-sized
+    cells serves the neighbourhood queries. The clusters match a from-scratch
+    `sklearn.cluster.DBSCAN(eps, min_samples)` run on the same points, up to label
+    numbering and which cluster claims a border point reachable from two.
+
+    Cluster labels are stable: a cluster keeps its label as it grows, and when two
+    clusters are merged by a bridging point the merged one keeps the lower label.
+
+    With `time_eps`, clustering is spatio-temporal (ST-DBSCAN): two points are only
+    neighbours if they are also at most `time_eps` apart in time, and the grid gains a
+    time axis of `time_eps`-long cells.
+
+    The first batch is clustered in bulk with `st_dbscan` (`chunk_size` and `n_jobs`
+    are passed on), and the union-find, counts and grid are seeded from its result.
+    Point-by-point insertion is only used for the batches after it.
+    """
+
+    def __init__(
+        self,
+        eps: float,
+        min_samples: int,
+        time_eps: Optional[float] = None,
+        chunk_size: int = 1_000_000,
+        n_jobs: int = 1,
+    ):
+        self.eps = eps
+        self.min_samples = min_samples
+        self.time_eps = time_eps
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self._xy = np.empty((0, 2), dtype=float)
+        self._t = np.empty(0, dtype=float)
+        self._size = 0
+        self._grid = defaultdict(list)
+        self._counts = []
+        self._core = []
+        self._parent = {}
+        self._root_label = {}
+        self._border_owner = {}
+        self._members: Dict[int, List[int]] = {}
+        self._next_label = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def labels(self) -> List[int]:
+        return list(self._members)
+
+    def members(self, label: int) -> List[int]:
+        """
+        Indices, in insertion order, of the points in a cluster.
+        """
+        return sorted(self._members[label])
+
+    def label_of(self, index: int) -> Optional[int]:
+        """
+        The cluster label of a point, or None for noise.
+        """
+        if self._core[index]:
+            return self._root_label[self._find(index)]
+        owner = self._border_owner.get(index)
+        return self._root_label[self._find(owner)] if owner is not None else None
+
+    def _cell(self, index: int) -> Tuple[int, ...]:
+        x, y = self._xy[index]
+        cell = (int(np.floor(x / self.eps)), int(np.floor(y / self.eps)))
+        if self.time_eps is not None:
+            cell += (int(np.floor(self._t[index] / self.time_eps)),)
+        return cell
+
+    def _region(self, index: int) -> np.ndarray:
+        x, y = self._xy[index]
+        cell = self._cell(index)
+        offsets = _NEIGHBOUR_OFFSETS_3D if self.time_eps is not None else _NEIGHBOUR_OFFSETS_2D
+        candidates = [
+            i for offset in offsets
+            for i in self._grid.get(tuple(c + o for c, o in zip(cell, offset)), ())
+        ]
+        candidates = np.asarray(candidates, dtype=int)
+        within = np.hypot(self._xy[candidates, 0] - x, self._xy[candidates, 1] - y) <= self.eps
+        if self.time_eps is not None:
+            within &= np.abs(self._t[candidates] - self._t[index]) <= self.time_eps
+        return candidates[within]
+
+    def _find(self, index: int) -> int:
+        root = index
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[index] != root:
+            self._parent[index], index = root, self._parent[index]
+        return root
+
+    def _union(self, a: int, b: int, removed: Set[int]):
+        ra, rb = self._find(a), self._find(b)
+        if ra == rb:
+            return
+        la, lb = self._root_label.pop(ra, None), self._root_label.pop(rb, None)
+        self._parent[rb] = ra
+        if la is None or lb is None:
+            label = la if lb is None else lb
+        else:
+            label, dropped = min(la, lb), max(la, lb)
+            self._members[label].extend(self._members.pop(dropped))
+            removed.add(dropped)
+        if label is not None:
+            self._root_label[ra] = label
+
+    def add(self, points: np.ndarray, times: Optional[np.ndarray] = None) -> Tuple[Set[int], Set[int]]:
+        """
+        Insert points, given as an (N, 2) array, and update the clusters. With `time_eps`,
+        `times` gives each point's time as a number (e.g. seconds) in the unit of `time_eps`.
+        Returns the labels of clusters that gained points or were merged into,
+        and the labels of clusters that no longer exist because they were merged away.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            return set(), set()
+        if self.time_eps is not None and times is None:
+            raise ValueError("times are required for spatio-temporal clustering")
+        if self._size == 0:
+            return self._load(points, times)
+
+        start = self._size
+        if start + len(points) > len(self._xy):
+            capacity = max(2 * len(self._xy), start + len(points))
+            grown = np.empty((capacity, 2), dtype=float)
+            grown[:start] = self._xy[:start]
+            self._xy = grown
+            grown_t = np.empty(capacity, dtype=float)
+            grown_t[:start] = self._t[:start]
+            self._t = grown_t
+        self._xy[start:start + len(points)] = points
+        if times is not None:
+            self._t[start:start + len(points)] = np.asarray(times, dtype=float)
+        self._size += len(points)
+        new_indices = range(start, self._size)
+        for index in new_indices:
+            self._grid[self._cell(index)].append(index)
+            self._counts.append(0)
+            self._core.append(False)
+
+        # Raise neighbour counts: a new point counts its whole neighbourhood, and
+        # existing points each count the new points that fall in theirs
+        regions = {}
+        became_core = []
+        for index in new_indices:
+            region = regions[index] = self._region(index)
+            self._counts[index] = len(region)
+            for neighbour in region[region < start]:
+                self._counts[neighbour] += 1
+                if not self._core[neighbour] and self._counts[neighbour] >= self.min_samples:
+                    became_core.append(int(neighbour))
+        became_core.extend(i for i in new_indices if self._counts[i] >= self.min_samples)
+        became_core = list(dict.fromkeys(became_core))
+
+        removed = set()
+        for index in became_core:
+            # A former border point leaves its owner's cluster before it joins as a core point
+            self._discard_member(index)
+            self._core[index] = True
+            self._parent[index] = index
+        for index in became_core:
+            region = regions[index] if index in regions else self._region(index)
+            regions[index] = region
+            for neighbour in region:
+                if self._core[neighbour]:
+                    self._union(index, int(neighbour), removed)
+
+        # Core components without a label are new clusters
+        touched = set()
+        for index in became_core:
+            root = self._find(index)
+            if root not in self._root_label:
+                self._root_label[root] = self._next_label
+                self._members[self._next_label] = []
+                self._next_label += 1
+        for index in became_core:
+            label = self._root_label[self._find(index)]
+            self._members[label].append(index)
+            touched.add(label)
+
+        # Attach border points: new non-core points next to a core point, and
+        # existing noise points next to a new core point
+        candidates = [i for i in new_indices if not self._core[i]]
+        for index in became_core:
+            candidates.extend(int(n) for n in regions[index] if not self._core[n] and n not in self._border_owner)
+        for index in dict.fromkeys(candidates):
+            if index in self._border_owner:
+                continue
+            region = regions[index] if index in regions else self._region(index)
+            owners = [int(n) for n in region if self._core[n]]
+            if owners:
+                self._border_owner[index] = owners[0]
+                label = self._root_label[self._find(owners[0])]
+                self._members[label].append(index)
+                touched.add(label)
+
+        return {label for label in touched if label in self._members}, removed
+
+    def _load(self, points: np.ndarray, times: Optional[np.ndarray]) -> Tuple[Set[int], Set[int]]:
+        labels, counts = _st_dbscan(points, self.eps, self.min_samples, times, self.time_eps, self.chunk_size, self.n_jobs)
+        n = len(points)
+        self._xy = points.copy()
+        self._t = np.asarray(times, dtype=float).copy() if times is not None else np.zeros(n)
+        self._size = n
+        self._counts = counts.tolist()
+        core = counts >= self.min_samples
+        self._core = core.tolist()
+
+        cells = np.floor(points / self.eps).astype(np.int64)
+        if self.time_eps is not None:
+            cells = np.column_stack((cells, np.floor(self._t / self.time_eps).astype(np.int64)))
+        for cell, indices in zip(*_group(cells)):
+            self._grid[tuple(cell)] = indices
+
+        # Every cluster has a core point. The first one of each becomes the root of the
+        # cluster's core points, and the owner of its border points
+        core_index = np.flatnonzero(core)
+        cluster_labels, first = np.unique(labels[core_index], return_index=True)
+        root_of = np.empty(len(cluster_labels), dtype=np.int64)
+        root_of[cluster_labels] = core_index[first]
+        self._parent = dict(zip(core_index.tolist(), root_of[labels[core_index]].tolist()))
+        self._root_label = dict(zip(root_of.tolist(), cluster_labels.tolist()))
+        border_index = np.flatnonzero(~core & (labels >= 0))
+        self._border_owner = dict(zip(border_index.tolist(), root_of[labels[border_index]].tolist()))
+        clustered = np.flatnonzero(labels >= 0)
+        self._members = dict(zip(*_group(labels[clustered], clustered)))
+        self._next_label = len(cluster_labels)
+        return set(self._members), set()
+
+    def _discard_member(self, index: int):
+        owner = self._border_owner.pop(index, None)
+        if owner is not None:
+            self._members[self._root_label[self._find(owner)]].remove(index)
+
+
+def _group(keys: np.ndarray, values: Optional[np.ndarray] = None) -> Tuple[list, List[List[int]]]:
+    """
+    Distinct keys (rows of a 2D array, or values of a 1D one) and the positions, or
+    `values`, at each, in their original order.
+    """
+    distinct, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind="stable")
+    values = (order if values is None else values[order]).tolist()
+    bounds = np.r_[0, np.cumsum(np.bincount(inverse, minlength=len(distinct)))].tolist()
+    return distinct.tolist(), [values[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def st_dbscan(
+    xy: np.ndarray,
+    eps: float,
+    min_samples: int,
+    times: Optional[np.ndarray] = None,
+    time_eps: Optional[float] = None,
+    chunk_size: int = 1_000_000,
+    n_jobs: int = 1,
+) -> np.ndarray:
+    """
+    Batch DBSCAN over a KD-tree, returning a label per point (-1 for noise) like
+    `sklearn.cluster.DBSCAN(eps, min_samples).labels_`. With `times` and `time_eps`,
+    clustering is spatio-temporal (ST-DBSCAN), as in IncrementalDBSCAN.
+
+    Points are processed in time-sorted chunks of `chunk_size`. Each chunk's KD-tree
+    holds only the chunk and the points within `time_eps` before and after it, so
+    memory is bounded by the chunk size and the detection rate rather than by the
+    total number of points. Clusters that span chunks are joined through the overlap.
+    Without `time_eps` every chunk has to see all points. `n_jobs` is passed to the
+    KD-tree queries (-1 uses all cores).
+    """
+    return _st_dbscan(xy, eps, min_samples, times, time_eps, chunk_size, n_jobs)[0]
+
+
+def _st_dbscan(xy, eps, min_samples, times, time_eps, chunk_size, n_jobs) -> Tuple[np.ndarray, np.ndarray]:
+    # st_dbscan, also returning the neighbour count of each point (itself included)
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    n = len(xy)
+    if n == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    if time_eps is not None:
+        times = np.asarray(times, dtype=float)
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+    else:
+        order = np.arange(n)
+    xy = xy[order]
+
+    windows = []
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        if time_eps is None:
+            low, high = 0, n
+        else:
+            low = int(np.searchsorted(times, times[start] - time_eps, side="left"))
+            high = int(np.searchsorted(times, times[end - 1] + time_eps, side="right"))
+        windows.append((start, end, low, high))
+
+    def neighbours(start, end, low, high):
+        # (i, j) pairs of a chunk point i and a neighbour j in its window, self included
+        tree = cKDTree(xy[low:high])
+        lists = tree.query_ball_point(xy[start:end], eps, workers=n_jobs)
+        lengths = np.fromiter(map(len, lists), dtype=int, count=end - start)
+        i = np.repeat(np.arange(start, end), lengths)
+        j = np.fromiter(chain.from_iterable(lists), dtype=int, count=int(lengths.sum())) + low
+        if time_eps is not None:
+            close = np.abs(times[i] - times[j]) <= time_eps
+            i, j = i[close], j[close]
+        return i, j
+
+    # A single window's neighbour pairs are kept for the second pass rather than queried twice
+    pairs = {}
+    counts = np.zeros(n, dtype=np.int64)
+    for start, end, low, high in windows:
+        i, j = neighbours(start, end, low, high)
+        if len(windows) == 1:
+            pairs[start] = (i, j)
+        counts[start:end] = np.bincount(i - start, minlength=end - start)
+    core = counts >= min_samples
+
+    # Core points are linked per window with connected components. A core point seen by
+    # two windows ties their component ids together, resolved at the end
+    cluster = np.full(n, -1, dtype=np.int64)
+    border_owner = np.full(n, -1, dtype=np.int64)
+    equivalent = []
+    next_id = 0
+    for start, end, low, high in windows:
+        i, j = pairs.pop(start, None) or neighbours(start, end, low, high)
+        linked = core[i] & core[j]
+        graph = coo_matrix((np.ones(linked.sum(), dtype=bool), (i[linked] - low, j[linked] - low)), shape=(high - low, high - low))
+        _, components = connected_components(graph, directed=False)
+        in_graph = np.zeros(high - low, dtype=bool)
+        in_graph[i[linked] - low] = True
+        in_graph[j[linked] - low] = True
+        nodes = np.flatnonzero(in_graph) + low
+        ids = components[nodes - low] + next_id
+        previous = cluster[nodes]
+        seen = previous >= 0
+        equivalent.extend(set(zip(ids[seen].tolist(), previous[seen].tolist())))
+        cluster[nodes] = ids
+        next_id = int(ids.max()) + 1 if len(ids) else next_id
+
+        # Non-core points next to a core point are border points of its cluster
+        attach = ~core[i] & core[j] & (border_owner[i] < 0)
+        border, first = np.unique(i[attach], return_index=True)
+        border_owner[border] = j[attach][first]
+
+    components = DisjointSet(range(next_id))
+    for a, b in equivalent:
+        components.merge(a, b)
+    roots = np.array([components[c] for c in range(next_id)], dtype=np.int64)
+
+    sorted_labels = np.full(n, -1, dtype=np.int64)
+    sorted_labels[core] = roots[cluster[core]]
+    borders = border_owner >= 0
+    sorted_labels[borders] = sorted_labels[border_owner[borders]]
+
+    labels = np.empty(n, dtype=np.int64)
+    labels[order] = sorted_labels
+    neighbour_counts = np.empty(n, dtype=np.int64)
+    neighbour_counts[order] = counts
+    # Number clusters by their first point, in input order
+    clustered = labels >= 0
+    _, first_index, inverse = np.unique(labels[clustered], return_index=True, return_inverse=True)
+    rank = np.empty(len(first_index), dtype=np.int64)
+    rank[np.argsort(first_index, kind="stable")] = np.arange(len(first_index))
+    labels[clustered] = rank[inverse]
+    return labels, neighbour_counts
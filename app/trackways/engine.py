@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.detections.store import read_new_detections
+from app.logger import logger
+from app.trackways.clustering import IncrementalDBSCAN
+
+# Approximate memory per point of the clustering state (grid, counts, union-find) and
+# of a point record in an analysis, on top of the detection rows themselves
+CLUSTER_BYTES_PER_POINT = 300
+RECORD_BYTES_PER_POINT = 500
+
+
+class TrackwayEngine:
+    """
+    Keeps the trackway clusters of one query (time window, bounding box and ST-DBSCAN
+    parameters) up to date as detections arrive.
+
+    Each update reads only the detections written since the previous one, inserts them
+    into an IncrementalDBSCAN and re-runs `analyze_fn` on the clusters that changed.
+    `analyze_fn(rows, labels)` analyzes all of them in one call and returns a dict of
+    analyses (None for rejected clusters) keyed on label. The analyses of untouched
+    clusters are kept. Everything is re-analyzed when `context` changes (e.g. the
+    habitat map was replaced), and the engine starts over if the store lost detections
+    it had already read. `nbytes` estimates the memory the engine holds.
+    """
+
+    def __init__(
+        self,
+        start_date=None,
+        end_date=None,
+        bbox: Optional[Sequence[float]] = None,
+        eps: float = 50.0,
+        min_samples: int = 5,
+        time_eps: Optional[float] = None,
+        analyze_fn: Callable[[pd.DataFrame, np.ndarray], dict] = None,
+        chunk_size: int = 1_000_000,
+        n_jobs: int = 1,
+    ):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.bbox = bbox
+        self.eps = eps
+        self.min_samples = min_samples
+        self.time_eps = time_eps
+        self.analyze_fn = analyze_fn
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._dbscan = IncrementalDBSCAN(self.eps, self.min_samples, self.time_eps, self.chunk_size, self.n_jobs)
+        self._chunks = []
+        self._rows_bytes = 0
+        self.nbytes = 0
+        self._seen = None
+        self._context = None
+        self._analyses = {}
+
+    def _all_rows(self) -> pd.DataFrame:
+        if len(self._chunks) > 1:
+            self._chunks = [pd.concat(self._chunks, ignore_index=True)]
+        return self._chunks[0]
+
+    def update(self, context: Hashable = None) -> dict:
+        """
+        Catch up with the detection store and return the analyses of all valid
+        trackways, keyed on cluster label.
+        """
+        with self._lock:
+            new_rows, seen, lost = read_new_detections(self.start_date, self.end_date, self.bbox, self._seen)
+            if lost:
+                logger.info("Detections were removed from the store; re-clustering trackways from scratch.")
+                self._reset()
+                new_rows, seen, _ = read_new_detections(self.start_date, self.end_date, self.bbox, None)
+            self._seen = seen
+
+            changed, removed = set(), set()
+            if not new_rows.empty:
+                # Insert in time order, so cluster labels do not depend on file order
+                new_rows = new_rows.sort_values("timestamp", kind="stable").reset_index(drop=True)
+                self._chunks.append(new_rows)
+                self._rows_bytes += int(new_rows.memory_usage(deep=True).sum())
+                seconds = new_rows["timestamp"].to_numpy(dtype="datetime64[us]").astype(np.int64) / 1e6
+                changed, removed = self._dbscan.add(new_rows[["x_center", "y_center"]].to_numpy(dtype=float), seconds)
+            if context != self._context:
+                changed = set(self._dbscan.labels)
+                self._context = context
+
+            for label in removed:
+                self._analyses.pop(label, None)
+            if changed:
+                members = [self._dbscan.members(label) for label in changed]
+                index = np.concatenate(members)
+                labels = np.repeat(list(changed), [len(m) for m in members])
+                self._analyses.update(self.analyze_fn(self._all_rows().iloc[index], labels))
+                logger.info(f"Re-analyzed {len(changed)} of {len(self._dbscan.labels)} trackway clusters.")
+
+            results = {label: analysis for label, analysis in sorted(self._analyses.items()) if analysis is not None}
+            records = sum(len(analysis["points"]) for analysis in results.values())
+            self.nbytes = self._rows_bytes + len(self._dbscan) * CLUSTER_BYTES_PER_POINT + records * RECORD_BYTES_PER_POINT
+            return results
+
+
+class TrackwayEngines:
+    """
+    LRU of TrackwayEngine instances, one per distinct query, so repeated and polling
+    queries reuse their clusters.
+
+    The least recently used engines are dropped once there are more than `max_engines`
+    or their estimated memory (`TrackwayEngine.nbytes`) exceeds `max_bytes`. An engine
+    that alone is larger than `max_bytes` is dropped after its update.
+    """
+
+    def __init__(self, max_engines: int, max_bytes: int):
+        self.max_engines = max_engines
+        self.max_bytes = max_bytes
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, factory: Callable[[], TrackwayEngine]) -> TrackwayEngine:
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = self._engines[key] = factory()
+            self._engines.move_to_end(key)
+            self._trim()
+            return engine
+
+    def update(self, key: Hashable, factory: Callable[[], TrackwayEngine], context: Hashable = None) -> dict:
+        """
+        Update the engine of a query, creating it if needed, and return its analyses.
+        """
+        results = self.get(key, factory).update(context)
+        with self._lock:
+            self._trim()
+        return results
+
+    def _trim(self):
+        for key in [key for key, engine in self._engines.items() if engine.nbytes > self.max_bytes]:
+            del self._engines[key]
+        total = sum(engine.nbytes for engine in self._engines.values())
+        while len(self._engines) > self.max_engines or total > self.max_bytes:
+            _, engine = self._engines.popitem(last=False)
+            total -= engine.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._engines.clear()
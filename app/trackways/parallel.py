@@ -0,0 +1,73 @@
+"""
+Per-trackway statistics that cannot be vectorized (habitat lookup and Moran's I),
+optionally sharded across a process pool.
+
+Trackways are shipped to the workers as flat NumPy arrays with segment offsets rather
+than as DataFrames, which keeps the pickled payload close to the raw coordinates.
+Shards are contiguous runs of trackways and their results are concatenated in shard
+order, and Moran's I permutations are seeded per trackway, so the output is the same
+whether it runs serially or in parallel.
+"""
+from typing import List, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+
+from app.concurrency import get_process_pool
+from app.config import settings
+from app.geospatial.services import calculate_morans_i
+from app.gis_integration.services import get_habitat_types_for_coords
+
+TrackwayStats = Tuple[Optional[int], Optional[float], Optional[float]]
+
+
+def trackway_stats(x, y, speed, offsets, centroids, seeds, habitat_map_path) -> List[TrackwayStats]:
+    """
+    Compute (habitat_type, morans_i, morans_i_p_value) for each trackway.
+    Trackway i is made of points offsets[i]:offsets[i + 1] of x, y and speed.
+    """
+    habitat_types = get_habitat_types_for_coords(centroids[:, 0], centroids[:, 1], habitat_map_path) if len(seeds) else []
+    stats = []
+    for i, seed in enumerate(seeds):
+        start, end = offsets[i], offsets[i + 1]
+        habitat_type = habitat_types[i]
+        gdf_points = gpd.GeoDataFrame({"speed": speed[start:end]}, geometry=gpd.points_from_xy(x[start:end], y[start:end]))
+        morans_i, morans_p = calculate_morans_i(gdf_points, "speed", seed=int(seed))
+        stats.append((habitat_type, morans_i, morans_p))
+    return stats
+
+
+def _shards(offsets: np.ndarray, n_shards: int):
+    """
+    Split trackways into contiguous shards with about the same number of points each.
+    """
+    bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], n_shards + 1)[1:-1])
+    bounds = np.unique(np.r_[0, bounds, len(offsets) - 1])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def map_trackway_stats(x, y, speed, offsets, centroids, seeds, habitat_map_path) -> List[TrackwayStats]:
+    """
+    Compute trackway_stats serially, or across the process pool when
+    `trackway_parallel_enabled` is set and there are enough trackways to pay for it.
+    """
+    n_trackways = len(seeds)
+    if not settings.trackway_parallel_enabled or n_trackways < settings.trackway_parallel_min_trackways:
+        return trackway_stats(x, y, speed, offsets, centroids, seeds, habitat_map_path)
+
+    pool = get_process_pool()
+    futures = []
+    # A few shards per worker evens out trackways of very different sizes
+    for first, last in _shards(offsets, settings.process_pool_size * 4):
+        start, end = offsets[first], offsets[last]
+        futures.append(pool.submit(
+            trackway_stats,
+            x[start:end],
+            y[start:end],
+            speed[start:end],
+            offsets[first:last + 1] - start,
+            centroids[first:last],
+            seeds[first:last],
+            habitat_map_path,
+        ))
+    return [stats for future in futures for stats in future.result()]
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Depends, Body
-from typing import Optional
+from typing import List, Optional
 from . import services
 from app.logger import logger
 import os
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from app.prediction.router import get_temp_geotiff_path
+from app.concurrency import ServiceBusyError, run_blocking
 
 
 router = APIRouter()
@@ -12,6 +13,10 @@ router = APIRouter()
 class TrackwayAnalysisRequest(BaseModel):
     start_date: Optional[str] = None
     end_date: Optional[str] = None
+    bbox: Optional[List[float]] = None  # min_x, min_y, max_x, max_y
+    eps: Optional[float] = Field(None, gt=0)  # Spatial clustering radius, defaults to settings
+    min_samples: Optional[int] = Field(None, ge=1)
+    time_eps: Optional[float] = Field(None, gt=0)  # Temporal clustering radius in seconds; null clusters on space only
     geotiff: Optional[UploadFile] = None
 
 
@@ -24,10 +29,16 @@ def analyze_trackways_endpoint(
     """
     try:
         logger.info(f"Received request to analyze trackways from {request.start_date} to {request.end_date}")
-        results = services.analyze_trackways(request.start_date, request.end_date)
+        if request.bbox is not None and len(request.bbox) != 4:
+            raise HTTPException(status_code=400, detail="bbox must be [min_x, min_y, max_x, max_y]")
+        # Only parameters given in the request override settings, so an explicit null time_eps is kept
+        clustering = request.model_dump(include={"eps", "min_samples", "time_eps"}, exclude_unset=True)
+        results = services.analyze_trackways(request.start_date, request.end_date, request.bbox, **clustering)
         if results is None:
             return {"message": "No trackways found or an error occurred."}
         return results
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during trackway analysis: {e}")
         raise HTTPException(status_code=500, detail="Error during trackway analysis")
@@ -46,6 +57,8 @@ async def analyze_trackways_from_image_endpoint(
         if results is None:
             return {"message": "No trackways found or an error occurred."}
         return results
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error during trackway analysis from image: {e}")
         raise HTTPException(status_code=500, detail="Error during trackway analysis from image")
@@ -59,13 +72,15 @@ async def extract_features_endpoint(file: UploadFile = File(...)):
     try:
         image_bytes = await file.read()
         logger.info(f"Received request to extract features from {file.filename}")
-        lines = services.extract_linear_features(image_bytes)
+        lines = await run_blocking(services.extract_linear_features, image_bytes)
 
         if lines is None:
             raise HTTPException(status_code=500, detail="Error extracting features")
 
         return {"filename": file.filename, "features": lines}
 
+    except ServiceBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error during feature extraction: {e}")
         raise HTTPException(status_code=500, detail=f"Error during feature extraction: {str(e)}")
@@ -1,148 +1,220 @@
 import pandas as pd
-from sklearn.cluster import DBSCAN
 import os
 from app.logger import logger
-from app.trackways.validation import is_biologically_plausible
-from typing import Optional
+from app.trackways.validation import plausible_trackways
+from typing import Optional, Sequence
 import cv2
 import numpy as np
 import geopandas as gpd
 from shapely.geometry import Point
-from app.gis_integration.services import get_habitat_type_for_coord
 from app.config import settings
-from app.geospatial.services import calculate_morans_i, calculate_distance_to_nearest_feature
+from app.detections.store import data_version
+from app.caching import ResultCache
+from app.trackways.clustering import st_dbscan
+from app.trackways.engine import TrackwayEngine, TrackwayEngines
+from app.trackways.parallel import map_trackway_stats
+from app.geospatial.services import calculate_distance_to_nearest_feature
 
-detections_file = "detections/detections.csv"
+trackway_cache = ResultCache(settings.trackway_cache_max_entries, settings.trackway_cache_max_bytes)
+trackway_engines = TrackwayEngines(settings.trackway_engine_max_engines, settings.trackway_engine_max_bytes)
 
-def _calc_displacement(trj):
-    return np.sqrt(np.power(trj.x.shift(1) - trj.x, 2) + np.power(trj.y.shift(1) - trj.y, 2))
-
-def analyze_trackways(start_date: Optional[str] = None, end_date: Optional[str] = None):
+def _trackway_cache_key(start_date, end_date, bbox, eps, min_samples, time_eps):
+    """
+    Key analysis results on the detections in range and everything else that affects them.
+    """
+    habitat_map_path = settings.habitat_map_path
+    habitat_map_mtime = os.path.getmtime(habitat_map_path) if os.path.exists(habitat_map_path) else None
+    return (
+        data_version(start_date, end_date),
+        start_date,
+        end_date,
+        tuple(bbox) if bbox is not None else None,
+        eps,
+        min_samples,
+        time_eps,
+        habitat_map_path,
+        habitat_map_mtime,
+    )
+
+# Default of parameters for which None is a meaningful value
+_UNSET = object()
+
+def analyze_trackways(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    bbox: Optional[Sequence[float]] = None,
+    eps: Optional[float] = None,
+    min_samples: Optional[int] = None,
+    time_eps: Optional[float] = _UNSET,
+):
     """
     Analyzes deer trackways from detection data.
-    Optionally, filter by a time window.
+    Optionally, filter by a time window and a (min_x, min_y, max_x, max_y) bounding box.
+    Detections are clustered with ST-DBSCAN: points at most `eps` apart in space and
+    `time_eps` seconds apart in time are neighbours. Unset parameters come from settings,
+    and `time_eps=None` clusters on space only.
+    Results are cached until detections in the time window are added.
     """
-    if not os.path.exists(detections_file):
-        logger.warning("Detections file not found. No trackways to analyze.")
-        return None
-
-    # Read detection points
-    df = pd.read_csv(detections_file)
-    if df.empty:
-        logger.info("Detections file is empty. No trackways to analyze.")
+    start_date, end_date = start_date or None, end_date or None
+    eps = eps if eps is not None else settings.trackway_cluster_eps
+    min_samples = min_samples if min_samples is not None else settings.trackway_cluster_min_samples
+    time_eps = time_eps if time_eps is not _UNSET else settings.trackway_cluster_time_eps
+    args = (start_date, end_date, bbox, eps, min_samples, time_eps)
+    if not settings.trackway_cache_enabled:
+        return _analyze_trackways(*args)
+    return trackway_cache.get_or_compute(_trackway_cache_key(*args), lambda: _analyze_trackways(*args))
+
+def _trackway_engine_key(start_date, end_date, bbox, eps, min_samples, time_eps):
+    return (
+        settings.detection_store_backend,
+        os.path.abspath(settings.detections_dir),
+        os.path.abspath(settings.detection_db_path),
+        start_date,
+        end_date,
+        tuple(bbox) if bbox is not None else None,
+        eps,
+        min_samples,
+        time_eps,
+    )
+
+def _analyze_trackways(start_date, end_date, bbox, eps, min_samples, time_eps):
+    # Clusters are kept per query and only the ones touched by new detections are re-analyzed
+    habitat_map_path = settings.habitat_map_path
+    habitat_map_mtime = os.path.getmtime(habitat_map_path) if os.path.exists(habitat_map_path) else None
+    results = trackway_engines.update(
+        _trackway_engine_key(start_date, end_date, bbox, eps, min_samples, time_eps),
+        lambda: TrackwayEngine(
+            start_date,
+            end_date,
+            bbox,
+            eps=eps,
+            min_samples=min_samples,
+            time_eps=time_eps,
+            analyze_fn=_analyze_clusters,
+            chunk_size=settings.trackway_cluster_chunk_size,
+            n_jobs=settings.trackway_cluster_n_jobs,
+        ),
+        context=(habitat_map_path, habitat_map_mtime),
+    )
+    if not results:
+        logger.info("No significant trackways found in the specified time window.")
         return None
 
-    # Convert timestamp to datetime objects
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-    # Filter by date range if provided
-    if start_date:
-        df = df[df['timestamp'] >= pd.to_datetime(start_date)]
-    if end_date:
-        df = df[df['timestamp'] <= pd.to_datetime(end_date)]
-
-    if df.empty:
-        logger.info("No detections found in the specified time window.")
-        return None
-
-    # Cluster detection points to identify potential trackways
-    # Using DBSCAN which is good for this kind of data.
-    # The parameters eps and min_samples will need tuning.
-    coords = df[['x_center', 'y_center']].values
-    db = DBSCAN(eps=50, min_samples=5).fit(coords)
-    labels = db.labels_
-
-    # Add cluster labels to the dataframe
-    df['cluster'] = labels
+    logger.info(f"Analyzed {len(results)} potential trackways after validation.")
 
-    # Filter out noise (points not assigned to any cluster)
-    trackway_points = df[df['cluster'] != -1]
+    return {int(cluster_id): analysis for cluster_id, analysis in results.items()}
 
-    if trackway_points.empty:
-        logger.info("No significant trackways found after clustering.")
-        return None
-
-    # Analyze each cluster as a potential trackway
-    results = {}
-    for cluster_id in trackway_points['cluster'].unique():
-        cluster_points = trackway_points[trackway_points['cluster'] == cluster_id].copy()
-
-        # Sort points by timestamp to create a trajectory
-        cluster_points = cluster_points.sort_values(by='timestamp')
-
-        # Rename columns
-        cluster_points.rename(columns={'x_center': 'x', 'y_center': 'y', 'timestamp': 'time'}, inplace=True)
-
-        # Perform some basic analysis
-        displacement = _calc_displacement(cluster_points)
-        path_length = displacement.sum()
-        time_diff = cluster_points['time'].diff().dt.total_seconds()
-        path_speed = (displacement / time_diff).fillna(0)
-
-        # Validate the trackway
-        if not is_biologically_plausible(path_length, path_speed, cluster_points):
-            continue
-
-        # Get habitat type for the trackway's centroid
-        centroid_x = cluster_points['x'].mean()
-        centroid_y = cluster_points['y'].mean()
-        habitat_type = get_habitat_type_for_coord(centroid_x, centroid_y, settings.habitat_map_path)
-
-        # Calculate Moran's I for speed
-        cluster_points['speed'] = path_speed
-        gdf_points = gpd.GeoDataFrame(
-            cluster_points,
-            geometry=gpd.points_from_xy(cluster_points.x, cluster_points.y)
-        )
-        morans_i, morans_p = calculate_morans_i(gdf_points, 'speed')
-
-
-        # Calculate confidence score stats
-        confidence_mean = cluster_points['score'].mean()
-        confidence_std = cluster_points['score'].std()
-
-        results[int(cluster_id)] = {
-            "length": path_length,
-            "average_speed": path_speed.mean() if not path_speed.empty else 0,
-            "points": cluster_points.to_dict('records'),
+def _analyze_clusters(rows: pd.DataFrame, labels: np.ndarray) -> dict:
+    """
+    Analyze clusters of detections as potential trackways, in one pass over all of them.
+    `labels` holds the cluster of each row. Returns the analysis of each cluster, or
+    None for clusters that are not biologically plausible.
+    """
+    labels = np.asarray(labels)
+    times = rows['timestamp'].to_numpy(dtype='datetime64[us]').astype(np.int64)
+    # Sort by cluster, then time, so every trackway is a contiguous time-ordered segment
+    order = np.lexsort((times, labels))
+    labels, times = labels[order], times[order]
+    points = rows.iloc[order].reset_index(drop=True)
+    points.rename(columns={'x_center': 'x', 'y_center': 'y', 'timestamp': 'time'}, inplace=True)
+    x = points['x'].to_numpy(dtype=float)
+    y = points['y'].to_numpy(dtype=float)
+    score = points['score'].to_numpy(dtype=float)
+
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(labels)]
+    counts = ends - starts
+    first = np.zeros(len(labels), dtype=bool)
+    first[starts] = True
+
+    # Steps between consecutive detections of the same trackway
+    dx = np.diff(x, prepend=x[:1])
+    dy = np.diff(y, prepend=y[:1])
+    displacement = np.hypot(dx, dy)
+    displacement[first] = 0
+    time_diff = np.diff(times, prepend=times[:1]) / 1e6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = displacement / time_diff
+    speed[first | np.isnan(speed)] = 0
+
+    # Turn angles need two steps, i.e. from the third point of a trackway on
+    heading = np.arctan2(dy, dx)
+    turn_angle = np.abs(np.rad2deg(np.diff(heading, prepend=heading[:1])))
+    turn_angle[first | np.r_[True, first[:-1]]] = 0
+
+    path_length = np.add.reduceat(displacement, starts)
+    max_speed = np.maximum.reduceat(speed, starts)
+    average_speed = np.add.reduceat(speed, starts) / counts
+    max_turn_angle = np.maximum.reduceat(turn_angle, starts)
+    end_to_end = np.hypot(x[ends - 1] - x[starts], y[ends - 1] - y[starts])
+    centroid_x = np.add.reduceat(x, starts) / counts
+    centroid_y = np.add.reduceat(y, starts) / counts
+    confidence_mean = np.add.reduceat(score, starts) / counts
+    squared_error = np.add.reduceat((score - np.repeat(confidence_mean, counts)) ** 2, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        confidence_std = np.sqrt(squared_error / (counts - 1))
+    confidence_std[counts < 2] = np.nan
+
+    plausible = plausible_trackways(path_length, max_speed, max_turn_angle, end_to_end, counts)
+    points['speed'] = speed
+
+    # Habitat type at the centroid and Moran's I for speed, per accepted trackway
+    accepted = np.flatnonzero(plausible)
+    segments = [np.arange(starts[i], ends[i]) for i in accepted]
+    index = np.concatenate(segments) if segments else np.empty(0, dtype=int)
+    stats = map_trackway_stats(
+        x[index],
+        y[index],
+        speed[index],
+        np.r_[0, np.cumsum(counts[accepted])],
+        np.column_stack((centroid_x[accepted], centroid_y[accepted])),
+        labels[starts[accepted]],
+        settings.habitat_map_path,
+    )
+
+    results = {labels[start].item(): None for start in starts}
+    for i, (habitat_type, morans_i, morans_p) in zip(accepted, stats):
+        results[labels[starts[i]].item()] = {
+            "length": path_length[i],
+            "average_speed": average_speed[i],
+            "points": points.iloc[starts[i]:ends[i]].to_dict('records'),
             "habitat_type": habitat_type,
             "morans_i": morans_i,
             "morans_i_p_value": morans_p,
-            "confidence_mean": confidence_mean,
-            "confidence_std": confidence_std,
+            "confidence_mean": confidence_mean[i],
+            "confidence_std": confidence_std[i],
         }
-
-    logger.info(f"Analyzed {len(results)} potential trackways after validation.")
-
     return results
 
 
 from app.prediction.services import predict as run_prediction
+from app.prediction.postprocessing import get_detections
 from app.habitat.services import classify_habitat
 from fastapi import UploadFile
-from app.geospatial.utils import pixel_to_geo
+from app.geospatial.utils import GeoReference
 from PIL import Image
 import io
 import geopandas as gpd
 from shapely.geometry import Point, LineString
 from datetime import datetime
+from app.concurrency import run_blocking
 
 def _extract_deer_points_from_predictions(predictions, geotiff_path):
-    deer_points = []
-    for box in predictions[0].boxes:
-        label = predictions[0].names[int(box.cls[0].item())]
-        if label == 'deer':
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
-            if geotiff_path:
-                center_x, center_y = pixel_to_geo(center_x, center_y, geotiff_path)
-            deer_points.append(Point(center_x, center_y))
-    return deer_points
+    centers = get_detections(predictions).filter_label('deer').centers
+    if geotiff_path and len(centers):
+        geo_x, geo_y = GeoReference.from_file(geotiff_path).pixel_to_geo(centers[:, 0], centers[:, 1])
+        centers = np.column_stack((geo_x, geo_y))
+    return [Point(x, y) for x, y in centers.tolist()]
 
 def _cluster_points_to_trackways(gdf):
-    coords = np.array([[p.x, p.y] for p in gdf.geometry])
-    db = DBSCAN(eps=0.1, min_samples=3).fit(coords)
-    gdf['cluster'] = db.labels_
+    coords = np.column_stack((gdf.geometry.x, gdf.geometry.y))
+    gdf['cluster'] = st_dbscan(
+        coords,
+        settings.trackway_image_cluster_eps,
+        settings.trackway_image_cluster_min_samples,
+        chunk_size=settings.trackway_cluster_chunk_size,
+        n_jobs=settings.trackway_cluster_n_jobs,
+    )
     return gdf[gdf['cluster'] != -1]
 
 def _convert_clusters_to_linestrings(trackway_gdf):
@@ -188,13 +260,13 @@ def _generate_report(trackways):
     return "report.md"
 
 
-async def analyze_trackways_from_image(file: UploadFile, geotiff_path: Optional[str] = None):
+def _analyze_trackways_from_image_bytes(image_bytes: bytes, filename: str, geotiff_path: Optional[str] = None):
     """
-    Full workflow from image to trackway analysis.
+    Detect deer in an image, cluster them into trackways and run the edge effect analysis.
+    This is blocking work (model inference, rasterio and OpenCV) and is run on the shared executor.
     """
-    image_bytes = await file.read()
     image = Image.open(io.BytesIO(image_bytes))
-    predictions = run_prediction(image, file.filename)
+    predictions = run_prediction(image, filename)
 
     deer_points = _extract_deer_points_from_predictions(predictions, geotiff_path)
     if not deer_points:
@@ -208,13 +280,22 @@ async def analyze_trackways_from_image(file: UploadFile, geotiff_path: Optional[
         return None
 
     trackways = _convert_clusters_to_linestrings(trackway_gdf)
+    trackways = _add_edge_effect_analysis_to_trackways(trackways, trackway_gdf, image_bytes)
+    report_path = _generate_report(trackways)
+    return trackways, report_path
 
-    file.file.seek(0)
-    image_bytes_for_features = file.file.read()
-    trackways = _add_edge_effect_analysis_to_trackways(trackways, trackway_gdf, image_bytes_for_features)
+
+async def analyze_trackways_from_image(file: UploadFile, geotiff_path: Optional[str] = None):
+    """
+    Full workflow from image to trackway analysis.
+    """
+    image_bytes = await file.read()
+    analysis = await run_blocking(_analyze_trackways_from_image_bytes, image_bytes, file.filename, geotiff_path)
+    if analysis is None:
+        return None
+    trackways, report_path = analysis
 
     habitat_info = await classify_habitat(file, geotiff_path)
-    report_path = _generate_report(trackways)
 
     return {
         "trackways": {
@@ -66,3 +66,16 @@ def is_biologically_plausible(length, speed, trj) -> bool:
                 logger.debug("Trackway identified as plausible commuting behavior.")
 
     return True
+
+
+def plausible_trackways(length, max_speed, max_turn_angle, displacement, n_points) -> np.ndarray:
+    """
+    Vectorized is_biologically_plausible over many trackways, given per-trackway
+    path length, maximum speed, maximum absolute turn angle, end-to-end
+    displacement and number of points.
+    """
+    length, displacement = np.asarray(length, dtype=float), np.asarray(displacement, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tortuous = (displacement > 0) & (length / displacement > MAX_TORTUOSITY)
+    shape_ok = (np.abs(max_turn_angle) <= MAX_TURN_ANGLE) & ~tortuous
+    return (length >= MIN_LENGTH) & ~(np.asarray(max_speed) > MAX_SPEED) & ((np.asarray(n_points) < 3) | shape_ok)
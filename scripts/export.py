@@ -0,0 +1,33 @@
+import os
+import sys
+import argparse
+
+# Add the project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from app.config import settings
+from app.prediction.services import INFERENCE_BACKENDS, export_model, get_latest_model_path
+
+
+def export(backend, weights=None, force=False):
+    """
+    Export the detection weights for a CPU inference backend.
+    The export is written next to the weights, where the prediction service picks it up.
+    """
+    weights = weights or get_latest_model_path()
+    export_path = export_model(weights, backend=backend, force=force)
+    print(f"Model exported for the '{backend}' backend to '{export_path}'.")
+    print(f"Set INFERENCE_BACKEND={backend} to serve it.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export YOLO weights for ONNX Runtime or OpenVINO.")
+    parser.add_argument("--backend", type=str, default=settings.inference_backend if settings.inference_backend != "pytorch" else "onnx",
+                        choices=[b for b in INFERENCE_BACKENDS if b != "pytorch"],
+                        help="Inference backend to export for")
+    parser.add_argument("--weights", type=str, default=None,
+                        help="Path to the .pt weights. Defaults to the latest trained model.")
+    parser.add_argument("--force", action="store_true", help="Re-export even if a cached export is up to date")
+    args = parser.parse_args()
+    export(args.backend, args.weights, args.force)
@@ -0,0 +1,31 @@
+import os
+import sys
+import argparse
+
+# Add the project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from app.config import settings
+from app.detections.store import import_csv
+
+
+def import_detections(csv_path, backend=None):
+    """
+    Import a legacy detections CSV into the detection store: the date-partitioned
+    Parquet files or the indexed SQLite database.
+    """
+    settings.detection_store_backend = backend or settings.detection_store_backend
+    target = settings.detection_db_path if settings.detection_store_backend == "sqlite" else settings.detections_dir
+    count = import_csv(csv_path)
+    print(f"Imported {count} detections from '{csv_path}' into '{target}'.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a detections CSV into the detection store.")
+    parser.add_argument("--csv", type=str, default=os.path.join("detections", "detections.csv"),
+                        help="Path to the detections CSV")
+    parser.add_argument("--backend", type=str, default=None, choices=["parquet", "sqlite"],
+                        help="Store to import into. Defaults to DETECTION_STORE_BACKEND.")
+    args = parser.parse_args()
+    import_detections(args.csv, args.backend)
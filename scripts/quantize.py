@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+from ultralytics import YOLO
+from PIL import Image
+
+# Add the project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from app.config import settings
+from app.prediction.services import export_model, get_latest_model_path
+from app.prediction.quantization import sample_calibration_images
+
+
+def measure_latency(model_path, image_paths, warmup=3):
+    """
+    Measure the mean and p95 single-image latency of a model, in milliseconds.
+    """
+    model = YOLO(model_path, task="detect")
+    images = [Image.open(p).convert("RGB") for p in image_paths]
+    for image in images[:warmup]:
+        model(image, imgsz=settings.img_size, verbose=False)
+
+    latencies = []
+    for image in images:
+        start = time.perf_counter()
+        model(image, imgsz=settings.img_size, verbose=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return sum(latencies) / len(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def measure_accuracy(model_path):
+    """
+    Compute mAP50 and mAP50-95 of a model on the validation split of the data config.
+    """
+    model = YOLO(model_path, task="detect")
+    metrics = model.val(data=settings.data_config, imgsz=settings.img_size, batch=1, plots=False, verbose=False)
+    return metrics.box.map50, metrics.box.map
+
+
+def generate_html_report(rows, calibration_count):
+    """
+    Generate an HTML report comparing accuracy and latency of the FP32 and INT8 models.
+    """
+    report_dir = Path('reports')
+    report_dir.mkdir(exist_ok=True)
+    run_name = time.strftime("%Y%m%d-%H%M%S")
+
+    baseline = rows[0]
+    table_rows = ""
+    for row in rows:
+        speedup = baseline["latency_ms"] / row["latency_ms"] if row["latency_ms"] else 0
+        table_rows += (
+            f"<tr><td>{row['name']}</td><td>{row['path']}</td><td>{row['size_mb']:.1f}</td>"
+            f"<td>{row['map50']:.4f}</td><td>{row['map']:.4f}</td><td>{row['map'] - baseline['map']:+.4f}</td>"
+            f"<td>{row['latency_ms']:.1f}</td><td>{row['p95_ms']:.1f}</td><td>{speedup:.2f}x</td></tr>"
+        )
+
+    html_content = f"""
+    <html>
+    <head>
+        <title>INT8 Quantization Report - {run_name}</title>
+        <style>
+            body {{ font-family: sans-serif; }}
+            table {{ border-collapse: collapse; width: 100%; }}
+            th, td {{ border: 1px solid #dddddd; text-align: left; padding: 8px; }}
+            th {{ background-color: #f2f2f2; }}
+        </style>
+    </head>
+    <body>
+        <h1>INT8 Quantization Report - {run_name}</h1>
+        <p>Calibrated on {calibration_count} images from {settings.quantization_calibration_dir}.
+        Accuracy on {settings.data_config}, latency at {settings.img_size}px on CPU.</p>
+        <table>
+            <tr><th>Model</th><th>Path</th><th>Size (MB)</th><th>mAP50</th><th>mAP50-95</th><th>&Delta; mAP50-95</th>
+                <th>Mean latency (ms)</th><th>p95 latency (ms)</th><th>Speedup</th></tr>
+            {table_rows}
+        </table>
+    </body>
+    </html>
+    """
+
+    report_path = report_dir / f'quantization_report_{run_name}.html'
+    with open(report_path, 'w') as f:
+        f.write(html_content)
+    print(f"HTML report generated at {report_path}")
+    return report_path
+
+
+def quantize(weights=None, force=False, latency_samples=50):
+    """
+    Quantize the detection weights to INT8 and compare them against the FP32 models.
+    """
+    weights = weights or get_latest_model_path()
+    int8_path = export_model(weights, backend="onnx_int8", force=force)
+    fp32_onnx_path = export_model(weights, backend="onnx")
+    print(f"INT8 model saved to '{int8_path}'. Set INFERENCE_BACKEND=onnx_int8 to serve it.")
+
+    calibration_images = sample_calibration_images()
+    latency_images = sample_calibration_images(n_samples=latency_samples, seed=1)
+
+    rows = []
+    for name, path in [("PyTorch FP32", weights), ("ONNX FP32", fp32_onnx_path), ("ONNX INT8", int8_path)]:
+        map50, map50_95 = measure_accuracy(path)
+        latency_ms, p95_ms = measure_latency(path, latency_images)
+        rows.append({
+            "name": name,
+            "path": path,
+            "size_mb": os.path.getsize(path) / 1e6,
+            "map50": map50,
+            "map": map50_95,
+            "latency_ms": latency_ms,
+            "p95_ms": p95_ms,
+        })
+        print(f"{name}: mAP50-95={map50_95:.4f}, mean latency={latency_ms:.1f} ms")
+
+    generate_html_report(rows, len(calibration_images))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize YOLO detection weights to INT8 and report accuracy vs. speed.")
+    parser.add_argument("--weights", type=str, default=None,
+                        help="Path to the .pt weights. Defaults to the latest trained model.")
+    parser.add_argument("--force", action="store_true", help="Re-quantize even if a cached INT8 model is up to date")
+    parser.add_argument("--latency-samples", type=int, default=50, help="Number of images to time inference on")
+    args = parser.parse_args()
+    try:
+        quantize(args.weights, args.force, args.latency_samples)
+    except ImportError as e:
+        sys.exit(str(e))
@@ -20,16 +20,28 @@ def override_settings():
     with tempfile.TemporaryDirectory() as tmpdir:
         original_upload_dir = settings.upload_dir
         original_metadata_log_file = settings.metadata_log_file
+        original_detections_dir = settings.detections_dir
+        original_detection_write_behind = settings.detection_write_behind
+        original_labels_dir = settings.labels_dir
         settings.upload_dir = tmpdir
         settings.metadata_log_file = f"{tmpdir}/metadata.log"
+        settings.detections_dir = f"{tmpdir}/detections"
+        settings.labels_dir = f"{tmpdir}/labels"
+        # Write detections synchronously, so nothing is flushed after the temporary directory is gone
+        settings.detection_write_behind = False
         yield
         settings.upload_dir = original_upload_dir
         settings.metadata_log_file = original_metadata_log_file
+        settings.detections_dir = original_detections_dir
+        settings.detection_write_behind = original_detection_write_behind
+        settings.labels_dir = original_labels_dir
 
 import pytest
 
 import numpy as np
+import rasterio
 from PIL import ImageFilter
+from rasterio.transform import from_origin
 
 @pytest.fixture
 def create_dummy_image():
@@ -59,3 +71,23 @@ def create_dummy_image():
         image.save(buffer, format=file_format)
         return buffer.getvalue()
     return _create_dummy_image
+
+@pytest.fixture
+def write_raster(tmp_path):
+    def _write_raster(name: str, data: np.ndarray, transform=None, nodata=None, block_size=None, crs=None):
+        """
+        Write a single-band GeoTIFF under tmp_path and return its path. The default
+        transform has 1x1 pixels with the origin at the top-left corner of (0, 0)-(width, height).
+        """
+        height, width = data.shape
+        profile = dict(
+            driver="GTiff", height=height, width=width, count=1, dtype=data.dtype, nodata=nodata, crs=crs,
+            transform=transform if transform is not None else from_origin(0, height, 1, 1),
+        )
+        if block_size:
+            profile.update(tiled=True, blockxsize=block_size, blockysize=block_size)
+        path = tmp_path / name
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(data, 1)
+        return path
+    return _write_raster
@@ -0,0 +1,291 @@
+import os
+import time
+import json
+import pytest
+import pandas as pd
+import pyarrow as pa
+from app.config import settings
+from app.detections.store import import_csv, read_detections, write_detections
+from app.detections.writer import DetectionWriter
+
+
+def _detections(timestamps):
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(timestamps),
+        "filename": ["image1.jpg"] * len(timestamps),
+        "x_center": [float(i) for i in range(len(timestamps))],
+        "y_center": [float(i) for i in range(len(timestamps))],
+        "score": [0.9] * len(timestamps),
+        "label": ["deer"] * len(timestamps),
+    })
+
+
+def test_read_detections_empty_store():
+    df = read_detections()
+    assert df.empty
+    assert list(df.columns) == ["timestamp", "filename", "x_center", "y_center", "score", "label"]
+
+
+def test_write_detections_partitions_by_date():
+    write_detections(_detections(["2025-01-01 10:00:00", "2025-01-01 11:00:00", "2025-01-03 09:00:00"]))
+    write_detections(_detections(["2025-01-02 12:00:00"]))
+
+    partitions = sorted(os.listdir(settings.detections_dir))
+    assert partitions == ["date=2025-01-01", "date=2025-01-02", "date=2025-01-03"]
+
+    df = read_detections()
+    assert len(df) == 4
+    assert df["timestamp"].is_monotonic_increasing
+    assert pd.api.types.is_datetime64_any_dtype(df["timestamp"])
+
+
+def test_read_detections_date_range(monkeypatch):
+    write_detections(_detections(["2025-01-01 10:00:00", "2025-01-02 10:00:00", "2025-01-02 18:00:00", "2025-01-03 10:00:00"]))
+
+    # Partitions outside the range are never opened
+    opened = []
+    import pyarrow.dataset as ds
+    original_dataset = ds.dataset
+    monkeypatch.setattr(ds, "dataset", lambda files, **kwargs: opened.extend(files) or original_dataset(files, **kwargs))
+
+    df = read_detections("2025-01-02 00:00:00", "2025-01-02 12:00:00", columns=["timestamp", "x_center"])
+    assert list(df.columns) == ["timestamp", "x_center"]
+    assert df["timestamp"].tolist() == [pd.Timestamp("2025-01-02 10:00:00")]
+    assert all("date=2025-01-02" in path for path in opened)
+
+
+def test_small_files_are_compacted(monkeypatch):
+    from app.detections import store
+
+    monkeypatch.setattr(settings, "detection_compaction_min_files", 4)
+    monkeypatch.setattr(settings, "detection_compaction_min_age", 0)
+    monkeypatch.setattr(store, "SETTLE_SECONDS", 0)
+    for i in range(6):
+        write_detections(_detections([f"2025-01-01 10:00:0{i}"]))
+
+    partition_dir = os.path.join(settings.detections_dir, "date=2025-01-01")
+    files = sorted(f for f in os.listdir(partition_dir) if f.endswith(".parquet"))
+    assert len(files) == 3
+    assert sum("-from-" in f for f in files) == 1
+    assert read_detections()["timestamp"].tolist() == [pd.Timestamp(f"2025-01-01 10:00:0{i}") for i in range(6)]
+
+
+def test_compaction_inputs_are_hidden_before_they_are_deleted(monkeypatch):
+    """Readers never see a row twice, even if compaction stops before deleting its inputs."""
+    from app.detections import store
+
+    monkeypatch.setattr(settings, "detection_compaction_min_files", 100)
+    monkeypatch.setattr(store, "SETTLE_SECONDS", 0)
+    for i in range(3):
+        write_detections(_detections([f"2025-01-01 10:00:0{i}"]))
+
+    monkeypatch.setattr(settings, "detection_compaction_min_files", 2)
+    monkeypatch.setattr(settings, "detection_compaction_min_age", 0)
+    monkeypatch.setattr(store.os, "remove", lambda path: None)
+    partition_dir = os.path.join(settings.detections_dir, "date=2025-01-01")
+    assert store.compact_partition(partition_dir) == 3
+    monkeypatch.undo()
+
+    assert len(os.listdir(partition_dir)) >= 4
+    assert len(read_detections()) == 3
+
+
+def test_import_csv(tmp_path):
+    csv_path = tmp_path / "detections.csv"
+    _detections(["2025-02-01 10:00:00", "2025-02-02 10:00:00"]).to_csv(csv_path, index=False)
+
+    assert import_csv(str(csv_path)) == 2
+    assert len(read_detections(start_date="2025-02-02")) == 1
+
+
+def test_detection_writer_buffers_and_flushes():
+    writes = []
+    writer = DetectionWriter(lambda df: writes.append(len(df)), flush_rows=3, flush_interval=60)
+    writer.submit(_detections(["2025-01-01 10:00:00", "2025-01-01 10:00:01"]))
+    assert writes == []
+    assert writer.metrics()["backlog_rows"] == 2
+
+    # Reaching flush_rows wakes the flush thread
+    writer.start()
+    writer.submit(_detections(["2025-01-01 10:00:02"]))
+    for _ in range(50):
+        if writes:
+            break
+        time.sleep(0.05)
+    assert writes == [3]
+
+    # Stopping flushes what is left
+    writer.submit(_detections(["2025-01-01 10:00:03"]))
+    writer.stop()
+    assert writes == [3, 1]
+    assert writer.metrics()["backlog_rows"] == 0
+    assert writer.metrics()["rows_written"] == 4
+
+
+def test_detection_writer_keeps_rows_on_failed_flush():
+    def failing_write(df):
+        raise OSError("disk full")
+
+    writer = DetectionWriter(failing_write, flush_rows=100, flush_interval=60)
+    writer.submit(_detections(["2025-01-01 10:00:00"]))
+    assert writer.flush() == 0
+    assert writer.metrics()["backlog_rows"] == 1
+    assert writer.metrics()["last_error"] == "disk full"
+
+    writer.write_fn = write_detections
+    assert writer.flush() == 1
+    assert len(read_detections()) == 1
+
+
+def test_detection_writer_drops_oldest_rows_beyond_cap():
+    def failing_write(df):
+        raise OSError("disk full")
+
+    writer = DetectionWriter(failing_write, flush_rows=2, flush_interval=60, max_rows=3)
+    writer.submit(_detections(["2025-01-01 10:00:00", "2025-01-01 10:00:01"]))
+    assert writer.flush() == 0
+    writer.submit(_detections(["2025-01-01 10:00:02", "2025-01-01 10:00:03"]))
+
+    metrics = writer.metrics()
+    assert metrics["backlog_rows"] == 3 and metrics["dropped_rows"] == 1
+    written = []
+    writer.write_fn = written.append
+    writer.flush()
+    assert written[0]["timestamp"].dt.second.tolist() == [1, 2, 3]
+
+
+def test_read_new_detections_watermark(monkeypatch):
+    from app.detections import store
+
+    write_detections(_detections(["2025-01-01 10:00:00"]))
+    rows, token, lost = store.read_new_detections()
+    assert len(rows) == 1 and not lost
+    rows, token, lost = store.read_new_detections(seen=token)
+    assert rows.empty and not lost
+
+    # Once files settle, the token is just the watermark
+    monkeypatch.setattr(store, "SETTLE_SECONDS", 0)
+    write_detections(_detections(["2025-01-01 11:00:00", "2025-01-02 09:00:00"]))
+    rows, token, lost = store.read_new_detections(seen=token)
+    assert len(rows) == 2 and not lost
+    assert token[1] == frozenset()
+    rows, token, lost = store.read_new_detections(seen=token)
+    assert rows.empty and not lost
+
+
+def test_read_new_detections_reports_partly_seen_compaction(monkeypatch):
+    from app.detections import store
+
+    monkeypatch.setattr(store, "SETTLE_SECONDS", 0)
+    monkeypatch.setattr(settings, "detection_compaction_min_files", 100)
+    write_detections(_detections(["2025-01-01 10:00:00"]))
+    _, token, _ = store.read_new_detections()
+    write_detections(_detections(["2025-01-01 10:00:01"]))
+
+    # Merging a file the reader has seen with one it has not means starting over
+    monkeypatch.setattr(settings, "detection_compaction_min_files", 2)
+    monkeypatch.setattr(settings, "detection_compaction_min_age", 0)
+    assert store.compact_partition(os.path.join(settings.detections_dir, "date=2025-01-01")) == 2
+    _, _, lost = store.read_new_detections(seen=token)
+    assert lost
+    rows, _, lost = store.read_new_detections()
+    assert len(rows) == 2 and not lost
+
+
+def test_sqlite_schema_is_created_once(tmp_path, monkeypatch):
+    from app.detections import database
+
+    runs = []
+    class CountingStatements(list):
+        def __iter__(self):
+            runs.append(1)
+            return super().__iter__()
+
+    monkeypatch.setattr(database, "SCHEMA_STATEMENTS", CountingStatements(database.SCHEMA_STATEMENTS))
+    db_path = str(tmp_path / "detections.db")
+    database.write_detections(_detections(["2025-01-01 10:00:00"]), db_path=db_path)
+    database.read_detections(db_path=db_path)
+    database.data_version(db_path=db_path)
+    assert runs == [1]
+    with pytest.raises(ValueError):
+        database.read_detections(columns=["timestamp; DROP TABLE detections"], db_path=db_path)
+
+
+def test_sqlite_backend_range_and_bbox_queries(tmp_path, monkeypatch):
+    import sqlite3
+    monkeypatch.setattr(settings, "detection_store_backend", "sqlite")
+    monkeypatch.setattr(settings, "detection_db_path", str(tmp_path / "detections.db"))
+    monkeypatch.setattr(settings, "detection_grid_cell_size", 10.0)
+
+    df = _detections(["2025-01-01 10:00:00", "2025-01-02 10:00:00", "2025-01-02 11:00:00", "2025-01-03 10:00:00"])
+    df["x_center"] = [5.0, 15.0, 55.0, 25.0]
+    df["y_center"] = [5.0, 15.0, 55.0, 25.0]
+    assert write_detections(df) == 4
+
+    in_range = read_detections("2025-01-02", "2025-01-02 23:59:59")
+    assert in_range["x_center"].tolist() == [15.0, 55.0]
+    assert pd.api.types.is_datetime64_any_dtype(in_range["timestamp"])
+
+    in_box = read_detections(bbox=(0, 0, 30, 30), columns=["x_center"])
+    assert sorted(in_box["x_center"].tolist()) == [5.0, 15.0, 25.0]
+
+    # Range queries are served by the indexes rather than a table scan
+    connection = sqlite3.connect(settings.detection_db_path)
+    plan = connection.execute("EXPLAIN QUERY PLAN SELECT * FROM detections WHERE timestamp >= 0").fetchall()
+    connection.close()
+    assert "idx_detections_timestamp" in str(plan)
+
+
+def test_analyze_trackways_bbox_validation():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    response = TestClient(app).post("/api/v1/trackways/analyze", json={"bbox": [0, 0, 1]})
+    assert response.status_code == 400
+
+
+def _page_through(client, params):
+    rows, cursor, pages = [], None, 0
+    while True:
+        response = client.get("/api/v1/detections", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        rows.extend(json.loads(line) for line in response.text.splitlines() if line)
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return rows, pages
+
+
+@pytest.mark.parametrize("backend", ["parquet", "sqlite"])
+def test_detections_endpoint_pagination_and_filters(backend, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    monkeypatch.setattr(settings, "detection_store_backend", backend)
+    monkeypatch.setattr(settings, "detection_db_path", str(tmp_path / "detections.db"))
+    # Duplicate timestamps across a partition boundary exercise the cursor tie-break
+    df = _detections(["2025-01-01 10:00:00"] * 3 + ["2025-01-02 10:00:00"] * 4 + ["2025-01-03 10:00:00"])
+    df["score"] = [0.9, 0.4, 0.9, 0.9, 0.9, 0.4, 0.9, 0.9]
+    df["label"] = ["deer"] * 7 + ["person"]
+    write_detections(df)
+    client = TestClient(app)
+
+    rows, pages = _page_through(client, {"limit": 2})
+    assert len(rows) == 8
+    assert pages == 4
+    assert sorted(row["x_center"] for row in rows) == list(range(8))
+
+    rows, _ = _page_through(client, {"limit": 3, "min_score": 0.5, "label": "deer", "start_date": "2025-01-01 12:00:00"})
+    assert [row["x_center"] for row in rows] == [3, 4, 6]
+
+    rows, _ = _page_through(client, {"bbox": "0,0,2.5,2.5"})
+    assert sorted(row["x_center"] for row in rows) == [0, 1, 2]
+
+    response = client.get("/api/v1/detections", params={"format": "arrow", "limit": 5})
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 5
+    assert table.schema.field("timestamp").type == pa.timestamp("us")
+    assert response.headers["X-Next-Cursor"]
+
+    assert client.get("/api/v1/detections", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/api/v1/detections", params={"bbox": "1,2"}).status_code == 400
@@ -1,5 +1,5 @@
 import pytest
-from app.geospatial.utils import pixel_to_geo
+from app.geospatial.utils import GeoReference, pixel_to_geo
 import rasterio
 from rasterio.transform import from_origin
 import numpy as np
@@ -54,6 +54,18 @@ def test_pixel_to_geo(sample_geotiff):
     assert x == 110
     assert y == -60
 
+def test_georeference_converts_arrays(sample_geotiff):
+    """GeoReference converts whole arrays of pixel coordinates with one read of the file."""
+    georeference = GeoReference.from_file(sample_geotiff)
+    assert georeference.crs.to_string() == "EPSG:4326"
+
+    geo_x, geo_y = georeference.pixel_to_geo(np.array([0, 50, 100]), np.array([0, 50, 100]))
+    np.testing.assert_array_equal(geo_x, [10, 60, 110])
+    np.testing.assert_array_equal(geo_y, [40, -10, -60])
+
+    boxes = georeference.boxes_to_geo(np.array([[0, 0, 50, 50], [50, 50, 100, 100]]))
+    np.testing.assert_array_equal(boxes, [[10, 40, 60, -10], [60, -10, 110, -60]])
+
 
 def test_calculate_distance_to_nearest_feature():
     """Test the calculate_distance_to_nearest_feature function."""
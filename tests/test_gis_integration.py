@@ -1,8 +1,18 @@
 import pytest
 import os
 import geopandas as gpd
-from shapely.geometry import LineString
+import numpy as np
+from fastapi.testclient import TestClient
+from rasterio import features
+from rasterio.transform import from_origin
+from shapely.geometry import LineString, Point
+from shapely.ops import unary_union
+from app.config import settings
+from app.detections.store import write_detections
+from app.geospatial import raster_cache, raster_stats
 from app.gis_integration import services
+from app.gis_integration.zonal import zonal_stats
+from app.main import app
 import pandas as pd
 
 @pytest.fixture
@@ -98,3 +108,164 @@ def test_generate_report(tmp_path):
     with open(output_path, 'r') as f:
         content = f.read()
         assert "Efficiency Gain: 10.00x" in content
+
+def test_get_habitat_types_for_coords_reads_each_block_once(monkeypatch, write_raster):
+    data = (np.arange(64 * 64) % 7).reshape(64, 64).astype(np.uint8)
+    path = write_raster("habitat.tif", data, block_size=16)
+
+    windows = []
+    original_window = raster_cache.Window
+    monkeypatch.setattr(raster_cache, "Window", lambda *args: windows.append(args) or original_window(*args))
+    rng = np.random.default_rng(0)
+    xs, ys = rng.uniform(0, 32, size=500), rng.uniform(32, 64, size=500)
+    types = services.get_habitat_types_for_coords(np.r_[xs, -5], np.r_[ys, 10], str(path))
+
+    # 500 points in the top-left quarter touch its 4 blocks only
+    assert len(windows) == 4
+    assert types[:-1] == [int(data[int(64 - y), int(x)]) for x, y in zip(xs, ys)]
+    assert types[-1] is None
+    assert services.get_habitat_type_for_coord(xs[0], ys[0], str(path)) == types[0]
+
+    # Rewriting the raster invalidates the cached dataset
+    write_raster("habitat.tif", np.full((64, 64), 9, dtype=np.uint8), block_size=16)
+    os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    assert services.get_habitat_type_for_coord(xs[0], ys[0], str(path)) == 9
+
+@pytest.mark.parametrize("tiled", [True, False])
+def test_get_habitat_areas_block_wise_and_cached(monkeypatch, write_raster, tiled):
+    data = np.random.default_rng(0).integers(0, 5, size=(300, 200)).astype(np.uint8)
+    layout = dict(transform=from_origin(0, 600, 2, 2), block_size=64 if tiled else None)
+    path = write_raster("habitat.tif", data, **layout)
+
+    # Small windows force many blocks, shared between two threads
+    monkeypatch.setattr(raster_stats, "TARGET_WINDOW_PIXELS", 5000)
+    monkeypatch.setattr(settings, "raster_block_workers", 2)
+    values, counts = np.unique(data, return_counts=True)
+    assert services.get_habitat_areas(str(path)) == {int(v): int(c) * 4.0 for v, c in zip(values, counts)}
+
+    # Cached until the file changes
+    monkeypatch.setattr(services, "raster_value_counts", lambda *args, **kwargs: pytest.fail("not cached"))
+    services.get_habitat_areas(str(path))
+    monkeypatch.undo()
+    write_raster("habitat.tif", np.ones_like(data), **layout)
+    os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    assert services.get_habitat_areas(str(path)) == {1: 300 * 200 * 4.0}
+
+def test_get_degradation_stats_for_habitats_single_pass(monkeypatch, write_raster):
+    rng = np.random.default_rng(1)
+    habitat = rng.integers(0, 4, size=(150, 130)).astype(np.uint8)
+    degradation = rng.uniform(0, 1, size=(150, 130)).astype(np.float32)
+    degradation[:5] = -1  # nodata
+    habitat[-3:] = 255  # nodata
+    # Different block layouts: tiled zones, striped values
+    habitat_path = write_raster("habitat.tif", habitat, nodata=255, block_size=32)
+    degradation_path = write_raster("degradation.tif", degradation, nodata=-1)
+
+    monkeypatch.setattr(raster_stats, "TARGET_WINDOW_PIXELS", 2000)
+    monkeypatch.setattr(settings, "raster_block_workers", 2)
+    stats = services.get_degradation_stats_for_habitats(str(habitat_path), str(degradation_path))
+
+    valid = (habitat != 255) & (degradation != -1)
+    assert set(stats) == {0, 1, 2, 3}
+    for habitat_type, habitat_stats in stats.items():
+        expected = degradation[valid & (habitat == habitat_type)].astype(np.float64)
+        assert habitat_stats["count"] == expected.size
+        assert habitat_stats["mean"] == pytest.approx(expected.mean())
+        assert habitat_stats["std"] == pytest.approx(expected.std())
+        assert habitat_stats["min"] == pytest.approx(expected.min())
+        assert habitat_stats["max"] == pytest.approx(expected.max())
+    assert services.get_average_degradation_for_habitats(str(habitat_path), str(degradation_path)) == {
+        habitat_type: habitat_stats["mean"] for habitat_type, habitat_stats in stats.items()
+    }
+
+def test_zonal_stats_matches_per_geometry_rasterization(monkeypatch, write_raster):
+    rng = np.random.default_rng(2)
+    transform = from_origin(0, 100, 1, 1)
+    habitat = rng.integers(1, 4, size=(100, 100)).astype(np.uint8)
+    habitat[:10, :10] = 0  # nodata
+    elevation = rng.uniform(100, 200, size=(100, 100)).astype(np.float32)
+    habitat_path = write_raster("habitat.tif", habitat, nodata=0, block_size=16)
+    elevation_path = write_raster("elevation.tif", elevation)
+
+    # Overlapping buffers, one across many tiles, one in the nodata corner and one outside the rasters
+    geometries = {
+        "a": LineString([(5, 5), (60, 70), (95, 20)]).buffer(4),
+        "b": Point(50, 50).buffer(10),
+        "c": Point(3, 97).buffer(2),
+        "d": Point(500, 500).buffer(2),
+    }
+    monkeypatch.setattr(raster_stats, "TARGET_WINDOW_PIXELS", 600)
+    stats = zonal_stats(geometries, {"habitat": str(habitat_path), "elevation": str(elevation_path)}, categorical=["habitat"], workers=2)
+
+    for key in "abc":
+        mask = features.geometry_mask([geometries[key]], out_shape=(100, 100), transform=transform, invert=True, all_touched=True)
+        classes, counts = np.unique(habitat[mask & (habitat != 0)], return_counts=True)
+        assert stats[key]["habitat"]["histogram"] == dict(zip(classes.tolist(), counts.tolist()))
+        assert stats[key]["habitat"]["majority"] == (classes[np.argmax(counts)].item() if counts.size else None)
+        assert stats[key]["elevation"]["count"] == mask.sum()
+        assert stats[key]["elevation"]["mean"] == pytest.approx(elevation[mask].astype(np.float64).mean())
+        assert stats[key]["elevation"]["max"] == pytest.approx(elevation[mask].max())
+    assert stats["c"]["habitat"] == {"count": 0, "histogram": {}, "majority": None}
+    assert stats["d"]["elevation"] == {"count": 0, "mean": None, "min": None, "max": None}
+
+def test_trackway_zonal_stats_endpoint(tmp_path, monkeypatch, write_raster):
+    write_detections(pd.DataFrame({
+        "timestamp": [pd.Timestamp('2025-09-05 10:00:00') + pd.Timedelta(seconds=i) for i in range(5)],
+        "x_center": [100.0, 110.0, 120.0, 130.0, 140.0],
+        "y_center": [100.0, 110.0, 120.0, 130.0, 140.0],
+        "score": [0.9] * 5,
+    }))
+    habitat_path = write_raster("habitat.tif", np.full((200, 200), 2, dtype=np.uint8))
+    degradation_path = write_raster("degradation.tif", np.full((200, 200), 0.5, dtype=np.float32))
+    monkeypatch.setattr(settings, "habitat_map_path", str(habitat_path))
+    monkeypatch.setattr(settings, "degradation_map_path", str(degradation_path))
+    monkeypatch.setattr(settings, "DEM_PATH", str(tmp_path / "missing_dem.tif"))
+    client = TestClient(app)
+
+    response = client.post("/api/v1/gis/trackway_zonal_stats", json={"buffer_distance": 5})
+    assert response.status_code == 200
+    stats = response.json()["0"]
+    assert stats["habitat"]["majority"] == 2
+    assert stats["degradation"]["mean"] == pytest.approx(0.5)
+    assert "elevation" not in stats
+
+    # Rasters on another grid are resampled to the habitat map's, and pixels they do not cover are left out
+    write_raster("degradation.tif", np.full((100, 100), 0.25, dtype=np.float32), transform=from_origin(0, 200, 2, 2))
+    dem_path = write_raster("dem.tif", np.full((200, 50), 300.0, dtype=np.float32))
+    monkeypatch.setattr(settings, "DEM_PATH", str(dem_path))
+    response = client.post("/api/v1/gis/trackway_zonal_stats", json={"buffer_distance": 5})
+    assert response.status_code == 200
+    stats = response.json()["0"]
+    assert stats["habitat"]["majority"] == 2
+    assert stats["degradation"]["mean"] == pytest.approx(0.25)
+    assert stats["degradation"]["count"] == stats["habitat"]["count"]
+    assert stats["elevation"] == {"count": 0, "mean": None, "min": None, "max": None}
+    assert client.post("/api/v1/gis/trackway_zonal_stats", json={"start_date": "2030-01-01"}).status_code == 404
+    # A zero buffer would leave no area to summarize
+    assert client.post("/api/v1/gis/trackway_zonal_stats", json={"buffer_distance": 0}).status_code == 422
+
+def test_calculate_similarity_matches_pairwise_reference():
+    rng = np.random.default_rng(4)
+    def random_lines(n, length):
+        starts = rng.uniform(0, 100, size=(n, 2))
+        ends = starts + rng.uniform(-length, length, size=(n, 2))
+        return [LineString([tuple(a), tuple(b)]) for a, b in zip(starts, ends)]
+
+    manual_gdf = gpd.GeoDataFrame(geometry=random_lines(40, 30), crs="EPSG:4326", index=np.arange(40) * 10)
+    ai_gdf = gpd.GeoDataFrame(geometry=random_lines(60, 30), crs="EPSG:4326")
+    ai_gdf["trackway_id"] = np.arange(60) + 1000
+    metrics = services.calculate_similarity(ai_gdf, manual_gdf)
+
+    pairs = [(i, j) for i, ai in enumerate(ai_gdf.geometry) for j, manual in enumerate(manual_gdf.geometry) if ai.intersects(manual)]
+    assert any(sum(1 for _, j in pairs if j == k) > 1 for k in range(40))  # Some manual trackways have several hits
+    covered = sum(
+        manual_gdf.geometry.iloc[j].intersection(unary_union([ai_gdf.geometry.iloc[i] for i, k in pairs if k == j])).length
+        for j in {j for _, j in pairs}
+    )
+    assert metrics["overlap_percentage"] == pytest.approx(covered / manual_gdf.length.sum() * 100)
+    assert metrics["detection_completeness"] == pytest.approx(len({j for _, j in pairs}) / 40 * 100)
+    offsets = [ai_gdf.geometry.iloc[i].hausdorff_distance(manual_gdf.geometry.iloc[j]) for i, j in pairs]
+    assert metrics["average_offset"] == pytest.approx(np.mean(offsets))
+    assert sorted((m["ai_trackway_id"], m["manual_trackway_id"]) for m in metrics["matches"]) == sorted(
+        (i + 1000, manual_gdf.index[j]) for i, j in pairs
+    )
@@ -3,20 +3,18 @@ from app.main import app
 import pytest
 import pandas as pd
 import numpy as np
-import rasterio
-from rasterio.transform import from_origin
 from app.config import settings
+from app.detections.store import write_detections
 import os
 
 client = TestClient(app)
 
 @pytest.fixture
-def setup_habitat_test_data(tmp_path, monkeypatch):
+def setup_habitat_test_data(monkeypatch, write_raster):
     """
     Set up dummy data for habitat tests.
     """
-    # Create dummy detections.csv
-    detections_file = tmp_path / "detections.csv"
+    # Write dummy detections to the detection store
     # A cluster of 5 points forming a line with length > 10
     detections_data = {
         "x_center": [0.5, 3.5, 6.5, 9.5, 12.5],
@@ -24,30 +22,13 @@ def setup_habitat_test_data(tmp_path, monkeypatch):
         "timestamp": pd.to_datetime([f"2023-01-01 12:0{i}:00" for i in range(5)]),
         "score": [0.9] * 5,
     }
-    pd.DataFrame(detections_data).to_csv(detections_file, index=False)
+    write_detections(pd.DataFrame(detections_data))
 
-    # Monkeypatch the path to the detections file in the trackways service
-    monkeypatch.setattr("app.trackways.services.detections_file", str(detections_file))
-
-    # Create dummy habitat map (20x2)
-    habitat_map_path = tmp_path / "habitat_map.tif"
+    # Dummy habitat and degradation maps (20x2), with 1x1 pixels and the origin at the top-left
     # The trackway is mostly in habitat 1
-    habitat_data = np.array([[1]*20, [3]*20], dtype=np.uint8)
-    transform = from_origin(0, 2, 1, 1) # 1x1 pixel size, origin at top-left
-    with rasterio.open(
-        habitat_map_path, 'w', driver='GTiff', height=2, width=20, count=1,
-        dtype=habitat_data.dtype, crs='+proj=latlong', transform=transform
-    ) as dst:
-        dst.write(habitat_data, 1)
-
-    # Create dummy degradation map (20x2)
-    degradation_map_path = tmp_path / "degradation_map.tif"
+    habitat_map_path = write_raster("habitat_map.tif", np.array([[1]*20, [3]*20], dtype=np.uint8), crs='+proj=latlong')
     degradation_data = np.array([[0.1]*20, [0.5]*20], dtype=np.float32)
-    with rasterio.open(
-        degradation_map_path, 'w', driver='GTiff', height=2, width=20, count=1,
-        dtype=degradation_data.dtype, crs='+proj=latlong', transform=transform
-    ) as dst:
-        dst.write(degradation_data, 1)
+    degradation_map_path = write_raster("degradation_map.tif", degradation_data, crs='+proj=latlong')
 
     # Override settings
     monkeypatch.setattr(settings, "habitat_map_path", str(habitat_map_path))
@@ -4,38 +4,31 @@ from app.main import app
 from PIL import Image
 import io
 import os
+import threading
+import time
+import numpy as np
 from app.config import settings
 
 
-class MockTensor:
-    def __init__(self, data):
-        self.data = data
-    def tolist(self):
-        return self.data
-    def item(self):
-        return self.data
-
-class MockBox:
+class MockBoxes:
     def __init__(self, xyxy, cls, conf):
-        self.xyxy = [MockTensor(xyxy)]
-        self.cls = [MockTensor(cls)]
-        self.conf = [MockTensor(conf)]
-
-    @property
-    def item(self):
-        return self.conf[0]
+        self.xyxy = np.array(xyxy, dtype=float).reshape(-1, 4)
+        self.cls = np.array(cls, dtype=float)
+        self.conf = np.array(conf, dtype=float)
 
 class MockResult:
     def __init__(self, model):
-        self.boxes = [MockBox([10, 10, 50, 50], 0, 0.9)]
+        self.boxes = MockBoxes([[10, 10, 50, 50]], [0], [0.9])
         self.names = model.names
 
 class MockYOLO:
-    def __init__(self, model_path):
+    def __init__(self, model_path, task=None):
         self.model_path = model_path
         self.names = {0: 'deer'}
 
     def __call__(self, image):
+        if isinstance(image, list):
+            return [MockResult(self) for _ in image]
         return [MockResult(self)]
 
 @pytest.fixture(scope="session", autouse=True)
@@ -62,7 +55,6 @@ def create_dummy_image(filename="test.jpg"):
 
 import rasterio
 from rasterio.transform import from_origin
-import numpy as np
 
 @pytest.fixture
 def sample_geotiff(tmp_path):
@@ -128,3 +120,474 @@ def test_predict_image_stream(client):
     content = response.text
     assert content.startswith('{"type": "FeatureCollection", "features": [')
     assert content.endswith(']}')
+
+def test_predict_image_tiled(client, sample_geotiff, monkeypatch):
+    """Test the /predict endpoint in tiled mode on a GeoTIFF."""
+    monkeypatch.setattr(settings, "tile_size", 64)
+    monkeypatch.setattr(settings, "tile_overlap", 16)
+    with open(sample_geotiff, "rb") as f:
+        files = {"file": ("test.tif", f, "image/tiff")}
+        response = client.post("/api/v1/predict/", files=files, data={"tiled": "true"})
+
+    assert response.status_code == 200
+    data = response.json()
+    # The mock model returns one box per tile, and a 100x100 raster gives 4 tiles
+    assert len(data["features"]) == 4
+    # Geographic coordinates come from the window transform (origin at 10, 40)
+    xs = sorted(f["geometry"]["coordinates"][0][0][0] for f in data["features"])
+    assert xs == [20.0, 20.0, 56.0, 56.0]
+
+def test_predict_image_tiled_companion_geotiff(client, sample_geotiff, tmp_path, monkeypatch):
+    """A raster without a CRS is georeferenced through the companion GeoTIFF."""
+    monkeypatch.setattr(settings, "tile_size", 64)
+    monkeypatch.setattr(settings, "tile_overlap", 16)
+    image_path = os.path.join(tmp_path, "frame.png")
+    Image.new("RGB", (100, 100)).save(image_path)
+    with open(image_path, "rb") as f, open(sample_geotiff, "rb") as geotiff:
+        files = {"file": ("frame.png", f, "image/png"), "geotiff_file": ("test.tif", geotiff, "image/tiff")}
+        response = client.post("/api/v1/predict/", files=files, data={"tiled": "true"})
+
+    assert response.status_code == 200
+    xs = sorted(f["geometry"]["coordinates"][0][0][0] for f in response.json()["features"])
+    assert xs == [20.0, 20.0, 56.0, 56.0]
+
+def test_tile_size_defaults_to_model_input_size(monkeypatch):
+    from app.prediction import services
+
+    monkeypatch.setattr(settings, "tile_size", None)
+    monkeypatch.setattr(settings, "img_size", 64)
+    windows = []
+    monkeypatch.setattr(services, "_tile_windows", lambda *args: windows.append(args) or iter(()))
+    monkeypatch.setattr(services, "get_model", lambda: MockYOLO("dummy"))
+    monkeypatch.setattr(services, "_save_deer_detections", lambda *args: None)
+
+    class _Raster:
+        width = height = 100
+        crs = None
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(services.rasterio, "open", lambda path: _Raster())
+    services.predict_tiled("unused.tif", "unused.tif")
+    assert windows[0][2] == 64
+
+def test_non_max_suppression_merges_seam_duplicates():
+    """Boxes of the same deer seen by two overlapping tiles are merged."""
+    import numpy as np
+    from app.prediction.services import _non_max_suppression
+
+    boxes = np.array([[10, 10, 50, 50], [12, 10, 52, 50], [100, 100, 140, 140]], dtype=float)
+    scores = np.array([0.8, 0.9, 0.7])
+    keep = _non_max_suppression(boxes, scores, 0.5)
+    assert keep.tolist() == [1, 2]
+
+def test_batch_scheduler_groups_concurrent_requests():
+    """Concurrent submissions are run as one batch and each caller gets its own result."""
+    from app.prediction.batching import BatchScheduler
+
+    batch_sizes = []
+    def model_fn(images):
+        batch_sizes.append(len(images))
+        return [f"result-{image}" for image in images]
+
+    scheduler = BatchScheduler(model_fn, max_batch_size=4, max_wait_ms=200, max_queue_depth=10)
+    futures = [scheduler.submit(i) for i in range(4)]
+    scheduler.start()
+    try:
+        assert [f.result(timeout=5) for f in futures] == ["result-0", "result-1", "result-2", "result-3"]
+    finally:
+        scheduler.stop()
+
+    assert batch_sizes == [4]
+    metrics = scheduler.metrics()
+    assert metrics["batches"] == 1
+    assert metrics["average_batch_fill"] == 1.0
+
+def test_batch_scheduler_rejects_when_queue_full():
+    from app.prediction.batching import BatchScheduler, QueueFullError
+
+    scheduler = BatchScheduler(lambda images: images, max_batch_size=2, max_wait_ms=1, max_queue_depth=1)
+    scheduler.submit("a")
+    with pytest.raises(QueueFullError):
+        scheduler.submit("b")
+
+def test_predict_image_batched(client, monkeypatch):
+    """Test the /predict endpoint with batching enabled."""
+    monkeypatch.setattr(settings, "batching_enabled", True)
+    image_path = create_dummy_image()
+    try:
+        with open(image_path, "rb") as f:
+            response = client.post("/api/v1/predict/", files={"file": (image_path, f, "image/jpeg")})
+    finally:
+        os.remove(image_path)
+
+    assert response.status_code == 200
+    assert len(response.json()["features"]) == 1
+
+    metrics = client.get("/api/v1/predict/metrics").json()
+    assert metrics["batching_enabled"] is True
+    assert metrics["requests"] >= 1
+
+def test_batched_requests_do_not_hold_executor_threads(monkeypatch):
+    """A batch fills up with more concurrent requests than there are executor threads."""
+    import asyncio
+    from app.prediction import services
+    from app.prediction.batching import BatchScheduler
+
+    batch_sizes = []
+    def model_fn(images):
+        batch_sizes.append(len(images))
+        return [MockResult(MockYOLO("dummy")) for _ in images]
+
+    scheduler = BatchScheduler(model_fn, max_batch_size=8, max_wait_ms=500, max_queue_depth=16)
+    monkeypatch.setattr(settings, "batching_enabled", True)
+    monkeypatch.setattr(services, "batch_scheduler", scheduler)
+    image_bytes = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(image_bytes, format="PNG")
+
+    async def predict_all():
+        return await asyncio.gather(*[
+            services.predict_async(io.BytesIO(image_bytes.getvalue()), f"frame_{i}.png") for i in range(8)
+        ])
+
+    try:
+        results = asyncio.run(predict_all())
+    finally:
+        scheduler.stop()
+    assert batch_sizes == [8] and settings.executor_pool_size < 8
+    assert all(len(result) == 1 for result in results)
+
+def test_predict_batch_multipart_and_zip(client, sample_geotiff, create_dummy_image):
+    """Test the /predict/batch endpoint with a multipart list and a zip archive."""
+    import json
+    import zipfile
+
+    image_bytes = create_dummy_image("jpeg", 100, 100)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("frames/frame_2.jpg", image_bytes)
+        zf.writestr("frames/frame_3.jpg", image_bytes)
+        with open(sample_geotiff, "rb") as geotiff:
+            zf.writestr("frames/frame_3.tif", geotiff.read())
+
+    files = [
+        ("files", ("frame_1.jpg", image_bytes, "image/jpeg")),
+        ("archive", ("frames.zip", archive.getvalue(), "application/zip")),
+    ]
+    response = client.post("/api/v1/predict/batch", files=files)
+
+    assert response.status_code == 200
+    assert "application/x-ndjson" in response.headers["content-type"]
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["filename"] for line in lines] == ["frame_1.jpg", "frames/frame_2.jpg", "frames/frame_3.jpg"]
+    assert all(line["type"] == "FeatureCollection" and len(line["features"]) == 1 for line in lines)
+    # Only frame_3 has a matching GeoTIFF, so only its coordinates are geographic
+    assert lines[0]["features"][0]["geometry"]["coordinates"][0][0] == [10, 10]
+    assert lines[2]["features"][0]["geometry"]["coordinates"][0][0] == [20.0, 30.0]
+
+def test_predict_batch_rejects_oversized_zip_member(client, monkeypatch, create_dummy_image):
+    """Zip members are checked against the size limits before they are inflated."""
+    import zipfile
+
+    monkeypatch.setattr(settings, "batch_max_file_bytes", 1024)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("bomb.png", b"\0" * 1_000_000)
+        zf.writestr("frame.jpg", create_dummy_image("jpeg", 10, 10))
+
+    response = client.post("/api/v1/predict/batch", files=[("archive", ("frames.zip", archive.getvalue(), "application/zip"))])
+    assert response.status_code == 413
+    assert "bomb.png" in response.json()["detail"]
+
+def test_predict_batch_rejects_oversized_batch(client, monkeypatch, create_dummy_image):
+    image_bytes = create_dummy_image("jpeg", 100, 100)
+    monkeypatch.setattr(settings, "batch_max_total_bytes", 2 * len(image_bytes))
+    files = [("files", (f"frame_{i}.jpg", image_bytes, "image/jpeg")) for i in range(3)]
+    assert client.post("/api/v1/predict/batch", files=files).status_code == 413
+
+def test_predict_batch_no_images(client):
+    response = client.post("/api/v1/predict/batch", data={})
+    assert response.status_code == 400
+
+def test_predict_batch_rejects_invalid_archive(client):
+    response = client.post("/api/v1/predict/batch", files={"archive": ("images.zip", b"not a zip file", "application/zip")})
+    assert response.status_code == 400
+    assert "images.zip" in response.json()["detail"]
+
+def test_predict_image_rejected_when_executor_full(client, monkeypatch):
+    """Requests beyond the executor's pending limit get a 503 with Retry-After."""
+    monkeypatch.setattr(settings, "executor_max_pending", 0)
+    image_path = create_dummy_image()
+    try:
+        with open(image_path, "rb") as f:
+            response = client.post("/api/v1/predict/", files={"file": (image_path, f, "image/jpeg")})
+    finally:
+        os.remove(image_path)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(settings.retry_after_seconds)
+
+def test_predict_batch_rejected_when_executor_full(client, monkeypatch, create_dummy_image):
+    monkeypatch.setattr(settings, "executor_max_pending", 0)
+    files = [("files", ("frame_1.jpg", create_dummy_image("jpeg", 100, 100), "image/jpeg"))]
+    response = client.post("/api/v1/predict/batch", files=files)
+    assert response.status_code == 503
+
+def test_batch_and_tiled_prediction_use_the_worker_pool(monkeypatch, sample_geotiff):
+    """With the pool enabled, batch images and tiles are pool tasks and no local model is loaded."""
+    from concurrent.futures import Future
+    from app.prediction import services
+
+    submitted = []
+    class FakePoolClient:
+        def submit(self, image):
+            submitted.append(image.size)
+            future = Future()
+            future.set_result(MockResult(MockYOLO("dummy")))
+            return future
+
+    def no_local_model():
+        raise AssertionError("the API process should not load a model")
+
+    monkeypatch.setattr(settings, "inference_pool_enabled", True)
+    monkeypatch.setattr(settings, "tile_size", 64)
+    monkeypatch.setattr(settings, "tile_overlap", 16)
+    monkeypatch.setattr(services, "get_pool_client", lambda: FakePoolClient())
+    monkeypatch.setattr(services, "get_model", no_local_model)
+
+    image_bytes = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(image_bytes, format="PNG")
+    results = list(services.predict_batch([(f"frame_{i}.png", image_bytes.getvalue()) for i in range(3)], batch_size=2))
+    assert [filename for filename, _ in results] == ["frame_0.png", "frame_1.png", "frame_2.png"]
+    assert submitted == [(32, 32)] * 3
+
+    submitted.clear()
+    detections = services.predict_tiled(sample_geotiff, "test.tif")
+    assert len(submitted) == 4
+    assert {d["label"] for d in detections} == {"deer"}
+
+def test_worker_pool_requires_an_authkey(monkeypatch):
+    from app.prediction import worker_pool
+
+    monkeypatch.setattr(settings, "inference_pool_authkey", None)
+    with pytest.raises(RuntimeError, match="INFERENCE_POOL_AUTHKEY"):
+        worker_pool.serve_pool(n_workers=1, model_path="unused.pt")
+    assert worker_pool._task_queue.empty()
+
+    monkeypatch.setattr(settings, "inference_pool_authkey", "secret")
+    assert worker_pool.get_authkey() == b"secret"
+
+def test_worker_pool_cpu_slices():
+    from app.prediction.worker_pool import _cpu_slices
+
+    assert _cpu_slices(2, [0, 1, 2, 3]) == [[0, 1], [2, 3]]
+    assert _cpu_slices(3, [0, 1]) == [[0], [1], [0]]
+
+def test_worker_pool_results_round_trip():
+    """Results packed in a worker are rebuilt with the structure the routers consume."""
+    import numpy as np
+    from app.prediction.worker_pool import _pack_results, _unpack_results
+
+    packed = _pack_results([MockResult(MockYOLO("dummy_model.pt"))])
+    assert packed.shape == (1, 6)
+
+    result = _unpack_results(packed, np.zeros((100, 100, 3), dtype=np.uint8), {0: 'deer'})
+    box = list(result.boxes)[0]
+    assert box.xyxy[0].tolist() == [10, 10, 50, 50]
+    assert result.names[int(box.cls[0].item())] == 'deer'
+    assert box.conf[0].item() == pytest.approx(0.9)
+
+def test_export_model_reuses_cached_export(tmp_path):
+    """An export newer than the weights is reused instead of exporting again."""
+    from app.prediction.services import export_model
+
+    weights = tmp_path / "best.pt"
+    weights.write_bytes(b"weights")
+    exported = tmp_path / "best.onnx"
+    exported.write_bytes(b"onnx")
+    os.utime(weights, (0, 0))
+
+    assert export_model(str(weights), backend="onnx") == str(exported)
+    assert export_model(str(weights), backend="pytorch") == str(weights)
+    with pytest.raises(ValueError):
+        export_model(str(weights), backend="tensorrt")
+
+def test_export_model_has_dynamic_batch(tmp_path, monkeypatch):
+    """Exports keep a dynamic batch axis so batched calls are not split into single images."""
+    from app.prediction import services
+
+    calls = []
+    class ExportingYOLO(MockYOLO):
+        def export(self, **kwargs):
+            calls.append(kwargs)
+            return str(tmp_path / "best.onnx")
+
+    monkeypatch.setattr(services, "YOLO", ExportingYOLO)
+    weights = tmp_path / "best.pt"
+    weights.write_bytes(b"weights")
+
+    services.export_model(str(weights), backend="onnx")
+    assert calls[0]["dynamic"] is True
+    assert calls[0]["batch"] == settings.batch_max_size
+
+def test_quantization_without_onnxruntime_has_install_hint(monkeypatch):
+    import sys
+    from app.prediction.quantization import quantize_onnx_model
+
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    with pytest.raises(ImportError, match="pip install -r requirements.txt"):
+        quantize_onnx_model("model.onnx", "model_int8.onnx", image_paths=["unused.jpg"])
+
+def test_quantization_calibration_reader(tmp_path):
+    """Calibration images are sampled reproducibly and letterboxed to the model input size."""
+    from app.prediction.quantization import CalibrationDataReader, sample_calibration_images
+
+    for i in range(5):
+        Image.new('RGB', (200, 100), color='white').save(tmp_path / f"image{i}.jpg")
+
+    paths = sample_calibration_images(str(tmp_path), n_samples=3)
+    assert len(paths) == 3
+    assert paths == sample_calibration_images(str(tmp_path), n_samples=3)
+
+    reader = CalibrationDataReader(paths, "images", 64)
+    batches = []
+    while (batch := reader.get_next()) is not None:
+        batches.append(batch["images"])
+    assert len(batches) == 3
+    assert batches[0].shape == (1, 3, 64, 64)
+    # The 2:1 image is padded top and bottom with grey
+    assert batches[0][0, 0, 0, 0] == pytest.approx(114 / 255)
+    assert batches[0][0, 0, 32, 32] == pytest.approx(1.0)
+
+def test_ready_after_model_warm_up(client, monkeypatch):
+    from app.prediction import services
+
+    calls = []
+    monkeypatch.setattr(services, "model_ready", threading.Event())
+    monkeypatch.setattr(services, "get_model", lambda: calls.append("load"))
+
+    response = client.get("/ready/")
+    assert response.status_code == 503
+    assert client.get("/health/").status_code == 200
+
+    services.warm_up_model()
+    assert calls == ["load"]
+    response = client.get("/ready/")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+def _write_run(project_dir, run, mtime):
+    weights = project_dir / run / "weights"
+    weights.mkdir(parents=True)
+    (weights / "best.pt").write_bytes(b"weights")
+    os.utime(weights / "best.pt", (mtime, mtime))
+
+def test_model_registry_hot_reload_pin_and_rollback(tmp_path):
+    from app.prediction.registry import ModelRegistry
+
+    _write_run(tmp_path, "exp", 1000)
+    loaded = []
+    registry = ModelRegistry(str(tmp_path), lambda path: loaded.append(path) or path, lambda: "base.pt", poll_interval=0)
+
+    old_model = registry.get_model()
+    assert registry.current_version()["version"] == "exp"
+
+    # New weights are swapped in; a caller holding the old model keeps it
+    _write_run(tmp_path, "exp2", 2000)
+    registry.refresh()
+    assert registry.get_model().endswith(os.path.join("exp2", "weights", "best.pt"))
+    assert old_model.endswith(os.path.join("exp", "weights", "best.pt"))
+
+    registry.rollback()
+    status = registry.status()
+    assert status["current"]["version"] == "exp"
+    assert status["pinned"] == "exp"
+    registry.refresh()
+    assert registry.current_version()["version"] == "exp"
+
+    registry.unpin()
+    assert registry.current_version()["version"] == "exp2"
+    with pytest.raises(KeyError):
+        registry.pin("missing")
+    assert len(loaded) == 4
+
+def test_model_registry_rollback_to_base_stays_pinned(tmp_path):
+    """Rolling back to the base model pins it, so the watcher doesn't swap the trained weights back in."""
+    from app.prediction.registry import ModelRegistry
+
+    registry = ModelRegistry(str(tmp_path), lambda path: path, lambda: "base.pt", poll_interval=0)
+    assert registry.get_model() == "base.pt"
+    _write_run(tmp_path, "exp", 1000)
+    registry.refresh()
+    assert registry.current_version()["version"] == "exp"
+
+    registry.rollback()
+    assert registry.status()["pinned"] == "base"
+    registry.refresh()
+    assert registry.get_model() == "base.pt"
+
+    registry.unpin()
+    assert registry.current_version()["version"] == "exp"
+
+def test_model_registry_endpoints(client, tmp_path, monkeypatch):
+    from app.prediction import services
+    from app.prediction.registry import ModelRegistry
+
+    _write_run(tmp_path, "exp", 1000)
+    _write_run(tmp_path, "exp2", 2000)
+    registry = ModelRegistry(str(tmp_path), MockYOLO, lambda: "base.pt", poll_interval=0)
+    monkeypatch.setattr(services, "registry", registry)
+
+    assert client.post("/api/v1/models/rollback").status_code == 409
+    response = client.post("/api/v1/models/pin", data={"version": "exp"})
+    assert response.status_code == 200
+    response = client.get("/api/v1/models/")
+    assert response.json()["current"]["version"] == "exp"
+    assert [v["version"] for v in response.json()["versions"]] == ["exp", "exp2"]
+    assert client.post("/api/v1/models/pin", data={"version": "nope"}).status_code == 404
+
+def test_get_detections_from_results():
+    """A Results object is converted to arrays once, and filtered by class name in bulk."""
+    import torch
+    from ultralytics.engine.results import Results
+    from app.prediction.postprocessing import get_detections
+
+    boxes = torch.tensor([
+        [0, 0, 10, 20, 0.9, 0],
+        [10, 10, 30, 30, 0.5, 1],
+        [20, 40, 40, 60, 0.7, 0],
+    ])
+    results = [Results(orig_img=np.zeros((100, 100, 3), dtype=np.uint8), path="", names={0: 'deer', 1: 'person'}, boxes=boxes)]
+
+    detections = get_detections(results)
+    assert get_detections(results) is detections
+    assert detections.labels == ['deer', 'person', 'deer']
+
+    deer = detections.filter_label('deer')
+    assert len(deer) == 2
+    np.testing.assert_allclose(deer.centers, [[5, 10], [30, 50]])
+    np.testing.assert_allclose(deer.conf, [0.9, 0.7])
+
+def test_batch_scheduler_created_once_across_threads(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.prediction import services
+
+    services.shutdown_batch_scheduler()
+    created = []
+    original = services.BatchScheduler.__init__
+
+    def slow_init(self, *args, **kwargs):
+        created.append(self)
+        time.sleep(0.05)  # Widen the window in which a second thread could also build one
+        original(self, *args, **kwargs)
+
+    monkeypatch.setattr(services.BatchScheduler, "__init__", slow_init)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            schedulers = list(pool.map(lambda _: services.get_batch_scheduler(), range(8)))
+    finally:
+        services.shutdown_batch_scheduler()
+    assert len(created) == 1
+    assert all(scheduler is created[0] for scheduler in schedulers)
@@ -7,6 +7,8 @@ import cv2
 import numpy as np
 import pandas as pd
 from app.trackways.validation import is_biologically_plausible
+from app.config import settings
+from app.detections.store import write_detections
 
 client = TestClient(app)
 
@@ -15,10 +17,7 @@ def setup_trackways_test_data(tmp_path, monkeypatch):
     """
     Set up dummy data for trackways tests.
     """
-    # Create dummy detections.csv in a temporary directory
-    detections_dir = tmp_path / "detections"
-    detections_dir.mkdir()
-    detections_file = detections_dir / "detections.csv"
+    # Write dummy detections to the detection store
     detections_data = {
         "timestamp": [pd.Timestamp('2025-09-05 10:00:00') + pd.Timedelta(seconds=i) for i in range(5)],
         "filename": ["image1.jpg"] * 5,
@@ -27,10 +26,7 @@ def setup_trackways_test_data(tmp_path, monkeypatch):
         "score": [0.9] * 5,
         "label": ["deer"] * 5,
     }
-    pd.DataFrame(detections_data).to_csv(detections_file, index=False)
-
-    # Monkeypatch the path to the detections file in the trackways service
-    monkeypatch.setattr("app.trackways.services.detections_file", str(detections_file))
+    write_detections(pd.DataFrame(detections_data))
 
     # Create a dummy image for feature extraction test
     tests_data_dir = tmp_path / "tests_data"
@@ -71,6 +67,28 @@ def test_analyze_trackways_endpoint_with_date_filter(setup_trackways_test_data):
     # The analyze_trackways function returns None which gets converted to a message
     assert data["message"] == "No trackways found or an error occurred."
 
+def test_analyze_trackways_cached_until_new_detections(setup_trackways_test_data, monkeypatch):
+    from app.trackways import services
+
+    calls = []
+    original = services._analyze_trackways
+    monkeypatch.setattr(services, "_analyze_trackways", lambda *args: calls.append(args) or original(*args))
+
+    first = services.analyze_trackways("2025-09-05", "2025-09-06")
+    first[0]["length"] = -1  # Callers get their own copy
+    second = services.analyze_trackways("2025-09-05", "2025-09-06")
+    assert len(calls) == 1
+    assert second[0]["length"] > 0
+
+    # Detections outside the range leave the cached result valid, new ones in range invalidate it
+    write_detections(pd.DataFrame({"timestamp": [pd.Timestamp('2025-10-01 10:00:00')], "x_center": [0.0], "y_center": [0.0], "score": [0.9]}))
+    services.analyze_trackways("2025-09-05", "2025-09-06")
+    assert len(calls) == 1
+    write_detections(pd.DataFrame({"timestamp": [pd.Timestamp('2025-09-05 10:00:05')], "x_center": [150.0], "y_center": [150.0], "score": [0.9]}))
+    third = services.analyze_trackways("2025-09-05", "2025-09-06")
+    assert len(calls) == 2
+    assert len(third[0]["points"]) == 6
+
 def test_extract_features_endpoint(setup_trackways_test_data):
     image_path = setup_trackways_test_data
     with open(image_path, "rb") as f:
@@ -133,3 +151,229 @@ def test_is_biologically_plausible_commuting():
     length = np.sqrt(np.diff(trj.x)**2 + np.diff(trj.y)**2).sum()
     speed = pd.Series([5.0] * 9)
     assert is_biologically_plausible(length, speed, trj) is True
+
+def test_result_cache_lru_and_memory_ceiling():
+    from app.caching import ResultCache
+
+    cache = ResultCache(max_entries=2, max_bytes=1000)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get_or_compute("a", lambda: None) == 1
+    cache.put("c", 3)  # Evicts "b", the least recently used
+    assert cache.get_or_compute("b", lambda: "recomputed") == "recomputed"
+
+    cache.put("big", "x" * 2000)  # Larger than the ceiling, never cached
+    assert cache.stats()["bytes"] <= 1000
+    assert cache.get_or_compute("big", lambda: "recomputed") == "recomputed"
+
+def test_incremental_dbscan_matches_batch_dbscan():
+    from sklearn.cluster import DBSCAN
+    from app.trackways.clustering import IncrementalDBSCAN
+
+    rng = np.random.default_rng(0)
+    points = np.vstack([rng.normal(center, 3.0, size=(40, 2)) for center in (0, 40, 100)] + [rng.uniform(-50, 150, size=(40, 2))])
+    rng.shuffle(points)
+
+    dbscan = IncrementalDBSCAN(eps=5.0, min_samples=4)
+    for chunk in np.array_split(points, 7):
+        dbscan.add(chunk)
+
+    expected = DBSCAN(eps=5.0, min_samples=4).fit(points)
+    core = np.zeros(len(points), dtype=bool)
+    core[expected.core_sample_indices_] = True
+    labels = [dbscan.label_of(i) for i in range(len(points))]
+    # Same noise points, and core points are grouped the same way
+    assert [label is None for label in labels] == list(expected.labels_ == -1)
+    pairs = {(labels[i], expected.labels_[i]) for i in np.flatnonzero(core)}
+    assert len(pairs) == len({a for a, _ in pairs}) == len({b for _, b in pairs})
+
+def test_incremental_dbscan_merges_bridged_clusters():
+    from app.trackways.clustering import IncrementalDBSCAN
+
+    dbscan = IncrementalDBSCAN(eps=1.5, min_samples=3)
+    touched, removed = dbscan.add([[0, 0], [1, 0], [2, 0], [10, 0], [11, 0], [12, 0]])
+    assert touched == {0, 1} and removed == set()
+
+    # Points bridging the gap merge the two trackways into the lower label
+    touched, removed = dbscan.add([[3.5, 0], [5, 0], [6.5, 0], [8, 0], [9, 0]])
+    assert touched == {0} and removed == {1}
+    assert dbscan.labels == [0]
+    assert dbscan.members(0) == list(range(11))
+
+def test_analyze_trackways_reanalyzes_only_changed_clusters(setup_trackways_test_data, monkeypatch):
+    from app.trackways import services
+
+    monkeypatch.setattr(settings, "trackway_cache_enabled", False)
+    write_detections(pd.DataFrame({
+        "timestamp": [pd.Timestamp('2025-09-05 11:00:00') + pd.Timedelta(seconds=i) for i in range(5)],
+        "x_center": [1000.0, 1010.0, 1020.0, 1030.0, 1040.0],
+        "y_center": [1000.0, 1010.0, 1020.0, 1030.0, 1040.0],
+        "score": [0.9] * 5,
+    }))
+    analyzed = []
+    original = services._analyze_clusters
+    monkeypatch.setattr(services, "_analyze_clusters", lambda rows, labels: analyzed.extend(np.unique(labels, return_counts=True)[1]) or original(rows, labels))
+    services.trackway_engines.clear()
+
+    assert set(services.analyze_trackways()) == {0, 1}
+    assert sorted(analyzed) == [5, 5]
+
+    # A detection next to the first trackway re-analyzes that one only
+    write_detections(pd.DataFrame({"timestamp": [pd.Timestamp('2025-09-05 10:00:05')], "x_center": [150.0], "y_center": [150.0], "score": [0.9]}))
+    results = services.analyze_trackways()
+    assert sorted(analyzed) == [5, 5, 6]
+    assert len(results[0]["points"]) == 6 and len(results[1]["points"]) == 5
+
+def test_analyze_clusters_matches_per_trackway_metrics():
+    from app.trackways.services import _analyze_clusters
+
+    rng = np.random.default_rng(1)
+    n = 60
+    labels = rng.integers(0, 6, size=n)
+    seconds = rng.permutation(n) * 3
+    # Even clusters walk a straight line, odd ones zig-zag and fail validation
+    zigzag = np.where(labels % 2, 20.0, 0.1) * rng.choice([-1, 1], size=n)
+    rows = pd.DataFrame({
+        "timestamp": pd.Timestamp('2025-09-05') + pd.to_timedelta(seconds, unit="s"),
+        "filename": ["image1.jpg"] * n,
+        "x_center": labels * 1000.0 + seconds,
+        "y_center": labels * 1000.0 + seconds + zigzag,
+        "score": rng.uniform(0.5, 1.0, size=n),
+        "label": ["deer"] * n,
+    })
+    results = _analyze_clusters(rows, labels)
+
+    assert set(results) == set(labels.tolist())
+    assert {label for label, analysis in results.items() if analysis is not None} == {0, 2, 4}
+    for label, analysis in results.items():
+        trj = rows[labels == label].sort_values("timestamp").rename(columns={"x_center": "x", "y_center": "y"})
+        step = np.sqrt(np.diff(trj.x) ** 2 + np.diff(trj.y) ** 2)
+        speed = pd.Series(np.r_[0, step / trj["timestamp"].diff().dt.total_seconds().to_numpy()[1:]])
+        plausible = is_biologically_plausible(step.sum(), speed, trj)
+        assert (analysis is not None) == plausible
+        if analysis is not None:
+            assert analysis["length"] == pytest.approx(step.sum())
+            assert analysis["average_speed"] == pytest.approx(speed.mean())
+            assert analysis["confidence_mean"] == pytest.approx(trj["score"].mean())
+            assert analysis["confidence_std"] == pytest.approx(trj["score"].std())
+            assert [p["time"] for p in analysis["points"]] == trj["timestamp"].tolist()
+
+def test_parallel_trackway_stats_match_serial(monkeypatch):
+    from app.concurrency import shutdown_process_pool
+    from app.trackways.parallel import map_trackway_stats
+
+    rng = np.random.default_rng(2)
+    counts = rng.integers(4, 30, size=12)
+    offsets = np.r_[0, np.cumsum(counts)]
+    x, y, speed = rng.uniform(0, 100, size=(3, offsets[-1]))
+    centroids = rng.uniform(0, 100, size=(len(counts), 2))
+    seeds = np.arange(len(counts)) * 7
+    args = (x, y, speed, offsets, centroids, seeds, "missing_habitat_map.tif")
+
+    serial = map_trackway_stats(*args)
+    monkeypatch.setattr(settings, "trackway_parallel_enabled", True)
+    monkeypatch.setattr(settings, "trackway_parallel_min_trackways", 1)
+    monkeypatch.setattr(settings, "process_pool_size", 2)
+    try:
+        parallel = map_trackway_stats(*args)
+    finally:
+        shutdown_process_pool()
+    assert parallel == serial
+    assert len(serial) == len(counts) and all(stats[1] is not None for stats in serial)
+
+def test_st_dbscan_chunked_matches_batch_dbscan():
+    from sklearn.cluster import DBSCAN
+    from app.trackways.clustering import st_dbscan
+
+    rng = np.random.default_rng(3)
+    xy = np.vstack([rng.normal(center, 2.0, size=(50, 2)) for center in (0, 30, 60)] + [rng.uniform(-20, 80, size=(30, 2))])
+    times = rng.uniform(0, 1000, size=len(xy))
+    expected = DBSCAN(eps=3.0, min_samples=4).fit(xy).labels_
+
+    labels = st_dbscan(xy, 3.0, 4, chunk_size=17)
+    assert list(labels == -1) == list(expected == -1)
+    assert len(set(zip(labels, expected))) == len(set(expected))
+
+    # A temporal radius longer than the whole time span changes nothing, however the chunks fall
+    assert list(st_dbscan(xy, 3.0, 4, times=times, time_eps=2000, chunk_size=17)) == list(labels)
+
+def test_st_dbscan_separates_visits_in_time():
+    from app.trackways.clustering import st_dbscan
+
+    # The same path walked twice, a day apart
+    xy = np.tile(np.column_stack((np.arange(10.0), np.arange(10.0))), (2, 1))
+    times = np.r_[np.arange(10.0), 86400 + np.arange(10.0)]
+    assert len(set(st_dbscan(xy, 2.0, 3))) == 1
+    labels = st_dbscan(xy, 2.0, 3, times=times, time_eps=3600, chunk_size=4)
+    assert list(labels) == [0] * 10 + [1] * 10
+
+def test_analyze_trackways_endpoint_clustering_parameters(setup_trackways_test_data):
+    write_detections(pd.DataFrame({
+        "timestamp": [pd.Timestamp('2025-09-06 10:00:00') + pd.Timedelta(seconds=i) for i in range(5)],
+        "x_center": [100.0, 110.0, 120.0, 130.0, 140.0],
+        "y_center": [100.0, 110.0, 120.0, 130.0, 140.0],
+        "score": [0.9] * 5,
+    }))
+    # Two visits of the same path a day apart are two trackways, unless the temporal radius spans both
+    assert len(client.post("/api/v1/trackways/analyze", json={}).json()) == 2
+    assert len(client.post("/api/v1/trackways/analyze", json={"time_eps": 2 * 86400}).json()) == 1
+    # An explicit null clusters on space only rather than falling back to the settings
+    assert len(client.post("/api/v1/trackways/analyze", json={"time_eps": None}).json()) == 1
+    assert client.post("/api/v1/trackways/analyze", json={"eps": -1}).status_code == 422
+
+def test_incremental_dbscan_bulk_load_matches_point_insertion():
+    from app.trackways.clustering import IncrementalDBSCAN
+
+    rng = np.random.default_rng(4)
+    points = np.vstack([rng.normal(center, 3.0, size=(60, 2)) for center in (0, 40, 100)] + [rng.uniform(-50, 150, size=(60, 2))])
+    times = np.sort(rng.uniform(0, 500, size=len(points)))
+    bulk, single = IncrementalDBSCAN(5.0, 4, time_eps=100), IncrementalDBSCAN(5.0, 4, time_eps=100)
+    bulk.add(points[:150], times[:150])
+    for i in range(150):
+        single.add(points[i:i + 1], times[i:i + 1])
+    # Both keep the same state through later incremental batches
+    bulk.add(points[150:], times[150:])
+    single.add(points[150:], times[150:])
+
+    assert bulk._counts == single._counts and bulk._core == single._core
+    labels = [bulk.label_of(i) for i in range(len(points))]
+    expected = [single.label_of(i) for i in range(len(points))]
+    assert [label is None for label in labels] == [label is None for label in expected]
+    pairs = {(labels[i], expected[i]) for i in np.flatnonzero(bulk._core)}
+    assert len(pairs) == len({a for a, _ in pairs}) == len({b for _, b in pairs}) == len(bulk.labels)
+
+def test_trackway_engines_bounded_by_memory():
+    from app.trackways.engine import TrackwayEngines
+
+    class Engine:
+        def __init__(self, nbytes):
+            self.nbytes = nbytes
+
+        def update(self, context=None):
+            return {}
+
+    engines = TrackwayEngines(max_engines=10, max_bytes=1000)
+    for key in "abc":
+        engines.update(key, lambda: Engine(400))
+    # "a", the least recently used, is dropped to stay under the memory ceiling
+    fresh = Engine(0)
+    assert engines.get("a", lambda: fresh) is fresh
+
+    engines.clear()
+    big = Engine(2000)
+    engines.update("big", lambda: big)  # Larger than the ceiling, not kept
+    assert engines.get("big", lambda: Engine(0)) is not big
+
+def test_analyze_trackways_bulk_load_uses_chunked_st_dbscan(setup_trackways_test_data, monkeypatch):
+    from app.trackways import clustering, services
+
+    calls = []
+    original = clustering._st_dbscan
+    monkeypatch.setattr(clustering, "_st_dbscan", lambda *args: calls.append(args[-2:]) or original(*args))
+    monkeypatch.setattr(settings, "trackway_cache_enabled", False)
+    monkeypatch.setattr(settings, "trackway_cluster_chunk_size", 3)
+    monkeypatch.setattr(settings, "trackway_cluster_n_jobs", 2)
+    services.trackway_engines.clear()
+
+    assert len(services.analyze_trackways()) == 1
+    assert calls == [(3, 2)]
@@ -48,3 +48,16 @@ def test_calculate_morans_i_random(gdf_random):
     # For a random pattern, Moran's I should be close to -1/(n-1)
     expected_morans_i = -1 / (len(gdf_random) - 1)
     assert np.isclose(morans_i, expected_morans_i, atol=0.1)
+
+def test_calculate_morans_i_seed_is_thread_safe(gdf_random):
+    """Seeded p-values are reproducible across threads and leave the global generator alone."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    expected = calculate_morans_i(gdf_random, 'value', seed=7)
+    np.random.seed(0)
+    state = np.random.get_state()[1].copy()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: calculate_morans_i(gdf_random, 'value', seed=7), range(8)))
+    assert results == [expected] * 8
+    assert 0 < expected[1] <= 1
+    assert (np.random.get_state()[1] == state).all()